@@ -1,20 +1,55 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import bisect
+import math
+import os
 import subprocess
+import sys
 import json
-import re
 from kubernetes import client, config
 from flask_cors import CORS
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common import instrumentation, podman_stats
+from common.informer import Informer, by_namespace, by_node_name, by_owner_uid
+
+from cache import TTLCache
+from metrics import MetricsSampler
+from stream import StreamHub, format_event
+
 app = Flask(__name__)
 
 # Enable CORS
 CORS(app)
+instrumentation.instrument_flask(app, 'dashboard')
 
 # Initialize Kubernetes clients
 config.load_kube_config()  # Assumes kubeconfig is set up locally
 v1 = client.CoreV1Api()
 apps_v1 = client.AppsV1Api()
 
+# Watch-backed caches so handlers answer from memory instead of listing on every request
+node_informer = Informer('nodes', v1.list_node)
+pod_informer = Informer('pods', v1.list_pod_for_all_namespaces, indexers={
+    'node': by_node_name,
+    'namespace': by_namespace,
+    'owner': by_owner_uid,
+})
+replicaset_informer = Informer('replicasets', apps_v1.list_replica_set_for_all_namespaces, indexers={
+    'namespace': by_namespace,
+    'owner': by_owner_uid,
+})
+deployment_informer = Informer('deployments', apps_v1.list_deployment_for_all_namespaces, indexers={
+    'namespace': by_namespace,
+})
+informers = [node_informer, pod_informer, replicaset_informer, deployment_informer]
+informer_objects = instrumentation.gauge('informer_objects', 'Objects held in each informer cache', ('informer',))
+for informer in informers:
+    informer_objects.labels(informer.name).set_function(informer.size)
+
+MB = 1000 * 1000  # memory_*_mb fields use the same decimal megabytes podman prints
+
 def get_minikube_status():
     """Get Minikube status using subprocess"""
     try:
@@ -31,64 +66,49 @@ def get_minikube_status():
     except json.JSONDecodeError:
         return {"error": "Failed to parse minikube status: Invalid JSON"}
 
+def node_summary(node):
+    return {
+        "name": node.metadata.name,
+        "status": [condition.type for condition in (node.status and node.status.conditions) or [] if condition.status == "True"]
+    }
+
+def pod_summary(pod):
+    return {
+        "name": pod.metadata.name,
+        "namespace": pod.metadata.namespace,
+        "status": pod.status.phase if pod.status else None,
+        "node_name": pod.spec.node_name if pod.spec else None
+    }
+
 def get_kubernetes_nodes():
     """Get Kubernetes nodes"""
     try:
-        nodes = v1.list_node()
-        return [{
-            "name": node.metadata.name,
-            "status": [condition.type for condition in node.status.conditions if condition.status == "True"]
-        } for node in nodes.items]
+        nodes = sorted(node_informer.list(), key=lambda node: node.metadata.name)
+        return [node_summary(node) for node in nodes]
     except Exception as e:
         return {"error": "Failed to get Kubernetes nodes", "details": str(e)}
 
-def parse_mem_usage(mem_usage_str):
-    """Parses '412.8MB / 2.042GB' => (used_MB, total_MB)"""
-    used_str, total_str = mem_usage_str.split(' / ')
-
-    def convert_to_mb(mem_str):
-        if 'GB' in mem_str:
-            return float(mem_str.replace('GB', '').strip()) * 1024
-        elif 'MB' in mem_str:
-            return float(mem_str.replace('MB', '').strip())
-        elif 'kB' in mem_str:
-            return float(mem_str.replace('kB', '').strip()) / 1024
-        else:
-            return 0
-
-    used_mb = convert_to_mb(used_str)
-    total_mb = convert_to_mb(total_str)
-    return used_mb, total_mb
-
 def get_podman_stats():
-    """Parse podman stats plain text output"""
+    """Per-node CPU and memory from podman stats, parsed by the shared columnar parser"""
     try:
-        result = subprocess.run(['podman', 'stats', '--no-stream'], capture_output=True, text=True, check=True)
-        
-        lines = result.stdout.strip().split('\n')
-        if len(lines) < 2:
+        stats = podman_stats.collect()
+        if not len(stats):
             return {"error": "No stats returned from podman"}
 
-        headers = re.split(r'\s{2,}', lines[0])
+        used_mb = stats.mem_used_bytes / MB
+        total_mb = stats.mem_limit_bytes / MB
         parsed_stats = {}
-
-        for line in lines[1:]:
-            cols = re.split(r'\s{2,}', line)
-            data = dict(zip(headers, cols))
-            node_name = data.get('NAME', '')
-
-            cpu_percent = float(data['CPU %'].replace('%', '').strip())
-            cpu_time = data.get('CPU TIME', '')
-
-            mem_used_mb, mem_total_mb = parse_mem_usage(data['MEM USAGE / LIMIT'])
-            mem_percent = float(data['MEM %'].replace('%', '').strip())
-
+        for i, node_name in enumerate(stats.names):
+            values = (stats.cpu_percent[i], used_mb[i], total_mb[i], stats.mem_percent[i])
+            if any(math.isnan(value) for value in values):
+                print(f"Skipping podman stats for {node_name}: container stopped or unparseable values")
+                continue
             parsed_stats[node_name] = {
-                'cpu': cpu_percent,
-                'cpu_time': cpu_time,
-                'memory_used_mb': mem_used_mb,
-                'memory_total_mb': mem_total_mb,
-                'memory_percent': mem_percent
+                'cpu': float(stats.cpu_percent[i]),
+                'cpu_time': stats.cpu_time[i],
+                'memory_used_mb': round(float(used_mb[i]), 3),
+                'memory_total_mb': round(float(total_mb[i]), 3),
+                'memory_percent': float(stats.mem_percent[i])
             }
 
         return parsed_stats
@@ -98,6 +118,25 @@ def get_podman_stats():
     except Exception as e:
         return {"error": "Unexpected error parsing podman stats", "details": str(e)}
 
+# Each slow collector is cached with its own TTL; /api/nodes runs them concurrently on a bounded pool
+minikube_status_cache = TTLCache('minikube status', get_minikube_status, ttl=float(os.environ.get('MINIKUBE_STATUS_TTL', '10')))
+podman_stats_cache = TTLCache('podman stats', get_podman_stats, ttl=float(os.environ.get('PODMAN_STATS_TTL', '5')))
+collector_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='collector')
+
+# Background podman sampler keeping per-node CPU/memory history for the last hour
+metrics_sampler = MetricsSampler(
+    get_podman_stats,
+    interval=float(os.environ.get('METRICS_SAMPLE_INTERVAL', '5')),
+    history_seconds=float(os.environ.get('METRICS_HISTORY_SECONDS', '3600')),
+)
+
+def get_latest_podman_stats():
+    """Latest sampler reading if there is one, otherwise a (cached) podman call"""
+    stats, age = metrics_sampler.latest()
+    if stats is None:
+        return podman_stats_cache.get()
+    return stats, age
+
 @app.route('/')
 def home():
     return "Welcome to the Flask Kubernetes API!"
@@ -105,14 +144,139 @@ def home():
 @app.route('/api/nodes', methods=['GET'])
 def get_nodes_info():
     """Get information about nodes in the cluster"""
-    minikube_status = get_minikube_status()
-    kubernetes_nodes = get_kubernetes_nodes()
-    podman_stats = get_podman_stats()
+    minikube_status = collector_pool.submit(minikube_status_cache.get)
+    podman_stats = collector_pool.submit(get_latest_podman_stats)
+    kubernetes_nodes = get_kubernetes_nodes()  # served from the node informer, no collector needed
+
+    minikube_status, minikube_status_age = minikube_status.result()
+    podman_stats, podman_stats_age = podman_stats.result()
+    nodes_age = node_informer.age()  # grows while the node watch is disconnected
 
     return jsonify({
         "minikube_status": minikube_status,
         "nodes": kubernetes_nodes,
-        "metrics": podman_stats
+        "metrics": podman_stats,
+        # Seconds since each section was collected, so the UI can flag stale data
+        "age_seconds": {
+            "minikube_status": round(minikube_status_age, 3),
+            "nodes": round(nodes_age, 3) if nodes_age is not None else None,
+            "metrics": round(podman_stats_age, 3)
+        }
+    })
+
+# Live push stream: informer and sampler changes are fanned out to every /api/stream client
+stream_hub = StreamHub(max_pending=int(os.environ.get('STREAM_MAX_PENDING', '1000')))
+instrumentation.gauge('stream_clients', 'Connected /api/stream clients').set_function(stream_hub.client_count)
+instrumentation.QUEUE_DEPTH.labels('stream').set_function(stream_hub.pending_count)
+
+def on_node_event(event_type, old, new):
+    """Publish node additions, removals and condition changes"""
+    if event_type == 'DELETED':
+        stream_hub.publish('node', f"node/{old.metadata.name}", dict(node_summary(old), type=event_type))
+        return
+    summary = node_summary(new)
+    if old is not None and node_summary(old) == summary:
+        return
+    stream_hub.publish('node', f"node/{new.metadata.name}", dict(summary, type=event_type))
+
+def on_pod_event(event_type, old, new):
+    """Publish pod additions, removals and phase transitions"""
+    if event_type == 'DELETED':
+        summary = pod_summary(old)
+    else:
+        summary = pod_summary(new)
+        if old is not None and pod_summary(old) == summary:
+            return
+    stream_hub.publish('pod', f"pod/{summary['namespace']}/{summary['name']}", dict(summary, type=event_type))
+
+def on_metrics_sample(stats, timestamp):
+    """Publish each node's newest CPU/memory sample"""
+    for node_name, values in stats.items():
+        stream_hub.publish('metrics', f"metrics/{node_name}", dict(values, node=node_name, timestamp=timestamp))
+
+node_informer.add_handler(on_node_event)
+pod_informer.add_handler(on_pod_event)
+metrics_sampler.add_handler(on_metrics_sample)
+
+def history_params():
+    """Read the window (seconds) and bucket count for a history query"""
+    window = float(request.args.get('window', 3600))
+    buckets = int(request.args.get('buckets', 120))
+    if window <= 0 or buckets <= 0:
+        raise ValueError("window and buckets must be positive")
+    return window, min(buckets, 1000)
+
+@app.route('/api/metrics/history', methods=['GET'])
+def get_metrics_history():
+    """Downsampled CPU/memory history (min/max/avg per bucket) for every node"""
+    try:
+        window, buckets = history_params()
+    except ValueError as e:
+        return jsonify({"error": "Invalid history parameters", "details": str(e)}), 400
+
+    return jsonify({
+        "nodes": [metrics_sampler.history(node_name, window, buckets) for node_name in metrics_sampler.nodes()]
+    })
+
+@app.route('/api/metrics/history/<node_name>', methods=['GET'])
+def get_node_metrics_history(node_name):
+    """Downsampled CPU/memory history (min/max/avg per bucket) for one node"""
+    try:
+        window, buckets = history_params()
+    except ValueError as e:
+        return jsonify({"error": "Invalid history parameters", "details": str(e)}), 400
+
+    history = metrics_sampler.history(node_name, window, buckets)
+    if history is None:
+        return jsonify({"error": f"No metrics recorded for node '{node_name}'"}), 404
+    return jsonify(history)
+
+@app.route('/api/stream', methods=['GET'])
+def stream_updates():
+    """Server-Sent Events: a snapshot of nodes, pods and metrics, then only the changes"""
+    node_name = request.args.get('node')  # Optionally only follow pods on one node
+    keepalive = float(os.environ.get('STREAM_KEEPALIVE', '15'))
+
+    def snapshot():
+        if node_name:
+            pods = pod_informer.by_index('node', node_name)
+        else:
+            pods = pod_informer.list()
+        metrics, _ = metrics_sampler.latest()
+        return {
+            "nodes": get_kubernetes_nodes(),
+            "pods": [pod_summary(pod) for pod in sorted(pods, key=lambda pod: (pod.metadata.namespace, pod.metadata.name))],
+            "metrics": metrics or {}
+        }
+
+    def wanted(event, data):
+        return not node_name or event != 'pod' or data["node_name"] == node_name
+
+    def generate():
+        stream_client = None
+        try:
+            # Subscribe only once the response is iterated (an unstarted generator never reaches
+            # `finally`), and before taking the snapshot so no change falls between the two
+            stream_client = stream_hub.subscribe()
+            yield format_event('snapshot', snapshot())
+            while True:
+                resync, updates = stream_client.take(timeout=keepalive)
+                if resync:
+                    # This client fell too far behind; replace its backlog with fresh state
+                    yield format_event('snapshot', snapshot())
+                elif updates:
+                    chunk = "".join(format_event(event, data) for event, data in updates if wanted(event, data))
+                    if chunk:
+                        yield chunk
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            if stream_client is not None:
+                stream_hub.unsubscribe(stream_client)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
     })
 
 @app.route('/api/pods', methods=['GET'])
@@ -124,16 +288,11 @@ def get_pods_by_node():
         return jsonify({"error": "Node name is required"}), 400
 
     try:
-        pods = v1.list_pod_for_all_namespaces(field_selector=f"spec.nodeName={node_name}")
+        pods = pod_informer.by_index('node', node_name)
         pod_info = []
 
-        for pod in pods.items:
-            pod_info.append({
-                "name": pod.metadata.name,
-                "namespace": pod.metadata.namespace,
-                "status": pod.status.phase,
-                "node_name": pod.spec.node_name
-            })
+        for pod in sorted(pods, key=lambda pod: (pod.metadata.namespace, pod.metadata.name)):
+            pod_info.append(pod_summary(pod))
 
         return jsonify({"pods": pod_info})
 
@@ -143,11 +302,12 @@ def get_pods_by_node():
 @app.route('/api/deployments', methods=['GET'])
 def get_deployments():
     """Get deployments and their associated pods (just names)"""
+    namespace = request.args.get('namespace', 'default')
     deployments_info = []
     try:
-        deployments = apps_v1.list_namespaced_deployment(namespace='default')
+        deployments = deployment_informer.by_index('namespace', namespace)
 
-        for deployment in deployments.items:
+        for deployment in sorted(deployments, key=lambda deployment: deployment.metadata.name):
             deployments_info.append({
                 "name": deployment.metadata.name
             })
@@ -156,42 +316,57 @@ def get_deployments():
 
     return jsonify(deployments_info)
 
+def encode_continue(last_name):
+    return base64.urlsafe_b64encode(json.dumps({"after": last_name}).encode()).decode()
+
+def decode_continue(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))["after"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid continue token")
+
 @app.route('/api/deployments/<deployment_name>/pods', methods=['GET'])
 def get_pods_by_deployment(deployment_name):
-    """Return pods belonging to a specific deployment"""
+    """Return pods belonging to a specific deployment, optionally paginated with limit/continue"""
+    namespace = request.args.get('namespace', 'default')
     try:
-        # Find the deployment
-        deployment = apps_v1.read_namespaced_deployment(name=deployment_name, namespace='default')
-
-        # Get ReplicaSets owned by the deployment
-        replicasets = apps_v1.list_namespaced_replica_set(
-            namespace='default',
-            label_selector=",".join([f"{k}={v}" for k, v in deployment.spec.selector.match_labels.items()])
-        )
+        limit = request.args.get('limit', type=int)
+        after = decode_continue(request.args['continue']) if 'continue' in request.args else None
+        if limit is not None and limit <= 0:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
 
-        pod_info = []
-        for rs in replicasets.items:
-            # Get pods owned by each replicaset
-            pods = v1.list_namespaced_pod(
-                namespace='default',
-                label_selector=",".join([f"{k}={v}" for k, v in rs.spec.selector.match_labels.items()])
-            )
-            for pod in pods.items:
-                for owner in pod.metadata.owner_references or []:
-                    if owner.kind == "ReplicaSet" and owner.name == rs.metadata.name:
-                        pod_info.append({
-                            "name": pod.metadata.name,
-                            "namespace": pod.metadata.namespace,
-                            "status": pod.status.phase,
-                            "node_name": pod.spec.node_name
-                        })
-
-        return jsonify({"pods": pod_info})
+    try:
+        deployment = deployment_informer.get(f"{namespace}/{deployment_name}")
+        if deployment is None:
+            return jsonify({"error": f"Deployment '{deployment_name}' not found"}), 404
+
+        # Deployment -> ReplicaSets -> Pods through the informers' owner indexes, no apiserver calls
+        pods = []
+        for rs in replicaset_informer.by_index('owner', deployment.metadata.uid):
+            pods.extend(pod_informer.by_index('owner', rs.metadata.uid))
+        pods.sort(key=lambda pod: pod.metadata.name)
+
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right([pod.metadata.name for pod in pods], after)
+        page = pods[start:start + limit] if limit else pods[start:]
+
+        response = {"pods": [pod_summary(pod) for pod in page]}
+        if limit and start + limit < len(pods):
+            response["continue"] = encode_continue(page[-1].metadata.name)
+        return jsonify(response)
 
-    except client.exceptions.ApiException as e:
-        return jsonify({"error": f"Deployment '{deployment_name}' not found", "details": str(e)}), 404
     except Exception as e:
         return jsonify({"error": "Failed to fetch pods for deployment", "details": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    instrumentation.instrument_kubernetes()
+    instrumentation.instrument_subprocess()
+    instrumentation.serve(9104)
+    for informer in informers:
+        informer.start()
+    metrics_sampler.start()
+    # The reloader would run a second copy of this module, doubling the watches
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5001)
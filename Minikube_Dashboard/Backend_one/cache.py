@@ -0,0 +1,54 @@
+import threading
+import time
+
+from common.instrumentation import CACHE_REQUESTS
+
+
+class TTLCache:
+    """Caches the result of one slow collector for `ttl` seconds.
+
+    Refreshes are single-flight: when the value is stale, the first caller runs
+    the collector and every concurrent caller waits for that same run instead of
+    starting its own, so N simultaneous requests cost at most one call.
+    """
+
+    def __init__(self, name, func, ttl):
+        self.name = name
+        self.func = func
+        self.ttl = ttl
+        self._value = None
+        self._updated = None
+        self._inflight = None
+        self._lock = threading.Lock()
+        self._hits = CACHE_REQUESTS.labels(name, 'hit')
+        self._misses = CACHE_REQUESTS.labels(name, 'miss')
+        self._waits = CACHE_REQUESTS.labels(name, 'coalesced')
+
+    def get(self):
+        """Return (value, age_seconds), refreshing the value if it has expired"""
+        with self._lock:
+            if self._updated is not None and time.monotonic() - self._updated < self.ttl:
+                self._hits.inc()
+                return self._value, time.monotonic() - self._updated
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = threading.Event()
+
+        if not leader:
+            self._waits.inc()
+            inflight.wait()
+            with self._lock:
+                return self._value, time.monotonic() - self._updated
+
+        self._misses.inc()
+        try:
+            value = self.func()
+        except Exception as e:
+            value = {"error": f"Failed to collect {self.name}", "details": str(e)}
+        with self._lock:
+            self._value = value
+            self._updated = time.monotonic()
+            self._inflight = None
+        inflight.set()
+        return value, 0.0
@@ -0,0 +1,156 @@
+import threading
+import time
+from array import array
+
+from common.instrumentation import LoopTimer
+
+# Per-node series kept for each sample
+METRIC_FIELDS = ('cpu', 'memory_used_mb', 'memory_percent')
+
+
+class RingBuffer:
+    """Fixed-capacity time series stored in preallocated arrays, one per field.
+
+    Appending overwrites the oldest sample once the buffer is full, so memory use
+    is constant no matter how long the sampler runs.
+    """
+
+    def __init__(self, capacity, fields=METRIC_FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in fields}
+        self.size = 0
+        self.head = 0  # next slot to write
+
+    def append(self, timestamp, values):
+        self.times[self.head] = timestamp
+        for field in self.fields:
+            self.columns[field][self.head] = values.get(field, 0.0)
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def samples(self, since):
+        """Yield (timestamp, {field: value}) for samples newer than `since`, oldest first"""
+        start = (self.head - self.size) % self.capacity
+        for i in range(self.size):
+            slot = (start + i) % self.capacity
+            if self.times[slot] >= since:
+                yield self.times[slot], {field: self.columns[field][slot] for field in self.fields}
+
+
+def downsample(samples, since, bucket_seconds, fields=METRIC_FIELDS):
+    """Collapse samples into fixed-width buckets holding min/max/avg per field"""
+    buckets = {}
+    for timestamp, values in samples:
+        index = int((timestamp - since) // bucket_seconds)
+        bucket = buckets.get(index)
+        if bucket is None:
+            bucket = buckets[index] = {field: [values[field], values[field], 0.0] for field in fields}
+            bucket['count'] = 0
+        bucket['count'] += 1
+        for field in fields:
+            stats = bucket[field]
+            value = values[field]
+            stats[0] = min(stats[0], value)
+            stats[1] = max(stats[1], value)
+            stats[2] += value
+
+    result = []
+    for index in sorted(buckets):
+        bucket = buckets[index]
+        start = since + index * bucket_seconds
+        entry = {"start": round(start, 3), "end": round(start + bucket_seconds, 3), "count": bucket['count']}
+        for field in fields:
+            low, high, total = bucket[field]
+            entry[field] = {"min": low, "max": high, "avg": round(total / bucket['count'], 3)}
+        result.append(entry)
+    return result
+
+
+class MetricsSampler:
+    """Polls node stats at a fixed cadence into per-node ring buffers.
+
+    `collect` returns {node_name: {'cpu': ..., 'memory_used_mb': ..., ...}} or a
+    dict with an "error" key, like get_podman_stats(). Handlers registered with
+    `add_handler()` are called as handler(stats, timestamp) after every sample.
+    """
+
+    def __init__(self, collect, interval=5.0, history_seconds=3600):
+        self.collect = collect
+        self.interval = interval
+        self.capacity = max(1, int(history_seconds / interval))
+        self._buffers = {}
+        self._latest = None
+        self._latest_time = None
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def add_handler(self, handler):
+        self._handlers.append(handler)
+
+    def latest(self):
+        """Return (stats, age_seconds) of the most recent successful sample, or (None, None)"""
+        with self._lock:
+            if self._latest_time is None:
+                return None, None
+            return self._latest, time.time() - self._latest_time
+
+    def nodes(self):
+        with self._lock:
+            return sorted(self._buffers)
+
+    def history(self, node_name, window, buckets):
+        """Downsampled history of one node over the last `window` seconds, or None for unknown nodes"""
+        since = time.time() - window
+        bucket_seconds = max(window / buckets, self.interval)
+        with self._lock:
+            buffer = self._buffers.get(node_name)
+            if buffer is None:
+                return None
+            samples = list(buffer.samples(since))
+        return {
+            "node": node_name,
+            "window_seconds": window,
+            "bucket_seconds": bucket_seconds,
+            "buckets": downsample(samples, since, bucket_seconds),
+        }
+
+    def sample(self):
+        stats = self.collect()
+        if not isinstance(stats, dict) or "error" in stats:
+            print(f"Skipping metrics sample: {stats}")
+            return
+        now = time.time()
+        with self._lock:
+            for node_name, values in stats.items():
+                buffer = self._buffers.get(node_name)
+                if buffer is None:
+                    buffer = self._buffers[node_name] = RingBuffer(self.capacity)
+                buffer.append(now, values)
+            self._latest = stats
+            self._latest_time = now
+        for handler in self._handlers:
+            handler(stats, now)
+
+    def _run(self):
+        loop = LoopTimer('metrics_sampler', self.interval)
+        next_run = time.monotonic()
+        while not self._stopped.is_set():
+            with loop.cycle():
+                try:
+                    self.sample()
+                except Exception as e:
+                    print(f"Metrics sample failed: {e}")
+            next_run = max(next_run + self.interval, time.monotonic())
+            self._stopped.wait(max(0.0, next_run - time.monotonic()))
@@ -0,0 +1,90 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class StreamClient:
+    """Pending updates for one connected client, coalesced by key.
+
+    A newer update for a key that is still waiting to be sent replaces the older
+    one, so a slow client only ever receives the latest state of each object.
+    If more than `max_pending` distinct keys pile up, the backlog is dropped and
+    the client is told to resync from a fresh snapshot instead.
+    """
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._resync = False
+        self._cond = threading.Condition()
+
+    def offer(self, event, key, data):
+        with self._cond:
+            if self._resync:
+                return
+            if key in self._pending:
+                self._pending[key] = (event, data)
+            elif len(self._pending) >= self.max_pending:
+                self._pending.clear()
+                self._resync = True
+            else:
+                self._pending[key] = (event, data)
+            self._cond.notify()
+
+    def take(self, timeout):
+        """Wait up to `timeout` seconds and return (resync, [(event, data), ...])"""
+        with self._cond:
+            if not self._pending and not self._resync:
+                self._cond.wait(timeout)
+            resync = self._resync
+            updates = list(self._pending.values())
+            self._pending.clear()
+            self._resync = False
+        return resync, updates
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+
+class StreamHub:
+    """Fans state changes out to every connected Server-Sent Events client.
+
+    `publish()` never blocks on a client: it only drops the update into each
+    client's coalescing buffer, so one slow browser cannot stall the producers.
+    """
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        client = StreamClient(self.max_pending)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def pending_count(self):
+        """Updates waiting to be sent, summed over all clients"""
+        with self._lock:
+            clients = list(self._clients)
+        return sum(client.pending_count() for client in clients)
+
+    def publish(self, event, key, data):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.offer(event, key, data)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -1,32 +1,104 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import json
 import os
 
+from vote_service import (
+    BatchTooLarge, batch_summary, validate_batch, validate_vote, vote_store, vote_tally, vote_writer,
+)
+from vote_store import DUPLICATE
+from vote_writer import WriterOverloaded, overloaded_message
+from common import instrumentation
+
 app = Flask(__name__)
 CORS(app)
+instrumentation.instrument_flask(app, 'vote')
 
-vote_file_path = '/mnt/data/votes/votes.txt'  # Write inside the mounted PVC
-
-# Ensure the file exists on startup
-if not os.path.exists(vote_file_path):
-    open(vote_file_path, 'a').close()
+def read_batch_votes():
+    """Yield vote payloads from a JSON array body or a streamed NDJSON body"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            raise ValueError("Expected a JSON array of votes")
+        yield from data
 
 @app.route('/vote', methods=['POST'])
 def vote():
     data = request.get_json()
-    choice = data.get('choice')
-    name = data.get('name')
+    error = validate_vote(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    if choice not in ['Choice 1', 'Choice 2']:
-        return jsonify({"error": "Invalid choice"}), 400
+    choice = data['choice']
+    name = data['name']
 
-    if not name or name.strip() == '':
-        return jsonify({"error": "Name is required"}), 400
+    try:
+        status, _ = vote_writer.write(name, choice)
+    except WriterOverloaded as e:
+        return jsonify({"error": overloaded_message(e)}), 503
 
-    with open(vote_file_path, 'a') as file:
-        file.write(f"{name} voted for {choice}\n")
+    if status == DUPLICATE:
+        return jsonify({"error": f"{name} has already voted"}), 409
 
     return jsonify({"message": f"Vote for {choice} by {name} recorded!"})
 
+@app.route('/votes/batch', methods=['POST'])
+def vote_batch():
+    """Record many votes at once; every vote gets its own accepted/rejected result"""
+    try:
+        results, votes, vote_indexes = validate_batch(read_batch_votes())
+    except BatchTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    statuses = []
+    if votes:
+        try:
+            statuses = vote_writer.write_many(votes)
+        except WriterOverloaded as e:
+            return jsonify({"error": overloaded_message(e)}), 503
+
+    return jsonify(batch_summary(results, votes, vote_indexes, statuses))
+
+@app.route('/results', methods=['GET'])
+def results():
+    counts, total = vote_tally.results()
+    return jsonify({"results": counts, "total": total})
+
+@app.route('/voters/<name>', methods=['GET'])
+def get_voter(name):
+    if vote_store is None:
+        return jsonify({"error": "Voter lookup requires VOTE_STORAGE=segmented"}), 501
+
+    voter = vote_store.lookup(name)
+    if voter is None:
+        return jsonify({"error": f"{name} has not voted"}), 404
+    return jsonify(voter)
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=80)
+    port = int(os.environ.get('VOTE_PORT', '80'))
+    instrumentation.serve(9105)
+    # VOTE_SERVER picks the serving mode: 'wsgi' (Flask dev server) or 'asgi' (uvicorn + asgi_app.py)
+    if os.environ.get('VOTE_SERVER', 'wsgi') == 'asgi':
+        import uvicorn
+        from asgi_app import app as asgi_app
+
+        uvicorn.run(
+            asgi_app,
+            host='0.0.0.0',
+            port=port,
+            backlog=int(os.environ.get('VOTE_BACKLOG', '4096')),
+            timeout_keep_alive=int(os.environ.get('VOTE_KEEPALIVE_TIMEOUT', '75')),
+        )
+    else:
+        # The reloader would import this module twice and open the vote log from two processes
+        app.run(debug=True, use_reloader=False, host='0.0.0.0', port=port)
@@ -0,0 +1,198 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import vote_service
+from vote_store import DUPLICATE
+from vote_writer import WriterOverloaded, overloaded_message
+from common import instrumentation
+
+# Blocking reads that remain in the request path (voter index lookups) run here;
+# writes never touch the event loop because they go through the vote writer thread
+io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='vote-io')
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def app(scope, receive, send):
+    """ASGI entry point serving the same contract as the Flask app in app.py"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    path = scope['path']
+    headers = dict(scope['headers'])
+
+    if method == 'OPTIONS':
+        await preflight(send, headers)
+        return
+
+    try:
+        if path == '/vote' and method == 'POST':
+            status, body = await vote(receive)
+        elif path == '/votes/batch' and method == 'POST':
+            status, body = await vote_batch(receive, headers)
+        elif path == '/results' and method == 'GET':
+            status, body = results()
+        elif path.startswith('/voters/') and method == 'GET':
+            status, body = await get_voter(unquote(path[len('/voters/'):]))
+        else:
+            status, body = 404, {"error": "Not found"}
+    except HTTPError as e:
+        status, body = e.status, {"error": str(e)}
+
+    await respond(send, status, body)
+
+
+def route(path):
+    return '/voters/{name}' if path.startswith('/voters/') else path
+
+
+app = instrumentation.instrument_asgi(app, 'vote', route)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_running_loop().run_in_executor(io_executor, vote_service.shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def vote(receive):
+    data = parse_json(await read_body(receive))
+    error = vote_service.validate_vote(data)
+    if error:
+        return 400, {"error": error}
+
+    choice = data['choice']
+    name = data['name']
+
+    status, _ = (await submit([(name, choice)], timeout=5.0))[0]
+    if status == DUPLICATE:
+        return 409, {"error": f"{name} has already voted"}
+
+    return 200, {"message": f"Vote for {choice} by {name} recorded!"}
+
+
+async def vote_batch(receive, headers):
+    content_type = headers.get(b'content-type', b'').split(b';')[0].strip()
+    try:
+        if content_type in (b'application/x-ndjson', b'application/jsonl'):
+            # Validated while streaming: reading stops at the first vote over the limit
+            results, votes, vote_indexes = await vote_service.validate_batch_async(read_ndjson(receive))
+        else:
+            payloads = parse_json(await read_body(receive))
+            if not isinstance(payloads, list):
+                return 400, {"error": "Expected a JSON array of votes"}
+            results, votes, vote_indexes = vote_service.validate_batch(payloads)
+    except vote_service.BatchTooLarge as e:
+        return 413, {"error": str(e)}
+
+    statuses = await submit(votes, timeout=30.0) if votes else []
+    return 200, vote_service.batch_summary(results, votes, vote_indexes, statuses)
+
+
+def results():
+    counts, total = vote_service.vote_tally.results()
+    return 200, {"results": counts, "total": total}
+
+
+async def get_voter(name):
+    if vote_service.vote_store is None:
+        return 501, {"error": "Voter lookup requires VOTE_STORAGE=segmented"}
+
+    voter = await asyncio.get_running_loop().run_in_executor(io_executor, vote_service.vote_store.lookup, name)
+    if voter is None:
+        return 404, {"error": f"{name} has not voted"}
+    return 200, voter
+
+
+async def submit(votes, timeout):
+    """Hand votes to the writer thread and wait for their batch to commit without blocking the loop.
+
+    Same timeouts as VoteWriter.write()/write_many(): a commit that takes longer answers 503.
+    """
+    try:
+        # timeout=0 fails fast instead of blocking the event loop on a full queue
+        future = vote_service.vote_writer.submit(votes, timeout=0)
+        try:
+            # shield: the queued votes cannot be withdrawn, so their future must stay uncancelled
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            raise WriterOverloaded("votes not committed in time", queued=True) from None
+    except WriterOverloaded as e:
+        raise HTTPError(503, overloaded_message(e))
+
+
+async def read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def read_ndjson(receive):
+    """Yield NDJSON payloads as lines arrive, so large uploads are parsed while streaming"""
+    pending = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        more_body = message.get('more_body', False)
+        pending += message.get('body', b'')
+        *lines, pending = pending.split(b'\n')
+        if not more_body:
+            lines.append(pending)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def parse_json(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise HTTPError(400, "Invalid JSON")
+
+
+async def preflight(send, headers):
+    response_headers = CORS_HEADERS + [
+        (b'access-control-allow-methods', headers.get(b'access-control-request-method', b'GET, POST, OPTIONS')),
+    ]
+    if b'access-control-request-headers' in headers:
+        response_headers.append((b'access-control-allow-headers', headers[b'access-control-request-headers']))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def respond(send, status, body):
+    payload = json.dumps(body).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': CORS_HEADERS + [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
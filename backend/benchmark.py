@@ -0,0 +1,330 @@
+"""Load test and latency benchmark for the vote backend.
+
+Runs the vote app against a throwaway directory standing in for the PVC mount,
+either in-process or as a real server on localhost, drives it with a
+configurable mix of payloads and writes throughput, latency percentiles and
+bytes written per vote to a JSON file:
+
+    python benchmark.py --target inprocess --server asgi --storage segmented \\
+        --concurrency 64 --requests 20000 --mix valid=90,invalid_choice=5,empty_name=5
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PAYLOAD_KINDS = ('valid', 'invalid_choice', 'empty_name', 'duplicate')
+
+
+def parse_mix(text):
+    """Parse 'valid=90,invalid_choice=5,...' into normalised weights"""
+    weights = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in PAYLOAD_KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown payload kind '{kind}', expected one of {PAYLOAD_KINDS}")
+        weights[kind] = float(weight or 1)
+    total = sum(weights.values())
+    return {kind: weight / total for kind, weight in weights.items()}
+
+
+def make_payloads(count, mix, seed):
+    """Build `count` vote payloads; returns (kind, payload) pairs"""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    payloads = []
+    voted = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'duplicate' and not voted:
+            kind = 'valid'
+        if kind == 'valid':
+            payload = {"name": f"voter-{seed}-{i}", "choice": rng.choice(['Choice 1', 'Choice 2'])}
+            voted.append(payload["name"])
+        elif kind == 'invalid_choice':
+            payload = {"name": f"voter-{seed}-{i}", "choice": 'Choice 3'}
+        elif kind == 'empty_name':
+            payload = {"name": rng.choice(['', '   ']), "choice": 'Choice 1'}
+        else:
+            payload = {"name": rng.choice(voted), "choice": rng.choice(['Choice 1', 'Choice 2'])}
+        payloads.append((kind, payload))
+    return payloads
+
+
+def chunk_requests(payloads, batch):
+    """Group payloads into requests: single /vote calls, or /votes/batch bodies of `batch` votes"""
+    if batch <= 1:
+        return [('/vote', json.dumps(payload).encode(), 1) for _, payload in payloads]
+    requests = []
+    for start in range(0, len(payloads), batch):
+        chunk = [payload for _, payload in payloads[start:start + batch]]
+        requests.append(('/votes/batch', json.dumps(chunk).encode(), len(chunk)))
+    return requests
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# Drivers: each sends every request once across `concurrency` workers and
+# returns a list of (latency_seconds, status_code, accepted_votes)
+
+
+def run_threads(requests, concurrency, send_one):
+    samples = []
+    lock = threading.Lock()
+    cursor = iter(range(len(requests)))
+
+    def worker():
+        local = []
+        state = {}
+        while True:
+            with lock:
+                i = next(cursor, None)
+            if i is None:
+                break
+            path, body, _ = requests[i]
+            start = time.perf_counter()
+            status, response = send_one(state, path, body)
+            local.append((time.perf_counter() - start, status, accepted_votes(path, status, response)))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def accepted_votes(path, status, response):
+    if status != 200:
+        return 0
+    if path == '/vote':
+        return 1
+    return json.loads(response)['accepted']
+
+
+def drive_wsgi_inprocess(requests, concurrency):
+    import app
+
+    def send_one(state, path, body):
+        client = state.get('client')
+        if client is None:
+            client = state['client'] = app.app.test_client()
+        response = client.post(path, data=body, content_type='application/json')
+        return response.status_code, response.get_data()
+
+    return run_threads(requests, concurrency, send_one)
+
+
+def drive_asgi_inprocess(requests, concurrency):
+    import asgi_app
+
+    async def call(path, body):
+        scope = {'type': 'http', 'method': 'POST', 'path': path,
+                 'headers': [(b'content-type', b'application/json')]}
+        sent = {}
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                sent['status'] = message['status']
+            else:
+                sent['body'] = message.get('body', b'')
+
+        await asgi_app.app(scope, receive, send)
+        return sent['status'], sent['body']
+
+    async def main():
+        samples = []
+        cursor = iter(requests)
+
+        async def worker():
+            for path, body, _ in cursor:
+                start = time.perf_counter()
+                status, response = await call(path, body)
+                samples.append((time.perf_counter() - start, status, accepted_votes(path, status, response)))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples
+
+    return asyncio.run(main())
+
+
+def drive_http(requests, concurrency, host, port):
+    def send_one(state, path, body):
+        conn = state.get('conn')
+        if conn is None:
+            conn = state['conn'] = http.client.HTTPConnection(host, port, timeout=60)
+        conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    return run_threads(requests, concurrency, send_one)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env, port, timeout=30):
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Vote server exited with code {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Vote server did not start listening on port {port}")
+
+
+def summarize(samples, duration, votes_sent, bytes_written):
+    latencies = sorted(latency for latency, _, _ in samples)
+    accepted = sum(votes for _, _, votes in samples)
+    return {
+        "requests": len(samples),
+        "votes_sent": votes_sent,
+        "votes_accepted": accepted,
+        "duration_s": round(duration, 4),
+        "requests_per_s": round(len(samples) / duration, 1) if duration else 0.0,
+        "votes_per_s": round(votes_sent / duration, 1) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 0.50), 3),
+            "p95": round(1000 * percentile(latencies, 0.95), 3),
+            "p99": round(1000 * percentile(latencies, 0.99), 3),
+            "max": round(1000 * latencies[-1], 3) if latencies else 0.0,
+        },
+        "status_counts": {str(status): count for status, count in sorted(Counter(s for _, s, _ in samples).items())},
+        "bytes_written": bytes_written,
+        "bytes_per_vote": round(bytes_written / accepted, 2) if accepted else None,
+    }
+
+
+def run(args):
+    data_dir = tempfile.mkdtemp(prefix='vote-bench-')
+    env = dict(os.environ)
+    env.update({
+        'VOTE_FILE_PATH': os.path.join(data_dir, 'votes.txt'),
+        'VOTE_STORAGE': args.storage,
+        'VOTE_SERVER': args.server,
+        'VOTE_DURABILITY': args.durability,
+    })
+
+    payloads = make_payloads(args.requests * max(args.batch, 1), args.mix, args.seed)
+    requests = chunk_requests(payloads, args.batch)
+    bytes_before = dir_size(data_dir)
+
+    if args.target == 'inprocess':
+        os.environ.update(env)
+        sys.path.insert(0, BACKEND_DIR)
+        drive = drive_asgi_inprocess if args.server == 'asgi' else drive_wsgi_inprocess
+        start = time.perf_counter()
+        samples = drive(requests, args.concurrency)
+        duration = time.perf_counter() - start
+        import vote_service
+        vote_service.shutdown()
+    else:
+        port = free_port()
+        env['VOTE_PORT'] = str(port)
+        server = start_server(env, port)
+        try:
+            start = time.perf_counter()
+            samples = drive_http(requests, args.concurrency, '127.0.0.1', port)
+            duration = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "benchmark": "vote",
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "target": args.target,
+            "server": args.server,
+            "storage": args.storage,
+            "durability": args.durability,
+            "concurrency": args.concurrency,
+            "requests": len(requests),
+            "batch": args.batch,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        "results": summarize(samples, duration, len(payloads), dir_size(data_dir) - bytes_before),
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['inprocess', 'localhost'], default='inprocess')
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--storage', choices=['segmented', 'text'], default='segmented')
+    parser.add_argument('--durability', choices=['batch', 'interval', 'none'], default='batch')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=5000, help="number of HTTP requests to send")
+    parser.add_argument('--batch', type=int, default=0, help="votes per /votes/batch request (0 = single /vote calls)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('valid=90,invalid_choice=4,empty_name=4,duplicate=2'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="where to save the JSON report (default: benchmark-results/<timestamp>-<config>.json)")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = args.output or os.path.join(
+        'benchmark-results',
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{args.target}-{args.server}-{args.storage}-{args.durability}.json",
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    results = report["results"]
+    print(f"{results['requests']} requests in {results['duration_s']}s: "
+          f"{results['requests_per_s']} req/s, {results['votes_per_s']} votes/s")
+    print("latency ms: " + ", ".join(f"{key}={value}" for key, value in results["latency_ms"].items()))
+    print(f"status codes: {results['status_counts']}, bytes/vote: {results['bytes_per_vote']}")
+    print(f"Report saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
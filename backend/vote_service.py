@@ -0,0 +1,146 @@
+import atexit
+import os
+import signal
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # common/ lives next to backend/ outside the image
+from common import instrumentation
+from vote_store import DUPLICATE, VoteStore
+from vote_tally import VoteTally
+from vote_writer import TextVoteLog, VoteWriter
+
+vote_file_path = os.environ.get('VOTE_FILE_PATH', '/mnt/data/votes/votes.txt')  # Write inside the mounted PVC
+vote_data_dir = os.path.dirname(vote_file_path)
+
+# Storage engine behind /vote: 'segmented' (binary segments + voter index) or 'text' (votes.txt only)
+storage_mode = os.environ.get('VOTE_STORAGE', 'segmented')
+
+if storage_mode == 'segmented':
+    vote_store = VoteStore(
+        os.environ.get('VOTE_STORE_DIR', os.path.join(vote_data_dir, 'store')),
+        segment_size=int(os.environ.get('VOTE_SEGMENT_SIZE', str(1024 * 1024))),
+        duplicate_policy=os.environ.get('VOTE_DUPLICATE_POLICY', 'reject'),
+    ).open()
+    # Migrate existing votes.txt data into a freshly created store
+    if vote_store.is_empty() and os.path.exists(vote_file_path):
+        imported = vote_store.import_text(vote_file_path)
+        print(f"Imported {imported} votes from {vote_file_path}")
+    vote_log = vote_store
+
+    # The store's index already holds every voter's choice, so no checkpoint is needed
+    vote_tally = VoteTally(None)
+    vote_tally.reset(vote_store.counts())
+elif storage_mode == 'text':
+    vote_store = None
+    # Ensure the file exists on startup
+    if not os.path.exists(vote_file_path):
+        open(vote_file_path, 'a').close()
+    vote_log = TextVoteLog(vote_file_path).open()
+
+    # Live per-choice counts, rebuilt from the last checkpoint plus the tail of the log
+    vote_tally = VoteTally(
+        os.environ.get('VOTE_CHECKPOINT_PATH', os.path.join(vote_data_dir, 'votes.checkpoint.json')),
+        checkpoint_interval=float(os.environ.get('VOTE_CHECKPOINT_INTERVAL', '30')),
+    )
+    vote_tally.recover(vote_file_path)
+else:
+    raise ValueError(f"Unknown VOTE_STORAGE '{storage_mode}', expected 'segmented' or 'text'")
+
+VOTE_BATCH_SIZE = instrumentation.histogram(
+    'vote_writer_batch_votes', 'Votes committed per writer batch', buckets=(1, 4, 16, 64, 256, 1024, 4096),
+)
+
+
+def record_commit(votes, results, position):
+    VOTE_BATCH_SIZE.observe(len(votes))
+    vote_tally.record(votes, results, position)
+
+
+# One background writer owns the vote log and commits votes in batches
+vote_writer = VoteWriter(
+    vote_log,
+    batch_size=int(os.environ.get('VOTE_BATCH_SIZE', '256')),
+    flush_interval=float(os.environ.get('VOTE_FLUSH_INTERVAL_MS', '5')) / 1000,
+    durability=os.environ.get('VOTE_DURABILITY', 'batch'),
+    fsync_interval=float(os.environ.get('VOTE_FSYNC_INTERVAL_MS', '1000')) / 1000,
+    queue_size=int(os.environ.get('VOTE_QUEUE_SIZE', '10000')),
+    on_commit=record_commit,
+).start()
+instrumentation.QUEUE_DEPTH.labels('vote_writer').set_function(vote_writer.queue_depth)
+
+@atexit.register
+def shutdown():
+    vote_writer.close()
+    vote_tally.checkpoint()
+
+# Kubernetes stops pods with SIGTERM; exit normally so the log and index are closed cleanly
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+# Largest number of votes accepted in one /votes/batch request
+max_batch_votes = int(os.environ.get('VOTE_MAX_BATCH', '10000'))
+
+def validate_vote(data):
+    """Return an error message for an invalid vote payload, or None if it is valid"""
+    if not isinstance(data, dict):
+        return "Vote must be a JSON object"
+
+    if data.get('choice') not in ['Choice 1', 'Choice 2']:
+        return "Invalid choice"
+
+    name = data.get('name')
+    if not isinstance(name, str) or name.strip() == '':
+        return "Name is required"
+
+    return None
+
+class BatchTooLarge(ValueError):
+    pass
+
+class BatchValidator:
+    """Validates the items of one batch as they arrive, so a body is never read past the limit"""
+
+    def __init__(self):
+        self.results = []
+        self.votes = []
+        self.vote_indexes = []
+
+    def add(self, data):
+        """Validate the next payload; raises BatchTooLarge as soon as it is one too many"""
+        index = len(self.results)
+        if index >= max_batch_votes:
+            raise BatchTooLarge(f"A batch can hold at most {max_batch_votes} votes")
+
+        error = validate_vote(data) if data is not None else "Invalid JSON"
+        if error:
+            self.results.append({"index": index, "status": "rejected", "error": error})
+        else:
+            self.results.append({"index": index, "status": "accepted"})
+            self.votes.append((data['name'], data['choice']))
+            self.vote_indexes.append(index)
+
+def validate_batch(payloads):
+    """Validate vote payloads in one pass.
+
+    Returns the per-item results so far plus the valid (name, choice) votes and the
+    item index each of them came from. Raises BatchTooLarge for oversized batches.
+    """
+    batch = BatchValidator()
+    for data in payloads:
+        batch.add(data)
+    return batch.results, batch.votes, batch.vote_indexes
+
+async def validate_batch_async(payloads):
+    """validate_batch() for an async iterator of payloads, e.g. an NDJSON body streamed over ASGI"""
+    batch = BatchValidator()
+    async for data in payloads:
+        batch.add(data)
+    return batch.results, batch.votes, batch.vote_indexes
+
+def batch_summary(results, votes, vote_indexes, statuses):
+    """Fold the writer's per-vote statuses into the batch results"""
+    for index, (name, _), (status, _) in zip(vote_indexes, votes, statuses):
+        if status == DUPLICATE:
+            results[index] = {"index": index, "status": "rejected", "error": f"{name} has already voted"}
+
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    return {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
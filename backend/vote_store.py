@@ -0,0 +1,460 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Outcome of appending one vote
+RECORDED = 'recorded'
+REPLACED = 'replaced'
+DUPLICATE = 'duplicate'
+
+# What to do when a name that has already voted votes again:
+#   reject  - refuse the new vote
+#   replace - the new vote supersedes the old one, which compaction later reclaims
+DUPLICATE_POLICIES = ('reject', 'replace')
+
+# Segment record: name length, crc32 of everything after the crc, choice id, timestamp, then the name
+RECORD_HEADER = struct.Struct('<IIBd')
+
+# Index file: fixed header followed by `capacity` open-addressing slots
+INDEX_MAGIC = b'VIDX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<4sIIIQ')  # magic, version, clean flag, capacity, count
+INDEX_HEADER_SIZE = 64
+SLOT = struct.Struct('<QIIIB3xd')  # name hash (0 = empty), segment, offset, record length, choice id, timestamp
+INITIAL_CAPACITY = 1024
+MAX_LOAD = 0.7
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+def _hash_name(name_bytes):
+    h = int.from_bytes(hashlib.blake2b(name_bytes, digest_size=8).digest(), 'little')
+    return h or 1
+
+
+def _pack_record(choice_id, timestamp, name_bytes):
+    body = struct.pack('<Bd', choice_id, timestamp) + name_bytes
+    return RECORD_HEADER.pack(len(name_bytes), zlib.crc32(body), choice_id, timestamp) + name_bytes
+
+
+class VoteStore:
+    """Segmented, length-prefixed vote log with a memory-mapped voter index.
+
+    Votes are appended as compact binary records to fixed-size segment files, with
+    one write per appended batch. A hash index over voter names lives in an mmap'd
+    file, so checking whether a name has voted (and what for) is a constant-time
+    probe rather than a scan.
+    The index is rebuilt from the segments if the store was not closed cleanly.
+    """
+
+    def __init__(self, directory, segment_size=1024 * 1024, duplicate_policy='reject', compact_threshold=0.5):
+        if duplicate_policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy '{duplicate_policy}', expected one of {DUPLICATE_POLICIES}")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.duplicate_policy = duplicate_policy
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._choices = []
+        self._choice_ids = {}
+        self._counts = []
+        self._segments = []  # ids of all segment files, oldest first; the last one is active
+        self._segment_sizes = {}
+        self._live_bytes = {}
+        self._read_fds = {}
+        self._active_fd = None
+        self._pending = bytearray()  # records of the current append, written to the active segment in one go
+        self._pending_start = 0
+        self._undo = None  # while an append is in progress: saved counters and (slot, previous bytes)
+        self._index_fd = None
+        self._index = None
+        self._capacity = 0
+        self._count = 0
+
+    # Lifecycle
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_choices()
+        self._segments = sorted(
+            int(f[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for f in os.listdir(self.directory)
+            if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX)
+        )
+        if not self._segments:
+            self._segments = [1]
+        for segment in self._segments:
+            self._segment_sizes[segment] = os.path.getsize(self._segment_path(segment)) \
+                if os.path.exists(self._segment_path(segment)) else 0
+        self._pending_start = self._segment_sizes[self._segments[-1]]
+
+        clean = self._open_index()
+        if not clean:
+            print(f"Vote index in {self.directory} was not closed cleanly, rebuilding from segments")
+            self._rebuild_index()
+        self._set_clean(False)
+        self._load_stats()
+        self._open_active(self._segments[-1])
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._index is None:
+                return
+            os.fsync(self._active_fd)
+            os.close(self._active_fd)
+            for fd in self._read_fds.values():
+                os.close(fd)
+            self._read_fds.clear()
+            self._set_clean(True)
+            self._close_index()
+
+    def sync(self):
+        os.fsync(self._active_fd)
+
+    # Queries
+
+    def is_empty(self):
+        return self._count == 0 and self._segment_sizes.get(self._segments[-1], 0) == 0 and len(self._segments) == 1
+
+    def counts(self):
+        with self._lock:
+            return {choice: self._counts[choice_id] for choice_id, choice in enumerate(self._choices, start=1)}
+
+    def position(self):
+        segment = self._segments[-1]
+        return segment, self._segment_sizes[segment]
+
+    def lookup(self, name):
+        """Return the recorded vote for `name`, or None if it has not voted."""
+        name_bytes = name.encode('utf-8')
+        with self._lock:
+            slot = self._find(_hash_name(name_bytes), name_bytes)
+            if slot is None:
+                return None
+            _, _, _, _, choice_id, timestamp = self._read_slot(slot)
+        return {"name": name, "choice": self._choices[choice_id - 1], "timestamp": timestamp}
+
+    # Writes
+
+    def append(self, votes):
+        """Append (name, choice) votes; returns one (status, previous_choice) per vote."""
+        results = []
+        with self._lock:
+            # Grow up front so slot numbers stay put while the batch is applied (and possibly undone)
+            while self._count + len(votes) > self._capacity * MAX_LOAD:
+                self._grow()
+            self._begin()
+            try:
+                for name, choice in votes:
+                    results.append(self._append_one(name.encode('utf-8'), self._intern(choice), time.time()))
+                self._flush_pending()
+            except Exception:
+                self._roll_back()
+                raise
+            self._undo = None
+            rotated = self._segment_sizes[self._segments[-1]] >= self.segment_size
+        if rotated:
+            # The votes are on disk by now, so a failure here must not be reported as a failed append
+            try:
+                self._rotate()
+                self.compact()
+            except OSError as e:
+                print(f"Rotating or compacting {self.directory} failed, retrying after the next append: {e}")
+        return results
+
+    def import_text(self, path):
+        """Import a legacy `<name> voted for <choice>` text log; returns the number of votes recorded."""
+        votes = []
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                name, sep, choice = line.rstrip('\n').rpartition(' voted for ')
+                if sep and name.strip():
+                    votes.append((name, choice))
+        recorded = 0
+        for start in range(0, len(votes), 1000):
+            results = self.append(votes[start:start + 1000])
+            recorded += sum(1 for status, _ in results if status != DUPLICATE)
+        self.sync()
+        return recorded
+
+    def compact(self):
+        """Rewrite sealed segments that are mostly superseded votes and delete the originals."""
+        for segment in list(self._segments[:-1]):
+            size = self._segment_sizes[segment]
+            if size and self._live_bytes.get(segment, 0) >= size * self.compact_threshold:
+                continue
+            with self._lock:
+                self._begin()
+                try:
+                    for offset, name_bytes, choice_id, timestamp, length in self._scan_segment(segment):
+                        slot = self._find(_hash_name(name_bytes), name_bytes)
+                        if slot is not None and self._read_slot(slot)[1:3] == (segment, offset):
+                            self._write_record(slot, name_bytes, choice_id, timestamp)
+                    self._flush_pending()
+                except Exception:
+                    self._roll_back()
+                    raise
+                self._undo = None
+                os.fsync(self._active_fd)
+                self._index.flush()
+                self._segments.remove(segment)
+                self._segment_sizes.pop(segment)
+                self._live_bytes.pop(segment, None)
+                fd = self._read_fds.pop(segment, None)
+                if fd is not None:
+                    os.close(fd)
+                os.remove(self._segment_path(segment))
+            if self._segment_sizes[self._segments[-1]] >= self.segment_size:
+                self._rotate()
+
+    def _append_one(self, name_bytes, choice_id, timestamp):
+        h = _hash_name(name_bytes)
+        slot = self._find(h, name_bytes)
+        previous = None
+        if slot is not None:
+            if self.duplicate_policy == 'reject':
+                return DUPLICATE, None
+            _, segment, _, length, previous, _ = self._read_slot(slot)
+            self._live_bytes[segment] -= length
+            self._counts[previous] -= 1
+        else:
+            slot = self._free_slot(h)
+            self._count += 1
+        self._write_record(slot, name_bytes, choice_id, timestamp, h)
+        self._counts[choice_id] += 1
+        if previous is None:
+            return RECORDED, None
+        return REPLACED, self._choices[previous - 1]
+
+    def _write_record(self, slot, name_bytes, choice_id, timestamp, h=None):
+        record = _pack_record(choice_id, timestamp, name_bytes)
+        segment = self._segments[-1]
+        offset = self._segment_sizes[segment]
+        self._pending += record
+        self._segment_sizes[segment] = offset + len(record)
+        self._live_bytes[segment] = self._live_bytes.get(segment, 0) + len(record)
+        if h is None:
+            h = self._read_slot(slot)[0]
+        self._put_slot(slot, h, segment, offset, len(record), choice_id, timestamp)
+
+    def _flush_pending(self):
+        # Trim as the writes go, so a write that fails part-way never sends the same bytes twice
+        while self._pending:
+            written = os.write(self._active_fd, self._pending)
+            del self._pending[:written]
+            self._pending_start += written
+
+    def _begin(self):
+        """Save what an append changes in memory, so _roll_back() can undo it if writing fails"""
+        self._undo = (self._count, list(self._counts), dict(self._live_bytes), self._pending_start, [])
+
+    def _roll_back(self):
+        """Undo a failed append: drop its partly written records and restore the index and counters"""
+        count, counts, live_bytes, start, slots = self._undo
+        try:
+            os.ftruncate(self._active_fd, start)
+            self._pending_start = start
+        except OSError as e:
+            # Keep what did reach the disk accounted for, so later records land after it
+            print(f"Truncating the active segment in {self.directory} failed: {e}")
+        for slot, previous in reversed(slots):
+            position = INDEX_HEADER_SIZE + slot * SLOT.size
+            self._index[position:position + SLOT.size] = previous
+        self._count, self._counts, self._live_bytes = count, counts, live_bytes
+        self._segment_sizes[self._segments[-1]] = self._pending_start
+        self._pending.clear()
+        self._undo = None
+
+    def _rotate(self):
+        with self._lock:
+            os.fsync(self._active_fd)
+            os.close(self._active_fd)
+            segment = self._segments[-1] + 1
+            self._segments.append(segment)
+            self._segment_sizes[segment] = 0
+            self._open_active(segment)
+
+    # Segments
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:08d}{SEGMENT_SUFFIX}")
+
+    def _open_active(self, segment):
+        self._active_fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._pending_start = self._segment_sizes[segment]
+
+    def _read_fd(self, segment):
+        fd = self._read_fds.get(segment)
+        if fd is None:
+            fd = self._read_fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def _read_name(self, segment, offset):
+        if segment == self._segments[-1] and offset >= self._pending_start:
+            start = offset - self._pending_start
+            length = RECORD_HEADER.unpack_from(self._pending, start)[0]
+            return bytes(self._pending[start + RECORD_HEADER.size:start + RECORD_HEADER.size + length])
+        fd = self._read_fd(segment)
+        length = RECORD_HEADER.unpack(os.pread(fd, RECORD_HEADER.size, offset))[0]
+        return os.pread(fd, length, offset + RECORD_HEADER.size)
+
+    def _scan_segment(self, segment):
+        """Yield (offset, name, choice id, timestamp, record length) for every intact record."""
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            name_length, crc, choice_id, timestamp = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + name_length
+            if end > len(data) or zlib.crc32(data[offset + 8:end]) != crc:
+                break
+            yield offset, data[offset + RECORD_HEADER.size:end], choice_id, timestamp, end - offset
+            offset = end
+        if offset != len(data):
+            # Torn or corrupt tail left by a crash; drop it so new records follow intact ones
+            print(f"Truncating {path} from {len(data)} to {offset} bytes")
+            os.truncate(path, offset)
+            self._segment_sizes[segment] = offset
+
+    # Choices
+
+    def _load_choices(self):
+        path = os.path.join(self.directory, 'choices.txt')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._choices = [line.rstrip('\n') for line in f if line.strip()]
+        self._choice_ids = {choice: i for i, choice in enumerate(self._choices, start=1)}
+        self._counts = [0] * (len(self._choices) + 1)
+
+    def _intern(self, choice):
+        choice_id = self._choice_ids.get(choice)
+        if choice_id is None:
+            if len(self._choices) >= 255:
+                raise ValueError("Too many distinct choices for a one-byte choice id")
+            with open(os.path.join(self.directory, 'choices.txt'), 'a', encoding='utf-8') as f:
+                f.write(f"{choice}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._choices.append(choice)
+            choice_id = self._choice_ids[choice] = len(self._choices)
+            self._counts.append(0)
+        return choice_id
+
+    # Index
+
+    def _index_path(self):
+        return os.path.join(self.directory, 'voters.idx')
+
+    def _open_index(self):
+        """Map the index file, creating it if needed; returns whether it was closed cleanly."""
+        path = self._index_path()
+        if not os.path.exists(path):
+            self._create_index(path, INITIAL_CAPACITY)
+            self._map_index(path)
+            return self._segment_sizes[self._segments[-1]] == 0 and len(self._segments) == 1
+        self._map_index(path)
+        magic, version, clean, capacity, count = INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION \
+                or len(self._index) != INDEX_HEADER_SIZE + capacity * SLOT.size:
+            self._close_index()
+            self._create_index(path, INITIAL_CAPACITY)
+            self._map_index(path)
+            return False
+        self._capacity, self._count = capacity, count
+        return bool(clean)
+
+    def _create_index(self, path, capacity):
+        with open(path, 'wb') as f:
+            f.truncate(INDEX_HEADER_SIZE + capacity * SLOT.size)
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, capacity, 0))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _map_index(self, path):
+        self._index_fd = os.open(path, os.O_RDWR)
+        self._index = mmap.mmap(self._index_fd, 0)
+        _, _, _, self._capacity, self._count = INDEX_HEADER.unpack_from(self._index, 0)
+
+    def _close_index(self):
+        self._index.flush()
+        self._index.close()
+        os.close(self._index_fd)
+        self._index = None
+        self._index_fd = None
+
+    def _set_clean(self, clean):
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, INDEX_VERSION, int(clean), self._capacity, self._count)
+        self._index.flush()
+
+    def _read_slot(self, slot):
+        return SLOT.unpack_from(self._index, INDEX_HEADER_SIZE + slot * SLOT.size)
+
+    def _put_slot(self, slot, h, segment, offset, length, choice_id, timestamp):
+        position = INDEX_HEADER_SIZE + slot * SLOT.size
+        if self._undo is not None:
+            self._undo[-1].append((slot, self._index[position:position + SLOT.size]))
+        SLOT.pack_into(self._index, position, h, segment, offset, length, choice_id, timestamp)
+
+    def _find(self, h, name_bytes):
+        mask = self._capacity - 1
+        slot = h & mask
+        while True:
+            slot_hash, segment, offset = struct.unpack_from('<QII', self._index, INDEX_HEADER_SIZE + slot * SLOT.size)
+            if slot_hash == 0:
+                return None
+            if slot_hash == h and self._read_name(segment, offset) == name_bytes:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _free_slot(self, h):
+        mask = self._capacity - 1
+        slot = h & mask
+        while struct.unpack_from('<Q', self._index, INDEX_HEADER_SIZE + slot * SLOT.size)[0]:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _grow(self):
+        entries = [entry for entry in SLOT.iter_unpack(self._index[INDEX_HEADER_SIZE:]) if entry[0]]
+        path = self._index_path()
+        tmp_path = f"{path}.tmp"
+        self._close_index()
+        self._create_index(tmp_path, self._capacity * 2)
+        os.replace(tmp_path, path)
+        self._map_index(path)
+        for entry in entries:
+            self._put_slot(self._free_slot(entry[0]), *entry)
+        self._count = len(entries)
+        self._set_clean(False)
+
+    def _rebuild_index(self):
+        self._close_index()
+        self._create_index(self._index_path(), INITIAL_CAPACITY)
+        self._map_index(self._index_path())
+        self._count = 0
+        for segment in self._segments:
+            for offset, name_bytes, choice_id, timestamp, length in self._scan_segment(segment):
+                h = _hash_name(name_bytes)
+                slot = self._find(h, name_bytes)
+                if slot is None:
+                    slot = self._free_slot(h)
+                    self._count += 1
+                self._put_slot(slot, h, segment, offset, length, choice_id, timestamp)
+                if self._count > self._capacity * MAX_LOAD:
+                    self._grow()
+
+    def _load_stats(self):
+        """Derive per-choice counts and per-segment live bytes from the index alone."""
+        self._counts = [0] * (len(self._choices) + 1)
+        self._live_bytes = {}
+        for h, segment, _, length, choice_id, _ in SLOT.iter_unpack(self._index[INDEX_HEADER_SIZE:]):
+            if h:
+                self._counts[choice_id] += 1
+                self._live_bytes[segment] = self._live_bytes.get(segment, 0) + length
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import time
+
+from vote_store import DUPLICATE, REPLACED
+
+VOTE_SEPARATOR = b' voted for '
+
+
+class VoteTally:
+    """Live per-choice vote counters backed by periodic checkpoints.
+
+    A checkpoint records the counts together with the byte offset in the text vote
+    log they cover, so a restart only has to replay the lines written after it.
+    With the segmented store there is no checkpoint file: the store derives the
+    counts from its index and `reset()` seeds them.
+    """
+
+    def __init__(self, checkpoint_path, checkpoint_interval=30.0):
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self._counts = {}
+        self._total = 0
+        self._offset = 0
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.Lock()
+
+    def results(self):
+        with self._lock:
+            return dict(self._counts), self._total
+
+    def reset(self, counts):
+        with self._lock:
+            self._counts = dict(counts)
+            self._total = sum(counts.values())
+
+    def record(self, votes, results, position):
+        """Count a freshly committed batch; `position` is where the log now ends."""
+        with self._lock:
+            for (_, choice), (status, previous_choice) in zip(votes, results):
+                if status == DUPLICATE:
+                    continue
+                self._counts[choice] = self._counts.get(choice, 0) + 1
+                if status == REPLACED:
+                    self._counts[previous_choice] -= 1
+                else:
+                    self._total += 1
+            self._offset = position
+        if time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def recover(self, log_path):
+        """Load the last checkpoint and replay the tail of the log written after it."""
+        self._load_checkpoint()
+        if not os.path.exists(log_path):
+            return
+        if os.path.getsize(log_path) < self._offset:
+            # The log was truncated or replaced, so the checkpoint no longer applies
+            print(f"Checkpoint offset {self._offset} is past the end of {log_path}, rescanning")
+            self._counts, self._total, self._offset = {}, 0, 0
+
+        with open(log_path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # torn write at the tail of the log
+                self._count_line(line)
+                self._offset += len(line)
+
+    def checkpoint(self):
+        if self.checkpoint_path is None:
+            return
+        with self._lock:
+            state = {"counts": self._counts, "total": self._total, "offset": self._offset}
+            data = json.dumps(state)
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self._last_checkpoint = time.monotonic()
+
+    def _load_checkpoint(self):
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            self._counts = {choice: int(count) for choice, count in state["counts"].items()}
+            self._total = int(state["total"])
+            self._offset = int(state["offset"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            self._counts, self._total, self._offset = {}, 0, 0
+
+    def _count_line(self, line):
+        _, sep, choice = line.rstrip(b'\n').rpartition(VOTE_SEPARATOR)
+        if not sep:
+            return
+        choice = choice.decode('utf-8', errors='replace')
+        self._counts[choice] = self._counts.get(choice, 0) + 1
+        self._total += 1
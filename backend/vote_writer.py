@@ -0,0 +1,197 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from vote_store import RECORDED
+
+# How hard to push committed batches to stable storage:
+#   batch    - fsync after every batch, before any request in it is answered
+#   interval - fsync at most once every `fsync_interval` seconds
+#   none     - leave it to the page cache
+DURABILITY_MODES = ('batch', 'interval', 'none')
+
+_STOP = object()
+
+
+class WriterOverloaded(Exception):
+    """The writer could not take or commit votes in time; `queued` says whether they may still be committed"""
+
+    def __init__(self, message, queued=False):
+        super().__init__(message)
+        self.queued = queued
+
+
+def overloaded_message(error):
+    """Client-facing text for a WriterOverloaded error"""
+    if error.queued:
+        return "The vote log is not keeping up, try again later; the vote was queued and may still be recorded"
+    return "Too many votes in flight, try again"
+
+
+class TextVoteLog:
+    """The original `<name> voted for <choice>` text log, kept open for appending."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def open(self):
+        self._file = open(self.path, 'ab', buffering=0)
+        return self
+
+    def append(self, votes):
+        data = ''.join(f"{name} voted for {choice}\n" for name, choice in votes).encode('utf-8')
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+        return [(RECORDED, None)] * len(votes)
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def position(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class VoteWriter:
+    """Single background writer that group-commits votes to a vote log.
+
+    Request handlers hand (name, choice) votes to `submit()`/`write()`; a bounded
+    queue feeds one thread that owns the log, so votes are written in arrival
+    order and never interleave, however many request threads are voting at once.
+
+    `on_commit(votes, results, position)` is called on the writer thread after
+    each batch is written and before any of its requests are answered.
+    """
+
+    def __init__(self, log, batch_size=256, flush_interval=0.005,
+                 durability='batch', fsync_interval=1.0, queue_size=10000, on_commit=None):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode '{durability}', expected one of {DURABILITY_MODES}")
+        self.log = log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        self.on_commit = on_commit
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='vote-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, votes, timeout=1.0):
+        """Queue (name, choice) votes to be written together; the returned future
+        resolves to one (status, previous_choice) per vote once they are committed.
+
+        Raises WriterOverloaded if the writer is too far behind to accept them in time.
+        """
+        future = Future()
+        try:
+            self._queue.put((votes, future), timeout=timeout)
+        except queue.Full:
+            raise WriterOverloaded("vote queue is full") from None
+        return future
+
+    def write(self, name, choice, timeout=5.0):
+        """Queue one vote and block until it has been committed."""
+        return self.write_many([(name, choice)], timeout=timeout)[0]
+
+    def write_many(self, votes, timeout=30.0):
+        """Queue a list of votes as one unit and block until they have been committed.
+
+        Raises WriterOverloaded if they cannot be queued, or are not committed,
+        within `timeout`; in the second case they stay queued and may still be.
+        """
+        future = self.submit(votes, timeout=timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            raise WriterOverloaded("votes not committed in time", queued=True) from None
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put((_STOP, None))
+        self._thread.join()
+        self._thread = None
+        self.log.close()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._idle_timeout())
+            except queue.Empty:
+                self._maybe_fsync()
+                continue
+
+            batch = [item]
+            size = 0 if item[0] is _STOP else len(item[0])
+            deadline = time.monotonic() + self.flush_interval
+            while size < self.batch_size and batch[-1][0] is not _STOP:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                if item[0] is not _STOP:
+                    size += len(item[0])
+
+            stop = batch[-1][0] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._commit(batch)
+            if stop:
+                if self._dirty:
+                    self.log.sync()
+                return
+
+    def _commit(self, batch):
+        votes = [vote for item_votes, _ in batch for vote in item_votes]
+        futures = [future for _, future in batch]
+        try:
+            results = self.log.append(votes)
+            self._dirty = True
+            if self.durability == 'batch':
+                self._fsync()
+            else:
+                self._maybe_fsync()
+            if self.on_commit is not None:
+                self.on_commit(votes, results, self.log.position())
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        start = 0
+        for item_votes, future in batch:
+            future.set_result(results[start:start + len(item_votes)])
+            start += len(item_votes)
+
+    def _idle_timeout(self):
+        if self.durability == 'interval' and self._dirty:
+            return max(0.0, self._last_fsync + self.fsync_interval - time.monotonic())
+        return None
+
+    def _maybe_fsync(self):
+        if self.durability == 'interval' and self._dirty \
+                and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+
+    def _fsync(self):
+        self.log.sync()
+        self._last_fsync = time.monotonic()
+        self._dirty = False
@@ -0,0 +1 @@
+"""Code shared by the scripts and the dashboard backend."""
@@ -0,0 +1,129 @@
+"""Bounded, node-aware job runner for volume backups and restores.
+
+Jobs run on at most `max_workers` threads, and at most `per_node` of them
+touch the same node at once, so one busy node cannot take the whole pool
+while the others sit idle. Every job records when it was queued, started
+and finished; `report()` turns that into per-job timings and the makespan,
+which for a restore is the recovery time of the pod volumes.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from common.instrumentation import QUEUE_DEPTH, histogram
+
+JOB_SECONDS = histogram('backup_job_duration_seconds', 'Run time of backup and restore jobs', ('runner', 'outcome'))
+JOB_WAIT_SECONDS = histogram('backup_job_wait_seconds', 'Time jobs spent queued before starting', ('runner',))
+
+
+class Job:
+    def __init__(self, key, node, func, args):
+        self.key = key
+        self.node = node
+        self.func = func
+        self.args = args
+        self.future = Future()
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def timings(self):
+        return {
+            "job": self.key,
+            "node": self.node,
+            "ok": self.error is None,
+            "error": self.error,
+            "wait_s": round((self.started or self.finished) - self.queued, 3),
+            "run_s": round(self.finished - self.started, 3) if self.started else 0.0,
+        }
+
+
+class JobRunner:
+    def __init__(self, name, max_workers=8, per_node=2):
+        self.name = name
+        self.max_workers = max_workers
+        self.per_node = per_node
+        self.created = time.time()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._pending = deque()
+        self._running = 0
+        self._running_by_node = {}
+        self._jobs = []
+        self._lock = threading.Lock()
+        QUEUE_DEPTH.labels(f"{name}-pending").set_function(lambda: len(self._pending))
+
+    def submit(self, key, node, func, *args):
+        """Queue func(*args) as job `key` on `node`; returns a Future of its result"""
+        job = Job(key, node, func, args)
+        with self._lock:
+            self._jobs.append(job)
+            self._pending.append(job)
+        self._dispatch()
+        return job.future
+
+    def wait(self):
+        """Block until every submitted job has finished"""
+        while True:
+            with self._lock:
+                futures = [job.future for job in self._jobs if not job.future.done()]
+            if not futures:
+                return
+            for future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    pass  # recorded on the job
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def report(self):
+        with self._lock:
+            jobs = [job for job in self._jobs if job.finished is not None]
+        finished = max((job.finished for job in jobs), default=self.created)
+        return {
+            "runner": self.name,
+            "jobs": len(jobs),
+            "failed": sum(1 for job in jobs if job.error is not None),
+            "makespan_s": round(finished - self.created, 3),
+            "timings": [job.timings() for job in sorted(jobs, key=lambda job: job.queued)],
+        }
+
+    def _dispatch(self):
+        to_start = []
+        with self._lock:
+            for job in list(self._pending):
+                if self._running >= self.max_workers:
+                    break
+                if self._running_by_node.get(job.node, 0) >= self.per_node:
+                    continue  # that node is busy; let jobs for other nodes go first
+                self._pending.remove(job)
+                self._running += 1
+                self._running_by_node[job.node] = self._running_by_node.get(job.node, 0) + 1
+                to_start.append(job)
+        for job in to_start:
+            self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        job.started = time.time()
+        try:
+            result = job.func(*job.args)
+        except Exception as e:
+            job.error = str(e)
+            job.finished = time.time()
+            self._release(job)
+            job.future.set_exception(e)
+            return
+        job.finished = time.time()
+        self._release(job)
+        job.future.set_result(result)
+
+    def _release(self, job):
+        JOB_WAIT_SECONDS.labels(self.name).observe(job.started - job.queued)
+        JOB_SECONDS.labels(self.name, 'ok' if job.error is None else 'failed').observe(job.finished - job.started)
+        with self._lock:
+            self._running -= 1
+            self._running_by_node[job.node] -= 1
+        self._dispatch()
@@ -0,0 +1,160 @@
+"""Micro-benchmark of the podman stats parsers.
+
+Times the shared columnar parser on JSON and table output against the
+per-line regex parser it replaced, over recorded outputs. Without --json or
+--table, outputs for --containers containers are generated in podman's exact
+formats; --record saves the live output of this machine's podman for later
+runs:
+
+    python -m common.benchmark_podman_stats --containers 2000 --repeat 50
+    python -m common.benchmark_podman_stats --record recorded/
+    python -m common.benchmark_podman_stats --json recorded/stats.json --table recorded/stats.txt
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import time
+
+from common import podman_stats
+
+TABLE_HEADER = ('ID', 'NAME', 'CPU %', 'MEM USAGE / LIMIT', 'MEM %', 'NET IO', 'BLOCK IO', 'PIDS', 'CPU TIME', 'AVG CPU %')
+SIZE_UNITS = ('B', 'kB', 'MB', 'GB', 'KiB', 'MiB', 'GiB')
+
+
+def legacy_parse(text):
+    """The dashboard's former parser: regex split per line, string replaces per field"""
+    def convert_to_mb(mem_str):
+        if 'GB' in mem_str:
+            return float(mem_str.replace('GB', '').strip()) * 1024
+        elif 'MB' in mem_str:
+            return float(mem_str.replace('MB', '').strip())
+        elif 'kB' in mem_str:
+            return float(mem_str.replace('kB', '').strip()) / 1024
+        else:
+            return 0
+
+    lines = text.strip().split('\n')
+    headers = re.split(r'\s{2,}', lines[0])
+    parsed = {}
+    for line in lines[1:]:
+        data = dict(zip(headers, re.split(r'\s{2,}', line)))
+        used, total = data['MEM USAGE / LIMIT'].split(' / ')
+        parsed[data.get('NAME', '')] = {
+            'cpu': float(data['CPU %'].replace('%', '').strip()),
+            'memory_used_mb': convert_to_mb(used),
+            'memory_total_mb': convert_to_mb(total),
+            'memory_percent': float(data['MEM %'].replace('%', '').strip()),
+        }
+    return parsed
+
+
+def generate_rows(count, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        size = lambda: f"{rng.uniform(1, 999):.4g}{rng.choice(SIZE_UNITS)}"
+        rows.append({
+            'id': f"{rng.getrandbits(48):012x}",
+            'name': f"minikube-m{i + 2:02d}",
+            'cpu_percent': f"{rng.uniform(0, 400):.2f}%",
+            'mem_usage': f"{size()} / {size()}",
+            'mem': f"{rng.uniform(0, 100):.2f}%",
+            'net_io': f"{size()} / {size()}",
+            'block_io': f"{size()} / {size()}",
+            'pids': str(rng.randint(1, 500)),
+            'cpu_time': f"{rng.randint(0, 59)}m{rng.uniform(0, 60):.3f}s",
+            'avg_cpu': f"{rng.uniform(0, 100):.2f}%",
+        })
+    return rows
+
+
+def format_table(rows):
+    """Lay rows out like podman's tabwriter: columns padded to the widest cell plus two spaces"""
+    keys = ('id', 'name', 'cpu_percent', 'mem_usage', 'mem', 'net_io', 'block_io', 'pids', 'cpu_time', 'avg_cpu')
+    cells = [list(TABLE_HEADER)] + [[row[key] for key in keys] for row in rows]
+    widths = [max(len(line[i]) for line in cells) + 2 for i in range(len(keys))]
+    return '\n'.join(''.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in cells) + '\n'
+
+
+def record(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, command in (('stats.json', ['podman', 'stats', '--no-stream', '--format', 'json']),
+                          ('stats.txt', ['podman', 'stats', '--no-stream'])):
+        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(result.stdout)
+        print(f"Recorded {os.path.join(directory, name)}")
+
+
+def time_parser(func, text, repeat):
+    func(text)  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, containers):
+    median = statistics.median(timings)
+    return {
+        "best_ms": round(min(timings) * 1000, 3),
+        "median_ms": round(median * 1000, 3),
+        "containers_per_s": round(containers / median) if median else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--containers', type=int, default=1000, help="containers in generated outputs")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="recorded `podman stats --format json` output to parse")
+    parser.add_argument('--table', help="recorded `podman stats` table output to parse")
+    parser.add_argument('--record', metavar='DIR', help="save this machine's podman stats output to DIR and exit")
+    parser.add_argument('--output', help="also save the JSON report here")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.record)
+        return
+
+    rows = generate_rows(args.containers, args.seed)
+    json_text = open(args.json).read() if args.json else json.dumps(rows, indent=1)
+    table_text = open(args.table).read() if args.table else format_table(rows)
+
+    results = {}
+    containers = len(podman_stats.parse_table(table_text))
+    results["legacy_table"] = summarize(time_parser(legacy_parse, table_text, args.repeat), containers)
+    results["columnar_table"] = summarize(time_parser(podman_stats.parse_table, table_text, args.repeat), containers)
+    containers = len(podman_stats.parse_json(json_text))
+    results["columnar_json"] = summarize(time_parser(podman_stats.parse_json, json_text, args.repeat), containers)
+
+    report = {
+        "config": {
+            "containers": containers,
+            "repeat": args.repeat,
+            "json": args.json or "generated",
+            "table": args.table or "generated",
+        },
+        "environment": {"python": platform.python_version(), "machine": platform.machine()},
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:15} best {result['best_ms']:9.3f} ms  median {result['median_ms']:9.3f} ms  "
+              f"{result['containers_per_s']} containers/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Asyncio runtime that hosts several controllers in one process.
+
+Work items are (controller, key) pairs on one shared priority queue. Change
+events only enqueue items: an item that is already waiting is not added
+twice, and one whose controller is busy is deferred until the running
+reconcile finishes, so a burst of events collapses into a single reconcile.
+Each controller runs one reconcile at a time, is throttled by its own token
+bucket, and after a failure retries the key with jittered exponential
+backoff. Reconcile functions are ordinary blocking code (the Kubernetes
+client, subprocesses) and run on a thread pool shared by all controllers,
+while the event loop only schedules.
+"""
+import asyncio
+import itertools
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.instrumentation import QUEUE_DEPTH, LoopTimer, counter
+
+RECONCILES = counter('controller_reconciles_total', 'Reconciles run by the controller manager', ('controller', 'result'))
+
+
+class TokenBucket:
+    """Allows `rate` reconciles per second on average, in bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def take(self):
+        """Take a token and return 0, or return the seconds until one is available without taking it"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Backoff:
+    """Per-key exponential backoff; the jitter keeps retries of different keys from lining up"""
+
+    def __init__(self, base=1.0, cap=300.0, jitter=0.5, random=random.random):
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+        self.random = random
+        self._failures = {}
+
+    def failure(self, key):
+        """Seconds to wait before retrying `key` after one more failure"""
+        failures = self._failures.get(key, 0) + 1
+        self._failures[key] = failures
+        delay = min(self.cap, self.base * 2 ** (failures - 1))
+        return delay * (1 - self.jitter * self.random())
+
+    def reset(self, key):
+        self._failures.pop(key, None)
+
+
+class Controller:
+    """A reconciler hosted by the Manager.
+
+    `reconcile(key)` is a blocking function; it may return the seconds after
+    which the same key should be reconciled again. With `resync` set,
+    `resync_key` is also queued on that period as a safety net for missed
+    events. Lower `priority` values are taken from the queue first.
+    """
+
+    def __init__(self, name, reconcile, priority=0, rate=1.0, burst=1, backoff=None, resync=None,
+                 resync_key='all'):
+        self.name = name
+        self.reconcile = reconcile
+        self.priority = priority
+        self.limiter = TokenBucket(rate, burst)
+        self.backoff = backoff or Backoff()
+        self.resync = resync
+        self.resync_key = resync_key
+        self.timer = LoopTimer(name)
+
+
+class Manager:
+    def __init__(self, workers=3):
+        self.workers = workers
+        self.controllers = {}
+        self.loop = None
+        self._queue = None
+        self._tickers = []
+        self._queued = set()  # (controller, key) waiting in the queue
+        self._due = {}  # (controller, key) -> loop time a delayed add becomes ready
+        self._active = set()  # controllers with a reconcile running
+        self._deferred = {}  # controller -> keys added while it was busy
+        self._sequence = itertools.count()
+        QUEUE_DEPTH.labels('controller_manager').set_function(lambda: len(self._queued))
+
+    def add(self, controller):
+        self.controllers[controller.name] = controller
+        return controller
+
+    def every(self, name, interval, func):
+        """Run blocking `func()` every `interval` seconds on the shared pool, e.g. to sample metrics"""
+        self._tickers.append((name, interval, func))
+
+    def enqueue(self, name, key='all', delay=0):
+        """Queue a reconcile of `key`; call from the event loop (see enqueue_threadsafe)"""
+        item = (name, key)
+        if delay > 0:
+            due = self.loop.time() + delay
+            if item in self._queued or self._due.get(item, float('inf')) <= due:
+                return  # already coming sooner
+            self._due[item] = due
+            self.loop.call_at(due, self._ready, item, due)
+            return
+        self._due.pop(item, None)
+        if name in self._active:
+            self._deferred.setdefault(name, set()).add(key)
+        elif item not in self._queued:
+            self._queued.add(item)
+            self._queue.put_nowait((self.controllers[name].priority, next(self._sequence), name, key))
+
+    def enqueue_threadsafe(self, name, key='all', delay=0):
+        """enqueue() from another thread, e.g. an informer's event handler"""
+        self.loop.call_soon_threadsafe(self.enqueue, name, key, delay)
+
+    async def run(self, on_start=None):
+        """Run until cancelled; `on_start()` is called once enqueue_threadsafe() can be used, e.g. to start informers"""
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self.loop.set_default_executor(ThreadPoolExecutor(self.workers + len(self._tickers),
+                                                          thread_name_prefix='reconcile'))
+        tasks = [self._work() for _ in range(self.workers)]
+        tasks += [self._resync(controller) for controller in self.controllers.values() if controller.resync]
+        tasks += [self._tick(*ticker) for ticker in self._tickers]
+        for controller in self.controllers.values():
+            self.enqueue(controller.name, controller.resync_key)
+        if on_start is not None:
+            on_start()
+        await asyncio.gather(*tasks)
+
+    def _ready(self, item, due):
+        if self._due.get(item) == due:  # not superseded by an earlier add
+            self.enqueue(*item)
+
+    async def _work(self):
+        while True:
+            _, _, name, key = await self._queue.get()
+            self._queued.discard((name, key))
+            controller = self.controllers[name]
+            if name in self._active:
+                self._deferred.setdefault(name, set()).add(key)
+                continue
+            wait = controller.limiter.take()
+            if wait:
+                self.enqueue(name, key, wait)
+                continue
+
+            self._active.add(name)
+            try:
+                with controller.timer.cycle():
+                    requeue = await self.loop.run_in_executor(None, controller.reconcile, key)
+            except Exception as e:
+                delay = controller.backoff.failure(key)
+                print(f"{name}: reconciling {key} failed: {e}; retrying in {delay:.1f}s")
+                RECONCILES.labels(name, 'error').inc()
+            else:
+                controller.backoff.reset(key)
+                RECONCILES.labels(name, 'success').inc()
+                delay = requeue
+            finally:
+                self._active.discard(name)
+            for deferred in self._deferred.pop(name, ()):
+                self.enqueue(name, deferred)
+            if delay is not None:
+                self.enqueue(name, key, delay)
+
+    async def _resync(self, controller):
+        while True:
+            await asyncio.sleep(controller.resync)
+            self.enqueue(controller.name, controller.resync_key)
+
+    async def _tick(self, name, interval, func):
+        timer = LoopTimer(name, interval)
+        while True:
+            with timer.cycle():
+                try:
+                    await self.loop.run_in_executor(None, func)
+                except Exception as e:
+                    print(f"{name} failed: {e}")
+            await asyncio.sleep(interval)
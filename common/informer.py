@@ -0,0 +1,219 @@
+import threading
+import time
+
+from kubernetes import watch
+from kubernetes.client.exceptions import ApiException
+
+
+def object_key(obj):
+    """Store key for an object: 'namespace/name', or just 'name' for cluster-scoped kinds"""
+    if obj.metadata.namespace:
+        return f"{obj.metadata.namespace}/{obj.metadata.name}"
+    return obj.metadata.name
+
+
+def by_namespace(obj):
+    return [obj.metadata.namespace] if obj.metadata.namespace else []
+
+
+def by_node_name(pod):
+    return [pod.spec.node_name] if pod.spec and pod.spec.node_name else []
+
+
+def by_owner_uid(obj):
+    return [owner.uid for owner in obj.metadata.owner_references or []]
+
+
+class Informer:
+    """In-process cache of one Kubernetes resource kind, kept current by a watch.
+
+    A background thread lists the resource once, then follows a watch from the
+    list's resourceVersion, resuming from the last seen version (bookmarks
+    included) after a disconnect and relisting only when the apiserver reports
+    that version as expired (410 Gone). Reads never touch the apiserver.
+
+    `indexers` maps an index name to a function returning the index values of an
+    object, e.g. {'node': by_node_name}; `by_index()` then answers from memory.
+    Handlers registered with `add_handler()` are called as handler(event_type,
+    old, new) for every change, including those found by a relist; those
+    registered with `add_error_handler()` get each failed list or watch.
+    `age()` tells how long ago the apiserver was last heard from, so callers
+    can flag a cache whose watch has been down for a while.
+    """
+
+    def __init__(self, name, list_func, indexers=None, watch_timeout=300, sync_timeout=30, **list_kwargs):
+        self.name = name
+        self.list_func = list_func
+        self.list_kwargs = list_kwargs
+        self.indexers = indexers or {}
+        self.watch_timeout = watch_timeout
+        self.sync_timeout = sync_timeout
+        self.resource_version = None
+        self._last_sync = None  # monotonic time of the last list, event, bookmark or cleanly ended watch
+        self._objects = {}
+        self._indexes = {index: {} for index in self.indexers}
+        self._handlers = []
+        self._error_handlers = []
+        self._lock = threading.RLock()
+        self._synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def add_handler(self, handler):
+        self._handlers.append(handler)
+
+    def add_error_handler(self, handler):
+        self._error_handlers.append(handler)
+
+    def has_synced(self):
+        return self._synced.is_set()
+
+    def wait_for_sync(self, timeout=None):
+        if not self._synced.wait(self.sync_timeout if timeout is None else timeout):
+            raise RuntimeError(f"{self.name} cache has not synced with the API server yet")
+
+    # Reads
+
+    def get(self, key):
+        self.wait_for_sync()
+        with self._lock:
+            return self._objects.get(key)
+
+    def list(self):
+        self.wait_for_sync()
+        with self._lock:
+            return list(self._objects.values())
+
+    def age(self):
+        """Seconds since the last list, watch event or bookmark; None before the first sync"""
+        if self._last_sync is None:
+            return None
+        return time.monotonic() - self._last_sync
+
+    def size(self):
+        """Objects currently cached; does not wait for the first sync"""
+        with self._lock:
+            return len(self._objects)
+
+    def by_index(self, index, value):
+        self.wait_for_sync()
+        with self._lock:
+            return [self._objects[key] for key in self._indexes[index].get(value, ())]
+
+    # Sync loop
+
+    def _run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                if self.resource_version is None:
+                    self._relist()
+                self._watch()
+                backoff = 1
+            except ApiException as e:
+                if e.status == 410:
+                    print(f"{self.name} watch resourceVersion {self.resource_version} expired, relisting")
+                    self.resource_version = None
+                    continue
+                print(f"{self.name} watch failed: {e.status} {e.reason}")
+                self._notify_error(e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            except Exception as e:
+                print(f"{self.name} watch failed: {e}")
+                self._notify_error(e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _relist(self):
+        result = self.list_func(**self.list_kwargs)
+        with self._lock:
+            previous = self._objects
+            self._objects = {}
+            self._indexes = {index: {} for index in self.indexers}
+            for obj in result.items:
+                self._store(object_key(obj), obj)
+            current = dict(self._objects)
+        self.resource_version = result.metadata.resource_version
+        self._last_sync = time.monotonic()
+        self._synced.set()
+
+        # Tell handlers about whatever changed while we were not watching
+        for key, old in previous.items():
+            if key not in current:
+                self._notify('DELETED', old, None)
+        for key, new in current.items():
+            old = previous.get(key)
+            if old is None:
+                self._notify('ADDED', None, new)
+            elif old.metadata.resource_version != new.metadata.resource_version:
+                self._notify('MODIFIED', old, new)
+
+    def _watch(self):
+        stream = watch.Watch().stream(
+            self.list_func,
+            resource_version=self.resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=self.watch_timeout,
+            **self.list_kwargs
+        )
+        for event in stream:
+            obj = event['object']
+            if event['type'] != 'BOOKMARK':
+                key = object_key(obj)
+                with self._lock:
+                    old = self._objects.get(key)
+                    if event['type'] == 'DELETED':
+                        self._remove(key)
+                    else:
+                        self._store(key, obj)
+                if event['type'] == 'DELETED':
+                    self._notify('DELETED', old or obj, None)
+                else:
+                    self._notify('MODIFIED' if old is not None else 'ADDED', old, obj)
+            self.resource_version = obj.metadata.resource_version
+            self._last_sync = time.monotonic()
+            if self._stopped.is_set():
+                return
+        self._last_sync = time.monotonic()  # the watch ran to its timeout, so nothing was missed
+
+    def _notify(self, event_type, old, new):
+        for handler in self._handlers:
+            try:
+                handler(event_type, old, new)
+            except Exception as e:
+                print(f"{self.name} event handler failed: {e}")
+
+    def _notify_error(self, error):
+        for handler in self._error_handlers:
+            try:
+                handler(error)
+            except Exception as e:
+                print(f"{self.name} error handler failed: {e}")
+
+    def _store(self, key, obj):
+        self._remove(key)
+        self._objects[key] = obj
+        for index, func in self.indexers.items():
+            for value in func(obj):
+                self._indexes[index].setdefault(value, set()).add(key)
+
+    def _remove(self, key):
+        old = self._objects.pop(key, None)
+        if old is None:
+            return
+        for index, func in self.indexers.items():
+            for value in func(old):
+                keys = self._indexes[index].get(value)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._indexes[index][value]
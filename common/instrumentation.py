@@ -0,0 +1,484 @@
+"""Lightweight metrics and profiling shared by every service and control loop.
+
+Counters, gauges and histograms live in one process-wide registry and are
+served in the Prometheus text format by a small HTTP server:
+
+    from common import instrumentation
+    instrumentation.serve(9101)                     # METRICS_PORT overrides, 0 disables
+    instrumentation.instrument_subprocess()         # time every subprocess.run (see record_subprocess for Popen)
+    instrumentation.instrument_kubernetes()         # time every Kubernetes API call
+    loop = instrumentation.LoopTimer('autoscaler', interval=90)
+    with loop.cycle():
+        ...
+
+Hot stacks are available on demand when the profiler is opted into with
+PROFILER_ENABLED=1: GET /debug/profile?seconds=5 samples all threads for that
+long and returns the most frequent stacks in folded (flame graph) format, and
+GET /debug/stacks dumps every thread's current stack.
+"""
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _default(self):
+        """The unlabelled child, for metrics without labels"""
+        return self.labels()
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from `function()` at scrape time, e.g. a queue's qsize"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return float('nan')
+        return self.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"]
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Histogram(self.buckets)
+
+    def _render_child(self, values, child):
+        with child.lock:
+            counts, count, total = list(child.counts), child.count, child.sum
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values, [('le', '+Inf')])
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Register `metric`, or return the one already registered under its name"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+# Metrics shared by every process
+SUBPROCESS_SECONDS = histogram('subprocess_duration_seconds', 'Wall time of subprocesses', ('command', 'outcome'))
+KUBERNETES_SECONDS = histogram('kubernetes_request_duration_seconds', 'Kubernetes API call latency', ('method', 'path', 'code'))
+LOOP_SECONDS = histogram('loop_cycle_duration_seconds', 'Duration of one control loop cycle', ('loop',))
+LOOP_LAG = gauge('loop_lag_seconds', 'How late the last cycle started compared to its interval', ('loop',))
+QUEUE_DEPTH = gauge('queue_depth', 'Items waiting in an internal queue', ('queue',))
+CACHE_REQUESTS = counter('cache_requests_total', 'Cache lookups by result', ('cache', 'result'))
+HTTP_SECONDS = histogram('http_request_duration_seconds', 'HTTP request latency', ('app', 'method', 'route', 'status'))
+
+
+class LoopTimer:
+    """Records the duration of each cycle of a loop and, for fixed-interval loops, how late it started"""
+
+    def __init__(self, name, interval=None):
+        self.name = name
+        self.interval = interval
+        self._last_start = None
+        self._duration = LOOP_SECONDS.labels(name)
+        self._lag = LOOP_LAG.labels(name)
+
+    @contextmanager
+    def cycle(self):
+        start = time.monotonic()
+        if self.interval is not None and self._last_start is not None:
+            self._lag.set(max(0.0, start - self._last_start - self.interval))
+        self._last_start = start
+        try:
+            yield
+        finally:
+            self._duration.observe(time.monotonic() - start)
+
+
+def command_label(args):
+    """'podman stats --no-stream' -> 'podman stats'; keeps label cardinality low"""
+    if isinstance(args, (str, bytes)):
+        args = (args.decode() if isinstance(args, bytes) else args).split()
+    words = [os.path.basename(str(args[0]))] if args else ['']
+    for arg in list(args)[1:2]:
+        arg = str(arg)
+        if not arg.startswith('-') and '/' not in arg and '=' not in arg:
+            words.append(arg)
+    return ' '.join(words)
+
+
+def record_subprocess(args, returncode, seconds, command=None):
+    """Record a subprocess that was driven through Popen directly, e.g. a streamed `kubectl exec tar`.
+
+    `command` overrides the label derived from `args`, to tell such streams
+    apart from short calls of the same program.
+    """
+    outcome = 'error' if returncode is None else 'ok' if returncode == 0 else 'failed'
+    SUBPROCESS_SECONDS.labels(command or command_label(args), outcome).observe(seconds)
+
+
+def instrument_subprocess():
+    """Time every subprocess.run and check_output (which calls run).
+
+    call, check_call and Popen are not wrapped; code that streams through
+    Popen reports its processes with record_subprocess() instead.
+    """
+    if getattr(subprocess.run, '_instrumented', False):
+        return
+    original = subprocess.run
+
+    @functools.wraps(original)
+    def run(*popenargs, **kwargs):
+        args = popenargs[0] if popenargs else kwargs.get('args', '')
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = original(*popenargs, **kwargs)
+            outcome = 'ok' if result.returncode == 0 else 'failed'
+            return result
+        except subprocess.CalledProcessError:
+            outcome = 'failed'
+            raise
+        finally:
+            SUBPROCESS_SECONDS.labels(command_label(args), outcome).observe(time.perf_counter() - start)
+
+    run._instrumented = True
+    subprocess.run = run
+
+
+def path_template(path):
+    """'/api/v1/namespaces/default/pods/web-1' -> '/api/v1/namespaces/{name}/pods/{name}'"""
+    path = path.split('?', 1)[0]
+    if '{' in path:
+        return path
+    parts = path.strip('/').split('/')
+    prefix = 2 if parts[:1] == ['api'] else 3  # /api/v1 or /apis/<group>/<version>
+    rest = parts[prefix:]
+    return '/' + '/'.join(parts[:prefix] + [part if i % 2 == 0 else '{name}' for i, part in enumerate(rest)])
+
+
+def instrument_kubernetes():
+    """Time every HTTP request the Kubernetes client makes, typed and dynamic clients and watches alike"""
+    from kubernetes.client import rest
+    from kubernetes.client.exceptions import ApiException
+
+    if getattr(rest.RESTClientObject.request, '_instrumented', False):
+        return
+    original = rest.RESTClientObject.request
+
+    @functools.wraps(original)
+    def request(self, method, url, *args, **kwargs):
+        url = urlparse(url)
+        # Newer clients put the query in the URL, older ones pass query_params separately
+        watch = parse_qs(url.query).get('watch', []) + [str(v) for k, v in kwargs.get('query_params') or [] if k == 'watch']
+        watching = any(value.lower() in ('true', '1') for value in watch)
+        start = time.perf_counter()
+        code = 'error'
+        try:
+            response = original(self, method, url.geturl(), *args, **kwargs)
+            code = str(response.status)
+            return response
+        except ApiException as e:
+            code = str(e.status)
+            raise
+        finally:
+            label_method = 'WATCH' if watching else method
+            KUBERNETES_SECONDS.labels(label_method, path_template(url.path), code).observe(time.perf_counter() - start)
+
+    request._instrumented = True
+    rest.RESTClientObject.request = request
+
+
+def instrument_flask(app, name):
+    """Time every request a Flask app serves, labelled by its route rule"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.instrumentation_start = time.perf_counter()
+
+    @app.after_request
+    def observe(response):
+        start = g.pop('instrumentation_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_SECONDS.labels(name, request.method, route, str(response.status_code)).observe(time.perf_counter() - start)
+        return response
+
+    return app
+
+
+def instrument_asgi(app, name, route=lambda path: path):
+    """Wrap an ASGI app so every HTTP request is timed; `route` maps a path to a low-cardinality label"""
+    async def instrumented(scope, receive, send):
+        if scope['type'] != 'http':
+            await app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = ['500']
+
+        async def send_and_record(message):
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+            await send(message)
+
+        try:
+            await app(scope, receive, send_and_record)
+        finally:
+            HTTP_SECONDS.labels(name, scope['method'], route(scope['path']), status[0]).observe(time.perf_counter() - start)
+
+    return instrumented
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts identical stacks"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+
+    def sample(self, seconds):
+        """Profile for `seconds`; returns a Counter of folded stacks ('file:func;file:func')"""
+        stacks = StackCounter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stacks[self._fold(frame)] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+def dump_stacks():
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    out = []
+    for thread_id, frame in sys._current_frames().items():
+        out.append(f"Thread {names.get(thread_id, thread_id)}:\n{''.join(traceback.format_stack(frame))}")
+    return '\n'.join(out)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    profiler = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            self._send(200, REGISTRY.render(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif url.path == '/debug/profile' and self.profiler is not None:
+            query = parse_qs(url.query)
+            seconds = min(float(query.get('seconds', ['5'])[0]), 60)
+            top = int(query.get('top', ['50'])[0])
+            stacks = self.profiler.sample(seconds)
+            self._send(200, ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common(top)))
+        elif url.path == '/debug/stacks' and self.profiler is not None:
+            self._send(200, dump_stacks())
+        else:
+            self._send(404, 'not found\n')
+
+    def _send(self, status, body, content_type='text/plain; charset=utf-8'):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would drown the service's own logs
+
+
+def serve(port, addr=None):
+    """Serve /metrics (and the opt-in profiler) on a background thread.
+
+    METRICS_PORT and METRICS_ADDR override the arguments; port 0 disables the
+    server. Returns the server, or None if it is disabled or the port is taken.
+    """
+    port = int(os.environ.get('METRICS_PORT', port))
+    addr = os.environ.get('METRICS_ADDR', addr or '127.0.0.1')
+    if not port:
+        return None
+    handler = type('Handler', (_Handler,), {})
+    if os.environ.get('PROFILER_ENABLED') == '1':
+        handler.profiler = SamplingProfiler(float(os.environ.get('PROFILER_INTERVAL', '0.01')))
+    try:
+        server = ThreadingHTTPServer((addr, port), handler)
+    except OSError as e:
+        print(f"Metrics server not started on {addr}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
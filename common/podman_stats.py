@@ -0,0 +1,157 @@
+"""Parse `podman stats` output into columns of NumPy arrays.
+
+Both the node temperature controller and the dashboard read node container
+stats through this module. JSON output (`--format json`) is preferred; the
+plain table is parsed as a fallback for podman versions without it.
+
+Sizes are converted to bytes with decimal (kB, MB, GB, TB, PB) and binary
+(KiB, MiB, GiB, TiB, PiB) units both understood. Anything that cannot be
+parsed, such as podman's "--" for a stopped container, becomes NaN rather
+than 0.
+"""
+import json
+import re
+import subprocess
+
+import numpy as np
+
+UNIT_BYTES = {
+    '': 1, 'b': 1,
+    'k': 1e3, 'kb': 1e3, 'm': 1e6, 'mb': 1e6, 'g': 1e9, 'gb': 1e9,
+    't': 1e12, 'tb': 1e12, 'p': 1e15, 'pb': 1e15,
+    'ki': 2 ** 10, 'kib': 2 ** 10, 'mi': 2 ** 20, 'mib': 2 ** 20, 'gi': 2 ** 30, 'gib': 2 ** 30,
+    'ti': 2 ** 40, 'tib': 2 ** 40, 'pi': 2 ** 50, 'pib': 2 ** 50,
+}
+
+# A number, an optional unit and an optional '%', e.g. '412.8MB', '2GiB', '12.5%'
+_NUMBER = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)?[ \t]*([A-Za-z]*)[ \t]*%?[ \t]*'
+# Exactly one match per line, falling back to an empty match for lines like '--'
+_QUANTITY = re.compile(rf'^[ \t]*(?:{_NUMBER}$|.*$)', re.MULTILINE)
+_USAGE = re.compile(rf'^[ \t]*(?:{_NUMBER}/[ \t]*{_NUMBER}$|.*$)', re.MULTILINE)
+_TABLE_COLUMN = re.compile(r'\S+(?: \S+)*')
+
+
+class PodmanStats:
+    """Stats for a set of containers, one array per column, row i is one container"""
+
+    def __init__(self, names, cpu_percent, mem_used_bytes, mem_limit_bytes, mem_percent, cpu_time):
+        self.names = names
+        self.cpu_percent = cpu_percent
+        self.mem_used_bytes = mem_used_bytes
+        self.mem_limit_bytes = mem_limit_bytes
+        self.mem_percent = mem_percent
+        self.cpu_time = cpu_time
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _match_columns(pattern, values, groups):
+    """Run `pattern` over all values joined by newlines and return its groups as columns"""
+    text = '\n'.join(values)
+    if text.count('\n') != len(values) - 1:
+        text = '\n'.join(value.replace('\n', ' ') for value in values)
+    matches = pattern.findall(text) if values else []
+    if len(matches) != len(values):
+        matches = [('',) * groups] * len(values)
+    return list(zip(*matches)) or [()] * groups
+
+
+def _numbers(column):
+    return np.array([number or 'nan' for number in column], dtype=np.float64)
+
+
+def _bytes(numbers, units):
+    factors = np.array([UNIT_BYTES.get(unit.lower(), np.nan) for unit in units], dtype=np.float64)
+    return _numbers(numbers) * factors
+
+
+def parse_sizes(values):
+    """Sizes such as '412.8MB', '2.042GiB', '0B' to bytes; unknown units give NaN"""
+    numbers, units = _match_columns(_QUANTITY, values, 2)
+    return _bytes(numbers, units)
+
+
+def parse_percents(values):
+    """Percentages such as '12.34%' to floats"""
+    return _numbers(_match_columns(_QUANTITY, values, 2)[0])
+
+
+def parse_usage(values):
+    """'412.8MB / 2.042GB' values to arrays of used and limit bytes"""
+    used, used_units, limit, limit_units = _match_columns(_USAGE, values, 4)
+    return _bytes(used, used_units), _bytes(limit, limit_units)
+
+
+def _build(names, cpu, mem_usage, mem, cpu_time):
+    used, limit = parse_usage(mem_usage)
+    return PodmanStats(
+        names=np.array(names, dtype=object),
+        cpu_percent=parse_percents(cpu),
+        mem_used_bytes=used,
+        mem_limit_bytes=limit,
+        mem_percent=parse_percents(mem),
+        cpu_time=np.array(cpu_time, dtype=object),
+    )
+
+
+def parse_json(text):
+    """Parse `podman stats --no-stream --format json`"""
+    rows = json.loads(text) or []
+    return _build(
+        [row.get('name', '') for row in rows],
+        [str(row.get('cpu_percent', '')) for row in rows],
+        [str(row.get('mem_usage', '')) for row in rows],
+        [str(row.get('mem', row.get('mem_percent', ''))) for row in rows],
+        [str(row.get('cpu_time', '')) for row in rows],
+    )
+
+
+def parse_table(text):
+    """Parse the default `podman stats --no-stream` table.
+
+    Columns are sliced at the offsets of the header titles, which podman aligns
+    its values to, so values containing single spaces ('412.8MB / 2.042GB')
+    stay in one piece.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return _build([], [], [], [], [])
+    header, body = lines[0], lines[1:]
+    starts = [match.start() for match in _TABLE_COLUMN.finditer(header)]
+    bounds = {match.group(): (start, end) for match, start, end in
+              zip(_TABLE_COLUMN.finditer(header), starts, starts[1:] + [None])}
+
+    def column(title):
+        if title not in bounds:
+            return [''] * len(body)
+        start, end = bounds[title]
+        return [line[start:end].strip() for line in body]
+
+    return _build(column('NAME'), column('CPU %'), column('MEM USAGE / LIMIT'), column('MEM %'), column('CPU TIME'))
+
+
+def parse(text):
+    """Parse either output format, telling them apart by the leading '['"""
+    if text.lstrip().startswith('['):
+        return parse_json(text)
+    return parse_table(text)
+
+
+def collect(timeout=30):
+    """Run `podman stats` once, using JSON when this podman supports it.
+
+    Raises subprocess.CalledProcessError if podman fails in both formats.
+    """
+    try:
+        result = subprocess.run(
+            ['podman', 'stats', '--no-stream', '--format', 'json'],
+            capture_output=True, text=True, check=True, timeout=timeout,
+        )
+        return parse_json(result.stdout)
+    except (subprocess.CalledProcessError, ValueError):
+        result = subprocess.run(
+            ['podman', 'stats', '--no-stream'],
+            capture_output=True, text=True, check=True, timeout=timeout,
+        )
+        return parse_table(result.stdout)
@@ -0,0 +1,244 @@
+"""Versioned snapshots of cluster resources and tiered, parallel restore.
+
+A snapshot holds the cleaned manifest ("neat": no status, uid, managed
+fields, ...) and resourceVersion of every object of the kinds in
+SNAPSHOT_KINDS, gzip-compressed under <root>/<version>.json.gz. A new
+snapshot is only written when some object was added, removed or changed its
+resourceVersion with a visible difference in its manifest; that difference is
+recorded per object as a list of changed paths.
+
+Restore applies a snapshot tier by tier (namespaces, volumes, config,
+workloads, services) with concurrent server-side apply inside each tier.
+"""
+import gzip
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes.dynamic.exceptions import ResourceNotFoundError
+
+# (tier, apiVersion, kind) in restore order; objects within a tier are applied concurrently
+SNAPSHOT_KINDS = [
+    (0, 'v1', 'Namespace'),
+    (1, 'v1', 'PersistentVolume'),
+    (1, 'v1', 'PersistentVolumeClaim'),
+    (2, 'v1', 'ConfigMap'),
+    (3, 'apps/v1', 'Deployment'),
+    (3, 'apps/v1', 'StatefulSet'),
+    (3, 'apps/v1', 'DaemonSet'),
+    (3, 'batch/v1', 'Job'),
+    (3, 'batch/v1', 'CronJob'),
+    (3, 'v1', 'Pod'),
+    (4, 'v1', 'Service'),
+    (4, 'autoscaling/v2', 'HorizontalPodAutoscaler'),
+]
+
+SYSTEM_NAMESPACES = {'kube-system', 'kube-public', 'kube-node-lease', 'kubernetes-dashboard'}
+# Objects the cluster creates for itself
+SKIP_OBJECTS = {('ConfigMap', 'kube-root-ca.crt'), ('Service', 'kubernetes')}
+
+METADATA_FIELDS = ('name', 'namespace', 'labels', 'annotations')
+DROP_ANNOTATIONS = ('kubectl.kubernetes.io/last-applied-configuration', 'deployment.kubernetes.io/revision')
+DROP_ANNOTATION_PREFIXES = ('pv.kubernetes.io/', 'volume.kubernetes.io/', 'volume.beta.kubernetes.io/')
+JOB_GENERATED_LABELS = ('controller-uid', 'job-name', 'batch.kubernetes.io/controller-uid', 'batch.kubernetes.io/job-name')
+
+
+def object_key(manifest):
+    metadata = manifest['metadata']
+    return f"{manifest['apiVersion']}/{manifest['kind']}/{metadata.get('namespace') or ''}/{metadata['name']}"
+
+
+def is_snapshotted(obj):
+    metadata = obj['metadata']
+    if metadata.get('ownerReferences'):
+        return False  # recreated by its controller
+    if metadata.get('namespace') in SYSTEM_NAMESPACES or (obj['kind'] == 'Namespace' and metadata['name'] in SYSTEM_NAMESPACES):
+        return False
+    return (obj['kind'], metadata['name']) not in SKIP_OBJECTS
+
+
+def clean(obj):
+    """Strip an object down to what is needed to recreate it"""
+    metadata = {field: obj['metadata'][field] for field in METADATA_FIELDS if obj['metadata'].get(field)}
+    annotations = {key: value for key, value in metadata.get('annotations', {}).items()
+                   if key not in DROP_ANNOTATIONS and not key.startswith(DROP_ANNOTATION_PREFIXES)}
+    if annotations:
+        metadata['annotations'] = annotations
+    else:
+        metadata.pop('annotations', None)
+
+    manifest = {'apiVersion': obj['apiVersion'], 'kind': obj['kind'], 'metadata': metadata}
+    for field, value in obj.items():
+        if field not in ('apiVersion', 'kind', 'metadata', 'status'):
+            manifest[field] = json.loads(json.dumps(value))
+
+    spec = manifest.get('spec', {})
+    if obj['kind'] == 'PersistentVolume':
+        spec.pop('claimRef', None)
+    elif obj['kind'] == 'Service':
+        spec.pop('clusterIP', None)
+        spec.pop('clusterIPs', None)
+    elif obj['kind'] == 'Pod':
+        spec.pop('nodeName', None)
+    elif obj['kind'] == 'Job':
+        spec.pop('selector', None)
+        labels = spec.get('template', {}).get('metadata', {}).get('labels', {})
+        for label in JOB_GENERATED_LABELS:
+            labels.pop(label, None)
+    return manifest
+
+
+def diff(old, new, path=''):
+    """Paths that differ between two manifests, as [{"path", "old", "new"}]"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new)):
+            changes.extend(diff(old.get(key), new.get(key), f"{path}.{key}" if path else key))
+        return changes
+    if old != new:
+        return [{'path': path, 'old': old, 'new': new}]
+    return []
+
+
+class SnapshotStore:
+    """Gzip-compressed JSON snapshots named by creation time, newest `keep` retained"""
+
+    def __init__(self, root, keep=48):
+        self.root = root
+        self.keep = keep
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name[:-len('.json.gz')] for name in os.listdir(self.root) if name.endswith('.json.gz'))
+
+    def load(self, version=None):
+        """The snapshot `version`, or the latest one; None if there is none"""
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                return None
+            version = versions[-1]
+        path = os.path.join(self.root, f"{version}.json.gz")
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt') as f:
+            return json.load(f)
+
+    def save(self, snapshot):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, os.path.join(self.root, f"{snapshot['version']}.json.gz"))
+        self.prune()
+
+    def prune(self):
+        for version in self.versions()[:-self.keep] if self.keep else []:
+            os.unlink(os.path.join(self.root, f"{version}.json.gz"))
+
+
+class ClusterSnapshotter:
+    """Takes snapshots through a kubernetes.dynamic.DynamicClient and restores them"""
+
+    def __init__(self, dynamic_client, store, kinds=SNAPSHOT_KINDS, workers=8, field_manager='cluster-dr'):
+        self.client = dynamic_client
+        self.store = store
+        self.kinds = kinds
+        self.workers = workers
+        self.field_manager = field_manager
+
+    def collect(self):
+        """{key: {"tier", "resourceVersion", "manifest"}} for every snapshotted object, one list call per kind"""
+        def list_kind(kind):
+            tier, api_version, name = kind
+            try:
+                resource = self.client.resources.get(api_version=api_version, kind=name)
+            except ResourceNotFoundError:
+                return tier, api_version, name, []  # API not served by this cluster version
+            items = resource.get().to_dict().get('items', [])
+            return tier, api_version, name, items
+
+        objects = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for tier, api_version, kind, items in pool.map(list_kind, self.kinds):
+                for obj in items:
+                    obj = dict(obj, apiVersion=api_version, kind=kind)
+                    if not is_snapshotted(obj):
+                        continue
+                    manifest = clean(obj)
+                    objects[object_key(manifest)] = {
+                        'tier': tier,
+                        'resourceVersion': obj['metadata'].get('resourceVersion'),
+                        'manifest': manifest,
+                    }
+        return objects
+
+    def snapshot(self):
+        """Write a new snapshot if anything changed; returns it, or None if nothing did"""
+        started = time.time()
+        objects = self.collect()
+        previous = self.store.load()
+        old_objects = previous['objects'] if previous else {}
+
+        added = sorted(set(objects) - set(old_objects))
+        removed = sorted(set(old_objects) - set(objects))
+        changed = {}
+        for key in set(objects) & set(old_objects):
+            if objects[key]['resourceVersion'] == old_objects[key]['resourceVersion']:
+                continue
+            changes = diff(old_objects[key]['manifest'], objects[key]['manifest'])
+            if changes:
+                changed[key] = changes
+        if previous is not None and not (added or removed or changed):
+            return None  # only status or other stripped fields moved
+
+        snapshot = {
+            'version': time.strftime('%Y%m%dT%H%M%S', time.gmtime(started)) + f"-{int(started * 1000) % 1000:03d}",
+            'created': started,
+            'parent': previous['version'] if previous else None,
+            'changes': {'added': added, 'removed': removed, 'changed': changed},
+            'objects': objects,
+        }
+        self.store.save(snapshot)
+        return snapshot
+
+    def restore(self, version=None):
+        """Apply a snapshot tier by tier; returns a report with per-tier timings, or None if there is no snapshot"""
+        snapshot = self.store.load(version)
+        if snapshot is None:
+            return None
+        tiers = {}
+        for key, entry in snapshot['objects'].items():
+            tiers.setdefault(entry['tier'], []).append((key, entry['manifest']))
+
+        report = {'version': snapshot['version'], 'tiers': [], 'failed': {}}
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for tier in sorted(tiers):
+                tier_started = time.time()
+                results = list(pool.map(lambda item: (item[0], self.apply(item[1])), tiers[tier]))
+                errors = {key: error for key, error in results if error is not None}
+                report['failed'].update(errors)
+                report['tiers'].append({
+                    'tier': tier,
+                    'objects': len(results),
+                    'failed': len(errors),
+                    'seconds': round(time.time() - tier_started, 3),
+                })
+        report['seconds'] = round(time.time() - started, 3)
+        return report
+
+    def apply(self, manifest):
+        """Server-side apply one object; returns None or the error message"""
+        try:
+            resource = self.client.resources.get(api_version=manifest['apiVersion'], kind=manifest['kind'])
+            self.client.server_side_apply(
+                resource, body=manifest, namespace=manifest['metadata'].get('namespace'),
+                field_manager=self.field_manager, force_conflicts=True,
+            )
+            return None
+        except Exception as e:
+            return str(e)
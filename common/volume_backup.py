@@ -0,0 +1,438 @@
+"""Incremental, content-addressed backups of pod volumes.
+
+Each backup run streams a volume out of its pod as a tar over `kubectl exec`,
+splits every file into fixed-size chunks and stores each chunk once under its
+SHA-256 in a local chunk store. A manifest per run records the files of every
+volume and the chunks they are made of, so any run can be restored later:
+
+    <root>/chunks/ab/ab12...          zlib-compressed chunk, named by its digest
+    <root>/manifests/<ns>/<pod>/<version>.json
+
+Before streaming, the volume is listed with `find` + `stat` and only files
+whose size or mtime differ from the previous manifest are put in the tar, so
+unchanged data is neither transferred nor stored again. Containers without
+`stat` fall back to a full tar, which still only stores new chunks.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+
+from common.instrumentation import record_subprocess
+
+CHUNK_SIZE = 1024 * 1024
+
+# find + stat listing run inside the container; one line per entry
+LIST_SCRIPT = 'cd "$1" && find . -exec stat -c "%F|%s|%Y|%a|%u|%g|%n" {} +'
+
+ENTRY_TYPES = {'regular file': 'file', 'regular empty file': 'file', 'directory': 'dir', 'symbolic link': 'symlink'}
+
+
+class BackupError(Exception):
+    pass
+
+
+def _in_background(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def _feed(stream, data):
+    """Write `data` to a child's stdin and close it; runs on its own thread so the child's output is read meanwhile"""
+    try:
+        if data:
+            stream.write(data)
+    except BrokenPipeError:
+        pass  # the child exited early; its error is reported by the caller
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+
+def _drain(stream, into):
+    """Read a child's stderr to the end, so a chatty child never blocks on a full pipe"""
+    into.append(stream.read())
+    stream.close()
+
+
+class ChunkStore:
+    """Chunks stored once each under their SHA-256, compressed on disk"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data):
+        """Store `data` unless it is already there; returns (digest, newly stored)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(data, 1))
+        os.replace(tmp, path)
+        return digest, True
+
+    def get(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def digests(self):
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            for name in os.listdir(os.path.join(self.root, prefix)):
+                if not name.startswith('.tmp-'):
+                    yield name
+
+    def remove(self, digest):
+        os.unlink(self.path(digest))
+
+
+class ChunkReader:
+    """File-like reader over a list of chunks, used to feed files into a tar"""
+
+    def __init__(self, store, digests):
+        self.store = store
+        self.digests = list(digests)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while self.digests and (size < 0 or len(self.buffer) < size):
+            self.buffer += self.store.get(self.digests.pop(0))
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def entry_path(name):
+    """Normalise './a/b' and 'a/b' to 'a/b'; the volume root itself is ''"""
+    while name.startswith('./'):
+        name = name[2:]
+    return '' if name == '.' else name.rstrip('/')
+
+
+def parse_listing(text):
+    """Parse LIST_SCRIPT output into {path: entry without chunks}"""
+    entries = {}
+    for line in text.splitlines():
+        parts = line.split('|', 6)
+        if len(parts) != 7:
+            continue
+        kind, size, mtime, mode, uid, gid, name = parts
+        path = entry_path(name)
+        if path and kind in ENTRY_TYPES:
+            entries[path] = {
+                'path': path, 'type': ENTRY_TYPES[kind], 'size': int(size), 'mtime': int(mtime),
+                'mode': int(mode, 8), 'uid': int(uid), 'gid': int(gid),
+            }
+    return entries
+
+
+class VolumeBackup:
+    """Backs up and restores pod volumes through a chunk store and per-run manifests"""
+
+    def __init__(self, root, kubectl='kubectl', chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.kubectl = kubectl
+        self.chunk_size = chunk_size
+        self.chunks = ChunkStore(os.path.join(root, 'chunks'))
+
+    # Manifests
+
+    def manifest_dir(self, namespace, pod):
+        return os.path.join(self.root, 'manifests', namespace, pod)
+
+    def versions(self, namespace, pod):
+        """Backup versions of a pod, oldest first"""
+        directory = self.manifest_dir(namespace, pod)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+
+    def backed_up_pods(self):
+        """(namespace, pod) pairs that have at least one backup"""
+        base = os.path.join(self.root, 'manifests')
+        if not os.path.isdir(base):
+            return []
+        return [(namespace, pod)
+                for namespace in sorted(os.listdir(base))
+                for pod in sorted(os.listdir(os.path.join(base, namespace)))
+                if self.versions(namespace, pod)]
+
+    def load_manifest(self, namespace, pod, version=None):
+        """The manifest of `version`, or of the latest backup; None if there is none"""
+        if version is None:
+            versions = self.versions(namespace, pod)
+            if not versions:
+                return None
+            version = versions[-1]
+        path = os.path.join(self.manifest_dir(namespace, pod), f"{version}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        directory = self.manifest_dir(manifest['namespace'], manifest['pod'])
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(directory, f"{manifest['version']}.json"))
+
+    # Backup
+
+    def backup_pod(self, namespace, pod, mounts):
+        """Back up `mounts` [(container, mount_path)] of a pod.
+
+        Returns the new manifest, or the previous one unchanged if no file
+        differs from the last backup (no new version is written then).
+        """
+        previous = self.load_manifest(namespace, pod)
+        previous_volumes = {(v['container'], v['mount_path']): v for v in previous['volumes']} if previous else {}
+        started = time.time()
+        stats = {'files': 0, 'bytes_transferred': 0, 'new_chunks': 0, 'new_bytes': 0, 'incomplete_volumes': 0}
+        volumes = []
+        for container, mount_path in mounts:
+            volume_previous = previous_volumes.get((container, mount_path))
+            entries = self._backup_volume(namespace, pod, container, mount_path, volume_previous, started, stats)
+            volumes.append({'container': container, 'mount_path': mount_path, 'entries': entries})
+
+        if previous is not None and volumes == previous['volumes']:
+            return previous
+        manifest = {
+            'version': time.strftime('%Y%m%dT%H%M%S', time.gmtime(started)) + f"-{int(started * 1000) % 1000:03d}",
+            'namespace': namespace,
+            'pod': pod,
+            'started': started,
+            'finished': time.time(),
+            'parent': previous['version'] if previous else None,
+            'stats': stats,
+            'volumes': volumes,
+        }
+        self.save_manifest(manifest)
+        return manifest
+
+    def _backup_volume(self, namespace, pod, container, mount_path, previous, started, stats):
+        listing = self._list_volume(namespace, pod, container, mount_path)
+        old_entries = {entry['path']: entry for entry in previous['entries']} if previous else {}
+
+        if listing is None:
+            changed = None  # full tar
+        else:
+            changed = []
+            for path, entry in listing.items():
+                old = old_entries.get(path)
+                if entry['type'] == 'dir':
+                    continue
+                if (old is None or old.get('racy') or old['type'] != entry['type']
+                        or old['size'] != entry['size'] or old['mtime'] != entry['mtime']):
+                    changed.append(path)
+
+        streamed, complete = {}, True
+        if changed is None or changed:
+            streamed, complete = self._stream_tar(namespace, pod, container, mount_path, changed, stats)
+        if not complete:
+            # tar failed part-way: files it did not send keep their previous entries (and chunks,
+            # so prune keeps them) and are read again next run, rather than dropping out of the backup
+            stats['incomplete_volumes'] += 1
+            carried = {path: dict(entry, racy=True) for path, entry in old_entries.items() if path not in streamed}
+        else:
+            carried = {}
+        for entry in streamed.values():
+            # mtime has one-second resolution, so a file written while this run read it
+            # could change again without its mtime moving; read it once more next run
+            if entry['type'] == 'file' and entry['mtime'] >= int(started) - 1:
+                entry['racy'] = True
+
+        if listing is None:
+            entries = list(streamed.values()) + list(carried.values())
+        else:
+            entries = []
+            for path, entry in listing.items():
+                if path in streamed:
+                    entries.append(streamed[path])
+                elif entry['type'] == 'dir':
+                    entries.append(entry)
+                elif path in old_entries:
+                    old = carried.get(path, old_entries[path])
+                    entries.append(dict(old, mode=entry['mode'], uid=entry['uid'], gid=entry['gid']))
+                # anything else vanished between the listing and the tar
+        stats['files'] += sum(1 for entry in entries if entry['type'] == 'file')
+        return sorted(entries, key=lambda entry: entry['path'])
+
+    def _exec(self, namespace, pod, container, command):
+        return [self.kubectl, 'exec', '-i', '-n', namespace, pod, '-c', container, '--'] + command
+
+    def _list_volume(self, namespace, pod, container, mount_path):
+        result = subprocess.run(
+            self._exec(namespace, pod, container, ['sh', '-c', LIST_SCRIPT, 'sh', mount_path]),
+            capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            return None
+        return parse_listing(result.stdout)
+
+    def _stream_tar(self, namespace, pod, container, mount_path, paths, stats):
+        """Stream `paths` (None for everything) out of the pod and store their chunks.
+
+        Returns ({path: entry}, complete); complete is False if tar exited
+        non-zero after sending some entries, so others may be missing.
+        """
+        if paths is None:
+            command = ['tar', 'cf', '-', '-C', mount_path, '.']
+            names = None
+        else:
+            command = ['tar', 'cf', '-', '-C', mount_path, '-T', '-']
+            names = ''.join(f"./{path}\n" for path in paths).encode()
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            self._exec(namespace, pod, container, command),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        # The name list can be larger than a pipe buffer, and tar starts writing the archive
+        # before it has read all of it, so stdin and stderr are serviced while stdout is read
+        errors = []
+        threads = [_in_background(_feed, process.stdin, names), _in_background(_drain, process.stderr, errors)]
+
+        entries = {}
+        try:
+            with tarfile.open(fileobj=process.stdout, mode='r|') as archive:
+                for member in archive:
+                    entry = self._store_member(archive, member, stats)
+                    if entry is not None:
+                        entries[entry['path']] = entry
+        except tarfile.TarError as e:
+            process.kill()
+            raise BackupError(f"Reading tar of {namespace}/{pod}:{mount_path} failed: {e}")
+        finally:
+            process.stdout.close()
+            process.wait()
+            for thread in threads:
+                thread.join()
+            record_subprocess(process.args, process.returncode, time.perf_counter() - start, 'kubectl exec tar cf')
+        stderr = b''.join(errors).decode(errors='replace')
+        if process.returncode != 0 and not entries:
+            raise BackupError(f"tar in {namespace}/{pod}:{mount_path} failed: {stderr.strip()}")
+        return entries, process.returncode == 0
+
+    def _store_member(self, archive, member, stats):
+        path = entry_path(member.name)
+        if not path:
+            return None
+        entry = {'path': path, 'size': member.size, 'mtime': int(member.mtime),
+                 'mode': member.mode, 'uid': member.uid, 'gid': member.gid}
+        if member.isdir():
+            entry.update(type='dir', size=0)
+        elif member.issym():
+            entry.update(type='symlink', size=0, target=member.linkname)
+        elif member.isfile():
+            entry.update(type='file', chunks=[])
+            source = archive.extractfile(member)
+            while True:
+                data = source.read(self.chunk_size)
+                if not data:
+                    break
+                digest, new = self.chunks.put(data)
+                entry['chunks'].append(digest)
+                stats['bytes_transferred'] += len(data)
+                if new:
+                    stats['new_chunks'] += 1
+                    stats['new_bytes'] += len(data)
+        else:
+            return None  # devices, fifos and hard links are not backed up
+        return entry
+
+    # Restore
+
+    def restore_pod(self, namespace, pod, version=None, target_pod=None):
+        """Write the files of a backup version back into the pod's volumes.
+
+        `target_pod` restores into a different pod, e.g. the replacement of a
+        pod that was recreated under a new name. Returns the restored manifest,
+        or None if there is no such backup.
+        """
+        manifest = self.load_manifest(namespace, pod, version)
+        if manifest is None:
+            return None
+        for volume in manifest['volumes']:
+            self._restore_volume(namespace, target_pod or pod, volume)
+        return manifest
+
+    def _restore_volume(self, namespace, pod, volume):
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            self._exec(namespace, pod, volume['container'], ['tar', 'xf', '-', '-C', volume['mount_path']]),
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        errors = []
+        drainer = _in_background(_drain, process.stderr, errors)
+        try:
+            with tarfile.open(fileobj=process.stdin, mode='w|') as archive:
+                for entry in volume['entries']:
+                    info = tarfile.TarInfo(entry['path'])
+                    info.mode = entry['mode']
+                    info.mtime = entry['mtime']
+                    info.uid = entry['uid']
+                    info.gid = entry['gid']
+                    if entry['type'] == 'dir':
+                        info.type = tarfile.DIRTYPE
+                        archive.addfile(info)
+                    elif entry['type'] == 'symlink':
+                        info.type = tarfile.SYMTYPE
+                        info.linkname = entry['target']
+                        archive.addfile(info)
+                    else:
+                        info.size = entry['size']
+                        archive.addfile(info, ChunkReader(self.chunks, entry['chunks']))
+        except BrokenPipeError:
+            pass  # tar exited early; its error is reported below
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+            drainer.join()
+            record_subprocess(process.args, process.returncode, time.perf_counter() - start, 'kubectl exec tar xf')
+        stderr = b''.join(errors).decode(errors='replace')
+        if process.returncode != 0:
+            raise BackupError(f"tar in {namespace}/{pod}:{volume['mount_path']} failed: {stderr.strip()}")
+
+    # Retention
+
+    def prune(self, keep):
+        """Keep the newest `keep` versions of every pod and delete chunks no manifest uses"""
+        referenced = set()
+        for namespace, pod in self.backed_up_pods():
+            versions = self.versions(namespace, pod)
+            for version in versions[:-keep] if keep else versions:
+                os.unlink(os.path.join(self.manifest_dir(namespace, pod), f"{version}.json"))
+            for version in self.versions(namespace, pod):
+                manifest = self.load_manifest(namespace, pod, version)
+                for volume in manifest['volumes']:
+                    for entry in volume['entries']:
+                        referenced.update(entry.get('chunks', ()))
+        removed = 0
+        for digest in list(self.chunks.digests()):
+            if digest not in referenced:
+                self.chunks.remove(digest)
+                removed += 1
+        return removed
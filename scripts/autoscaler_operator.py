@@ -1,87 +1,399 @@
+import os
 import subprocess
+import sys
+import threading
 import time
 import re
-from kubernetes import client, config
+from concurrent.futures import ThreadPoolExecutor
+from kubernetes import client, config, watch
+from kubernetes.client.exceptions import ApiException
+from kubernetes.utils import parse_quantity
 
-# Load kube config
-config.load_kube_config()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation
 
-# Initialize the Kubernetes API client
-v1 = client.CoreV1Api()
+# Kubernetes API client, set by main() (or by the controller manager, which imports this module)
+v1 = None
 
-# Function to check top event with "Insufficient memory"
-def check_insufficient_memory_in_events(pod_name, namespace='default'):
-    try:
-        result = subprocess.run(
-            ["kubectl", "describe", "pod", pod_name, "-n", namespace],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-
-        event_section = re.search(r'Events:\n((?:.|\n)*)', result.stdout)
-        if event_section:
-            events = event_section.group(1).strip().split("\n")
-            event_lines = [line for line in events if not re.match(r'^\s*(Type|----)', line) and line.strip()]
-            if event_lines:
-                # Read only the topmost event line
-                top_event_line = event_lines[0].strip()
-                if re.search(r"Insufficient memory", top_event_line, re.IGNORECASE):
-                    print(f"Pod {pod_name} has insufficient memory in top event: {top_event_line}")
-                    return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error describing pod {pod_name}: {e}")
+SCALE_REASONS = ("Insufficient memory", "Insufficient cpu")  # scheduling failures a new node can fix
+SETTLE_SECONDS = 5  # wait after the first trigger so a burst of pending pods is handled together
+RESYNC_SECONDS = 300  # re-check even without events, as a safety net
+MINIKUBE_PROFILE = os.environ.get("MINIKUBE_PROFILE", "minikube")
+MAX_NEW_NODES = int(os.environ.get("AUTOSCALER_MAX_NEW_NODES", "5"))  # upper bound per scale-out
+NEW_NODE_CPU = os.environ.get("AUTOSCALER_NEW_NODE_CPU")  # e.g. "2"; defaults to the largest existing node
+NEW_NODE_MEMORY = os.environ.get("AUTOSCALER_NEW_NODE_MEMORY")  # e.g. "2Gi"
+DRY_RUN = "--dry-run" in sys.argv or os.environ.get("AUTOSCALER_DRY_RUN") == "1"
+
+HOSTNAME_LABEL = "kubernetes.io/hostname"
+RESOURCES = ("cpu", "memory", "pods")
+
+# Index of Pending pods and why the scheduler last failed to place them
+class UnschedulablePods:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pods = {}  # "namespace/name" -> Pending pod
+        self._reasons = {}  # "namespace/name" -> (event time, set of reasons)
+        self._by_reason = {}  # reason -> set of "namespace/name"
+        self.changed = threading.Event()
+
+    def replace_pods(self, pods):
+        with self._lock:
+            self._pods = {pod_key(pod): pod for pod in pods if is_unscheduled(pod)}
+            for pod in pods:
+                if not is_unscheduled(pod):
+                    self._set_reasons(pod_key(pod), None)
+        self.changed.set()
+
+    def update_pod(self, event_type, pod):
+        key = pod_key(pod)
+        with self._lock:
+            if event_type == 'DELETED' or not is_unscheduled(pod):
+                # Scheduled, finished or gone: it no longer needs capacity, and its old reasons are stale
+                self._pods.pop(key, None)
+                self._set_reasons(key, None)
+            else:
+                self._pods[key] = pod
+
+    def replace_events(self, events):
+        with self._lock:
+            for key in list(self._reasons):
+                self._set_reasons(key, None)
+            for event in events:
+                self._record_event(event)
+        self.changed.set()
+
+    def update_event(self, event_type, event):
+        if event_type == 'DELETED':
+            return  # expired events say nothing about the pod's current state
+        with self._lock:
+            if self._record_event(event):
+                self.changed.set()
+
+    def pending_count(self):
+        return len(self._pods)
+
+    def pods_with_reason(self, reason):
+        with self._lock:
+            return [self._pods[key] for key in self._by_reason.get(reason, ()) if key in self._pods]
 
-    return False
+    def _record_event(self, event):
+        """Keep only the newest FailedScheduling event per pod; returns True if its reasons changed"""
+        obj = event.involved_object
+        key = f"{obj.namespace}/{obj.name}"
+        when = event_time(event)
+        current = self._reasons.get(key)
+        if current is not None and current[0] > when:
+            return False
+        reasons = parse_scheduling_reasons(event.message or "")
+        if current is not None and current[1] == reasons:
+            self._reasons[key] = (when, reasons)
+            return False
+        self._set_reasons(key, (when, reasons))
+        return True
+
+    def _set_reasons(self, key, entry):
+        old = self._reasons.pop(key, None)
+        if old is not None:
+            for reason in old[1]:
+                keys = self._by_reason.get(reason)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_reason[reason]
+        if entry is not None:
+            self._reasons[key] = entry
+            for reason in entry[1]:
+                self._by_reason.setdefault(reason, set()).add(key)
+
+unschedulable_pods = UnschedulablePods()
+instrumentation.QUEUE_DEPTH.labels("pending_pods").set_function(unschedulable_pods.pending_count)
+
+def pod_key(pod):
+    return f"{pod.metadata.namespace}/{pod.metadata.name}"
+
+# A bound pod stays Pending while its images pull, but it already has its node
+def is_unscheduled(pod):
+    if pod.status.phase != 'Pending' or pod.spec.node_name:
+        return False
+    return not any(c.type == 'PodScheduled' and c.status == 'True' for c in pod.status.conditions or ())
+
+def event_time(event):
+    when = event.last_timestamp or event.event_time or event.metadata.creation_timestamp
+    return when.timestamp() if when else 0.0
+
+# Function to split a FailedScheduling message into reasons, e.g.
+# "0/3 nodes are available: 1 node(s) had untolerated taint {...}, 2 Insufficient memory. preemption: ..."
+# gives {"node(s) had untolerated taint {...}", "Insufficient memory"}
+def parse_scheduling_reasons(message):
+    match = re.search(r'nodes are available: (.*?)(?:\. preemption:|\.$|$)', message)
+    if not match:
+        return frozenset([message.strip()]) if message.strip() else frozenset()
+    reasons = set()
+    for part in re.split(r',\s*(?=\d+ )', match.group(1)):
+        reasons.add(re.sub(r'^\d+\s+', '', part.strip()))
+    return frozenset(reasons)
+
+# Function to list a resource once and then follow its changes with a watch
+def watch_forever(list_func, on_list, on_event, **kwargs):
+    resource_version = None
+    while True:
+        try:
+            if resource_version is None:
+                result = list_func(**kwargs)
+                on_list(result.items)
+                resource_version = result.metadata.resource_version
+            stream = watch.Watch().stream(
+                list_func,
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=300,
+                **kwargs
+            )
+            for event in stream:
+                obj = event['object']
+                if event['type'] != 'BOOKMARK':
+                    on_event(event['type'], obj)
+                resource_version = obj.metadata.resource_version
+        except ApiException as e:
+            if e.status == 410:
+                resource_version = None  # too old to resume from, relist
+                continue
+            print(f"Watch error: {e.status} {e.reason}")
+            time.sleep(5)
+        except Exception as e:
+            print(f"Watch error: {e}")
+            time.sleep(5)
 
-# Function to check pending pods with insufficient memory
+def start_watches():
+    # Only Pending pods are watched; one that leaves Pending drops out of the selector as DELETED,
+    # and one that is bound but still pulling images is dropped by update_pod
+    threading.Thread(target=watch_forever, daemon=True, args=(
+        v1.list_pod_for_all_namespaces, unschedulable_pods.replace_pods, unschedulable_pods.update_pod,
+    ), kwargs={"field_selector": "status.phase=Pending"}).start()
+    threading.Thread(target=watch_forever, daemon=True, args=(
+        v1.list_event_for_all_namespaces, unschedulable_pods.replace_events, unschedulable_pods.update_event,
+    ), kwargs={"field_selector": "reason=FailedScheduling"}).start()
+
+# Function to check pending pods that need more capacity
 def check_pending_pods():
-    pods = v1.list_pod_for_all_namespaces(watch=False)
-    pending_pods = []
+    pending_pods = {}
+    for reason in SCALE_REASONS:
+        for pod in unschedulable_pods.pods_with_reason(reason):
+            print(f"Pod {pod.metadata.name} is pending with {reason}")
+            pending_pods[pod_key(pod)] = pod
+    return list(pending_pods.values())
+
+# Functions to turn resource quantities into comparable numbers (millicores, bytes, pod slots)
+def to_amounts(resources):
+    resources = resources or {}
+    return {
+        "cpu": int(parse_quantity(resources.get("cpu", "0")) * 1000),
+        "memory": int(parse_quantity(resources.get("memory", "0"))),
+        "pods": int(parse_quantity(resources.get("pods", "0"))),
+    }
+
+def pod_requests(pod):
+    """Effective requests the scheduler uses: sum of containers, at least the largest init container, plus overhead"""
+    total = {"cpu": 0, "memory": 0, "pods": 1}
+    for container in pod.spec.containers or []:
+        requests = to_amounts(container.resources.requests if container.resources else None)
+        total["cpu"] += requests["cpu"]
+        total["memory"] += requests["memory"]
+    for container in pod.spec.init_containers or []:
+        requests = to_amounts(container.resources.requests if container.resources else None)
+        total["cpu"] = max(total["cpu"], requests["cpu"])
+        total["memory"] = max(total["memory"], requests["memory"])
+    overhead = to_amounts(pod.spec.overhead)
+    total["cpu"] += overhead["cpu"]
+    total["memory"] += overhead["memory"]
+    return total
+
+# A node in the packing simulation: its labels and the capacity still free on it
+class NodeBin:
+    def __init__(self, name, labels, free, new=False):
+        self.name = name
+        self.labels = labels
+        self.free = free
+        self.new = new
+
+    def fits(self, pod, requests):
+        selector = pod.spec.node_selector or {}
+        if any(self.labels.get(key) != value for key, value in selector.items()):
+            return False
+        return all(requests[r] <= self.free[r] for r in RESOURCES)
+
+    def place(self, requests):
+        for r in RESOURCES:
+            self.free[r] -= requests[r]
+
+def list_cluster_state():
+    """All nodes and the pods bound to them, straight from the API server"""
+    nodes = v1.list_node().items
+    bound = v1.list_pod_for_all_namespaces(
+        field_selector="spec.nodeName!=,status.phase!=Succeeded,status.phase!=Failed"
+    ).items
+    return nodes, bound
+
+def node_bins(cluster_state=list_cluster_state):
+    """Schedulable nodes with allocatable capacity minus what bound pods already request"""
+    nodes, pods = cluster_state()
+    used = {}
+    for pod in pods:
+        if not pod.spec.node_name or pod.status.phase in ("Succeeded", "Failed"):
+            continue  # a cached pod list also has pending and finished pods
+        requests = pod_requests(pod)
+        node_used = used.setdefault(pod.spec.node_name, {r: 0 for r in RESOURCES})
+        for r in RESOURCES:
+            node_used[r] += requests[r]
+
+    bins = []
+    for node in nodes:
+        if node.spec.unschedulable:
+            continue
+        allocatable = to_amounts(node.status.allocatable)
+        node_used = used.get(node.metadata.name, {})
+        free = {r: allocatable[r] - node_used.get(r, 0) for r in RESOURCES}
+        bins.append(NodeBin(node.metadata.name, dict(node.metadata.labels or {}), free))
+    return nodes, bins
 
-    for pod in pods.items:
-        if pod.status.phase == 'Pending':
-            if check_insufficient_memory_in_events(pod.metadata.name, pod.metadata.namespace):
-                pending_pods.append(pod)
+def new_node_template(nodes):
+    """Capacity of a freshly added node: from the env overrides, else the largest existing node"""
+    largest = max((to_amounts(node.status.allocatable) for node in nodes),
+                  key=lambda a: (a["memory"], a["cpu"]), default={"cpu": 0, "memory": 0, "pods": 110})
+    template = dict(largest)
+    if NEW_NODE_CPU:
+        template["cpu"] = int(parse_quantity(NEW_NODE_CPU) * 1000)
+    if NEW_NODE_MEMORY:
+        template["memory"] = int(parse_quantity(NEW_NODE_MEMORY))
+    return template
 
-    return pending_pods
+def predicted_node_names(nodes, count):
+    """Names minikube will give the next `count` nodes: <profile>-m02, <profile>-m03, ..."""
+    numbers = [1]
+    for node in nodes:
+        match = re.fullmatch(re.escape(MINIKUBE_PROFILE) + r"-m(\d+)", node.metadata.name)
+        if match:
+            numbers.append(int(match.group(1)))
+    last = max(numbers)
+    return [f"{MINIKUBE_PROFILE}-m{last + i:02d}" for i in range(1, count + 1)]
+
+# Function to simulate first-fit-decreasing bin packing of the pending pods
+def plan_scale_out(pending_pods, nodes, bins, max_new_nodes):
+    """Returns (new node names, {pod key: node name}, [unplaceable pod keys])"""
+    template = new_node_template(nodes)
+    new_names = predicted_node_names(nodes, max_new_nodes)
+    opened = []
+    placements = {}
+    unplaceable = []
+
+    # Largest pods first, so small ones fill the gaps left behind
+    sized = [(pod_requests(pod), pod) for pod in pending_pods]
+    sized.sort(key=lambda item: (item[0]["memory"], item[0]["cpu"]), reverse=True)
+    for requests, pod in sized:
+        target = next((b for b in bins + opened if b.fits(pod, requests)), None)
+        if target is None and len(opened) < max_new_nodes:
+            name = new_names[len(opened)]
+            candidate = NodeBin(name, {HOSTNAME_LABEL: name}, dict(template), new=True)
+            if candidate.fits(pod, requests):
+                opened.append(candidate)
+                target = candidate
+        if target is None:
+            unplaceable.append(pod_key(pod))
+            continue
+        target.place(requests)
+        placements[pod_key(pod)] = target.name
+    return [b.name for b in opened], placements, unplaceable
+
+def print_plan(new_nodes, placements, unplaceable):
+    print(f"Scale-out plan: add {len(new_nodes)} node(s) {new_nodes}")
+    for key, node_name in sorted(placements.items()):
+        print(f"  {key} -> {node_name}")
+    for key in unplaceable:
+        print(f"  {key} -> does not fit on any node (check its nodeSelector and requests)")
 
 # Function to add Minikube node
 def add_minikube_node():
     try:
         print("Adding a new node to Minikube...")
-        subprocess.run(["minikube", "node", "add"], check=True)
+        subprocess.run(["minikube", "node", "add", "-p", MINIKUBE_PROFILE], check=True)
         print("New node added successfully.")
+        return True
     except subprocess.CalledProcessError as e:
         print(f"Error adding node to Minikube: {e}")
+        return False
+
+# Function to add several nodes at once
+def add_minikube_nodes(count):
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        results = list(pool.map(lambda _: add_minikube_node(), range(count)))
+    return sum(results)
 
 # Function to delete pending pods
 def delete_pending_pods(pods):
     for pod in pods:
+        name, namespace = pod.metadata.name, pod.metadata.namespace
         try:
-            print(f"Deleting pending pod: {pod.metadata.name} in namespace {pod.metadata.namespace}")
-            v1.delete_namespaced_pod(pod.metadata.name, pod.metadata.namespace)
+            # The scheduler may have bound it since the plan was made; only delete it if it is still waiting
+            live = v1.read_namespaced_pod(name, namespace)
+            if not is_unscheduled(live):
+                print(f"Not deleting pod {name} in namespace {namespace}: it has been scheduled")
+                continue
+            print(f"Deleting pending pod: {name} in namespace {namespace}")
+            preconditions = client.V1Preconditions(uid=live.metadata.uid, resource_version=live.metadata.resource_version)
+            v1.delete_namespaced_pod(name, namespace, body=client.V1DeleteOptions(preconditions=preconditions))
         except Exception as e:
-            print(f"Error deleting pod {pod.metadata.name}: {e}")
+            print(f"Error deleting pod {name}: {e}")
+
+# Function to size and carry out one scale-out; cluster_state() returns (nodes, pods), and
+# replan_state() the same once nodes were added (cluster_state() if not given)
+def scale_out(pending_pods, cluster_state=list_cluster_state, replan_state=None):
+    nodes, bins = node_bins(cluster_state)
+    new_nodes, placements, unplaceable = plan_scale_out(pending_pods, nodes, bins, MAX_NEW_NODES)
+    print_plan(new_nodes, placements, unplaceable)
+    if DRY_RUN:
+        print("Dry run: not adding nodes or deleting pods.")
+        return
+
+    if new_nodes:
+        added = add_minikube_nodes(len(new_nodes))
+        print(f"Added {added} of {len(new_nodes)} planned node(s).")
+
+    # Re-plan against the live cluster and only evict the pods that now have room
+    nodes, bins = node_bins(replan_state or cluster_state)
+    _, placements, _ = plan_scale_out(pending_pods, nodes, bins, 0)
+    delete_pending_pods([pod for pod in pending_pods if pod_key(pod) in placements])
 
 # Monitor and scale
 def monitor_and_scale():
+    start_watches()
+    loop = instrumentation.LoopTimer("autoscaler")
     while True:
-        print("Checking for pending pods...")
-        pending_pods = check_pending_pods()
+        # Sleep until the pod/event watches report a change (or the resync interval passes)
+        if unschedulable_pods.changed.wait(RESYNC_SECONDS):
+            time.sleep(SETTLE_SECONDS)
+        unschedulable_pods.changed.clear()
 
-        if pending_pods:
-            print(f"Found {len(pending_pods)} pending pods due to insufficient memory.")
-            
-            # Add a new node if there are pending pods
-            add_minikube_node()
+        with loop.cycle():
+            print("Checking for pending pods...")
+            pending_pods = check_pending_pods()
 
-            # Delete the pending pods so they can be rescheduled
-            delete_pending_pods(pending_pods)
-        else:
-            print("No pending pods requiring new nodes.")
+            if pending_pods:
+                print(f"Found {len(pending_pods)} pending pods due to insufficient resources.")
+                try:
+                    scale_out(pending_pods)
+                except Exception as e:
+                    print(f"Error planning scale-out: {e}")
+            else:
+                print("No pending pods requiring new nodes.")
 
-        time.sleep(90)
+def main():
+    global v1
+    config.load_kube_config()
+    v1 = client.CoreV1Api()
+    monitor_and_scale()
 
 if __name__ == "__main__":
-    monitor_and_scale()
+    instrumentation.instrument_kubernetes()
+    instrumentation.instrument_subprocess()
+    instrumentation.serve(9101)
+    main()
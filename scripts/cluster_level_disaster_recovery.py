@@ -1,28 +1,54 @@
 import os
+import sys
+import json
 import logging
 import time
 import subprocess
 from pathlib import Path
+from kubernetes import client, config, dynamic, watch
+from kubernetes.client.exceptions import ApiException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import instrumentation
+from common.backup_jobs import JobRunner
+from common.resource_snapshots import ClusterSnapshotter, SnapshotStore
+from common.volume_backup import BackupError, VolumeBackup
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Paths
-MINIKUBE_PATH = '/opt/homebrew/bin/minikube'
-KUBECTL_PATH = '/opt/homebrew/bin/kubectl'
-YQ_PATH = '/opt/homebrew/bin/yq'
-NEAT_PATH = '/Users/vaddempudinikhitha/.krew/bin/kubectl-neat'
+MINIKUBE_PATH = os.environ.get('MINIKUBE_PATH', '/opt/homebrew/bin/minikube')
+KUBECTL_PATH = os.environ.get('KUBECTL_PATH', '/opt/homebrew/bin/kubectl')
+STATE_DIR = Path(os.environ.get('DR_STATE_DIR', Path(__file__).parent))  # snapshots, backups and node count
+
+BACKUP_FILE = str(STATE_DIR / "combined.yaml")  # single-file backups from before snapshots
+SNAPSHOT_DIR = str(STATE_DIR / "snapshots")
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", "48"))  # resource snapshots retained
+BACKUP_DIR = str(STATE_DIR / "backup")
+NODE_COUNT_FILE = str(STATE_DIR / "node_count.txt")  # ← NEW
+BACKUP_KEEP_VERSIONS = int(os.environ.get("BACKUP_KEEP_VERSIONS", "24"))  # point-in-time versions kept per pod
+BACKUP_WORKERS = int(os.environ.get("BACKUP_WORKERS", "8"))  # backup/restore jobs running at once
+BACKUP_JOBS_PER_NODE = int(os.environ.get("BACKUP_JOBS_PER_NODE", "2"))  # of which at most this many per node
+RESTORE_TIMEOUT = 600  # seconds to wait for pods to become ready before giving up on their restore
+MONITOR_INTERVAL = int(os.environ.get('DR_MONITOR_INTERVAL', '60'))  # seconds between health checks and backups
+RESTORE_SETTLE = 15  # stop waiting for backed-up pods once every pod is ready and nothing changed for this long
+REPORT_DIR = str(Path(BACKUP_DIR) / "reports")
+SYSTEM_NAMESPACES = ['kube-system', 'kube-proxy', 'kubernetes-dashboard']
+CONTROL_PLANE_LABEL = 'node-role.kubernetes.io/control-plane'
+
+# Read-only paths Kubernetes mounts into every pod; never backed up or restored
+SKIP_PATHS = ['/var/run/secrets/kubernetes.io/serviceaccount']
 
-BACKUP_FILE = str(Path(__file__).parent / "combined.yaml")
-BACKUP_DIR = str(Path(__file__).parent / "backup")
-NODE_COUNT_FILE = str(Path(__file__).parent / "node_count.txt")  # ← NEW
+RECOVERY_SECONDS = instrumentation.histogram(
+    'disaster_recovery_restore_seconds', 'Time to restore resources and pod data after a restart',
+    buckets=(10, 30, 60, 120, 300, 600, 1200),
+)
 
-def run_command(command):
-    result = subprocess.run(command, capture_output=True, text=True, shell=True)
-    if result.returncode != 0:
-        logger.error(f"Command failed: {command}\nError: {result.stderr}")
-    return result.stdout.strip()
+volume_backups = VolumeBackup(BACKUP_DIR, kubectl=KUBECTL_PATH)
+v1 = None  # set by connect_kubernetes()
+snapshotter = None  # set by connect_kubernetes()
 
 def save_node_count(count):
     with open(NODE_COUNT_FILE, 'w') as f:
@@ -34,75 +60,197 @@ def load_node_count():
             return int(f.read())
     return 1  # fallback if file missing
 
+def connect_kubernetes(api_client=None):
+    """(Re)load the kubeconfig; minikube may move the apiserver port when it restarts.
+
+    Pass `api_client` to share an existing client and its connection pool instead.
+    """
+    global v1, snapshotter
+    if api_client is None:
+        config.load_kube_config()
+        api_client = client.ApiClient()
+    v1 = client.CoreV1Api(api_client)
+    snapshotter = None  # the dynamic client discovers APIs on creation, so it is built on first use
+
+def get_snapshotter():
+    global snapshotter
+    if snapshotter is None:
+        snapshotter = ClusterSnapshotter(
+            dynamic.DynamicClient(v1.api_client),
+            SnapshotStore(SNAPSHOT_DIR, keep=SNAPSHOT_KEEP),
+            workers=BACKUP_WORKERS,
+        )
+    return snapshotter
+
 def get_non_default_nodes():
-    nodes = run_command(f"{KUBECTL_PATH} get nodes -o jsonpath='{{.items[*].metadata.name}}'").split()
-    non_default_nodes = []
-    for node in nodes:
-        labels = run_command(f"{KUBECTL_PATH} get node {node} -o jsonpath='{{.metadata.labels}}'")
-        if "control-plane" not in labels:
-            non_default_nodes.append(node)
+    nodes = v1.list_node(label_selector=f"!{CONTROL_PLANE_LABEL}").items
+    non_default_nodes = [node.metadata.name for node in nodes]
     logger.info(f"Found {len(non_default_nodes)} non-default nodes.")
     return non_default_nodes
 
-def get_pod_mount_paths(namespace, pod_name):
-    command = f"{KUBECTL_PATH} get pod {pod_name} -n {namespace} -o jsonpath='{{.spec.containers[*].volumeMounts[*].mountPath}}'"
-    return run_command(command).split()
-
-def backup_pod_data(namespace, pod_name, mount_paths):
-    backup_path = Path(BACKUP_DIR) / namespace / pod_name
-    backup_path.mkdir(parents=True, exist_ok=True)
-    for mount_path in mount_paths:
-        dest_dir = backup_path / mount_path.lstrip('/')  # preserve folder structure
-        dest_dir.parent.mkdir(parents=True, exist_ok=True)
-        command = f"{KUBECTL_PATH} cp {namespace}/{pod_name}:{mount_path} {dest_dir}"
-        subprocess.run(command, shell=True, check=False)
-
-def backup_all_pod_volumes():
-    non_default_nodes = get_non_default_nodes()
-    for node in non_default_nodes:
-        pods = run_command(f"{KUBECTL_PATH} get pods --field-selector spec.nodeName={node} --all-namespaces -o jsonpath='{{.items[*].metadata.name}}'").split()
-        namespaces = run_command(f"{KUBECTL_PATH} get pods --field-selector spec.nodeName={node} --all-namespaces -o jsonpath='{{.items[*].metadata.namespace}}'").split()
-        for ns, pod in zip(namespaces, pods):
-            if ns not in ['kube-system', 'kube-proxy', 'kubernetes-dashboard']:
-                mounts = get_pod_mount_paths(ns, pod)
-                backup_pod_data(ns, pod, mounts)
-
-def restore_pod_data(namespace, pod_name, backup_path):
-    mount_paths = get_pod_mount_paths(namespace, pod_name)
-    skip_paths = ['/var/run/secrets/kubernetes.io/serviceaccount']
-    for mount_path in mount_paths:
-        if any(mount_path.startswith(skip) for skip in skip_paths):
-            logger.info(f"Skipping read-only system path: {mount_path}")
-            continue
-        local_backup_path = Path(backup_path) / mount_path.lstrip('/')
-        if local_backup_path.exists():
-            command = f"{KUBECTL_PATH} cp {local_backup_path}/. {namespace}/{pod_name}:{mount_path}"
-            subprocess.run(command, shell=True, check=False)
-
-def restore_all_pod_data():
-    namespaces = run_command(f"{KUBECTL_PATH} get namespaces -o jsonpath='{{.items[*].metadata.name}}'").split()
-    for ns in namespaces:
-        pods = run_command(f"{KUBECTL_PATH} get pods -n {ns} -o jsonpath='{{.items[*].metadata.name}}'").split()
-        for pod in pods:
-            backup_path = Path(BACKUP_DIR) / ns / pod
-            if backup_path.exists():
-                if wait_for_pod_ready(ns, pod):
-                    restore_pod_data(ns, pod, backup_path)
-                else:
-                    logger.warning(f"Skipping restore for {ns}/{pod} because it is not ready.")
-
-def run_kubectl_get_all_and_neat():
+def list_workload_pods():
+    """Running pods outside the system namespaces, in one field-selected list call"""
+    selector = ",".join([f"metadata.namespace!={ns}" for ns in SYSTEM_NAMESPACES] + ["status.phase=Running"])
+    return v1.list_pod_for_all_namespaces(field_selector=selector).items
+
+# The same filters for node and pod lists that come from a cache
+def is_default_node(node):
+    return CONTROL_PLANE_LABEL in (node.metadata.labels or {})
+
+def is_workload_pod(pod):
+    return pod.metadata.namespace not in SYSTEM_NAMESPACES and pod.status.phase == 'Running'
+
+def pod_volume_mounts(pod):
+    """(container, mount path) pairs of a pod, without the service account token"""
+    mounts = []
+    for container in pod.spec.containers:
+        for mount in container.volume_mounts or []:
+            if any(mount.mount_path.startswith(skip) for skip in SKIP_PATHS):
+                continue
+            mounts.append((container.name, mount.mount_path))
+    return mounts
+
+def pod_is_ready(pod):
+    statuses = (pod.status and pod.status.container_statuses) or []
+    return bool(statuses) and all(status.ready for status in statuses)
+
+def log_job_report(runner):
+    report = runner.report()
+    for timing in report['timings']:
+        outcome = "ok" if timing['ok'] else f"failed: {timing['error']}"
+        logger.info(f"{runner.name} {timing['job']} on {timing['node']}: "
+                    f"waited {timing['wait_s']}s, ran {timing['run_s']}s, {outcome}")
+    logger.info(f"{runner.name}: {report['jobs']} jobs, {report['failed']} failed, "
+                f"all done after {report['makespan_s']}s")
+    Path(REPORT_DIR).mkdir(parents=True, exist_ok=True)
+    with open(Path(REPORT_DIR) / f"{runner.name}-{time.strftime('%Y%m%dT%H%M%S')}.json", 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def backup_pod_data(namespace, pod_name, mounts):
+    started = time.time()
+    manifest = volume_backups.backup_pod(namespace, pod_name, mounts)
+    if manifest['started'] < started:
+        logger.info(f"{namespace}/{pod_name} unchanged since backup version {manifest['version']}")
+        return manifest
+    stats = manifest['stats']
+    logger.info(f"Backed up {namespace}/{pod_name} as version {manifest['version']}: "
+                f"{stats['files']} files, {stats['bytes_transferred']} bytes read, "
+                f"{stats['new_chunks']} new chunks ({stats['new_bytes']} bytes)")
+    if stats['incomplete_volumes']:
+        logger.warning(f"tar failed part-way in {stats['incomplete_volumes']} volume(s) of {namespace}/{pod_name}; "
+                       f"files it did not send keep their previous backup")
+    return manifest
+
+def backup_all_pod_volumes(nodes=None, pods=None):
+    """Back up the volumes of workload pods on non-default nodes.
+
+    `nodes` and `pods` are complete lists, e.g. from a shared cache; listed from the API when omitted.
+    """
+    if nodes is None:
+        non_default_nodes = set(get_non_default_nodes())
+        pods = list_workload_pods()
+    else:
+        non_default_nodes = {node.metadata.name for node in nodes if not is_default_node(node)}
+        pods = [pod for pod in pods if is_workload_pod(pod)]
+    runner = JobRunner('backup', BACKUP_WORKERS, BACKUP_JOBS_PER_NODE)
+    for pod in pods:
+        ns, name = pod.metadata.namespace, pod.metadata.name
+        node = pod.spec.node_name
+        if node in non_default_nodes:
+            mounts = pod_volume_mounts(pod)
+            if mounts:
+                runner.submit(f"{ns}/{name}", node, backup_pod_data, ns, name, mounts)
+    runner.wait()
+    runner.shutdown()
+    log_job_report(runner)
+    volume_backups.prune(BACKUP_KEEP_VERSIONS)
+
+def restore_pod_data(namespace, pod_name, version=None):
+    """Restore a pod's volumes from backup `version`, or from its latest backup"""
+    manifest = volume_backups.restore_pod(namespace, pod_name, version)
+    if manifest is None:
+        raise BackupError(f"No backup {version or ''} found for {namespace}/{pod_name}")
+    logger.info(f"Restored {namespace}/{pod_name} from version {manifest['version']}")
+    return manifest
+
+def restore_all_pod_data(timeout=RESTORE_TIMEOUT):
+    """Restore every backed-up pod as soon as a watch reports it ready, several at a time.
+
+    Waits until every pod with a backup has been restored, or until all pods
+    in the cluster are ready and have stayed unchanged for RESTORE_SETTLE
+    seconds (backups of pods that no longer exist keep no one waiting), or
+    until `timeout`.
+    """
+    runner = JobRunner('restore', BACKUP_WORKERS, BACKUP_JOBS_PER_NODE)
+    expected = set(volume_backups.backed_up_pods())
+    submitted = set()
+    ready = {}  # (namespace, name) -> ready, for every pod in the cluster
+
+    def observe(event_type, pod):
+        key = (pod.metadata.namespace, pod.metadata.name)
+        if event_type == 'DELETED':
+            ready.pop(key, None)
+            return
+        ready[key] = pod_is_ready(pod)
+        if ready[key] and key in expected and key not in submitted:
+            logger.info(f"Pod {key[0]}/{key[1]} is ready, restoring its volumes")
+            runner.submit(f"{key[0]}/{key[1]}", pod.spec.node_name, restore_pod_data, *key)
+            submitted.add(key)
+
+    deadline = time.time() + timeout
+    resource_version = None
+    last_change = time.time()
+    while time.time() < deadline and not expected <= submitted:
+        if resource_version is not None and all(ready.values()) and time.time() - last_change >= RESTORE_SETTLE:
+            break
+        try:
+            if resource_version is None:
+                pods = v1.list_pod_for_all_namespaces()
+                ready.clear()
+                for pod in pods.items:
+                    observe('ADDED', pod)
+                resource_version = pods.metadata.resource_version
+                last_change = time.time()
+            stream = watch.Watch().stream(
+                v1.list_pod_for_all_namespaces,
+                resource_version=resource_version,
+                timeout_seconds=max(1, min(5, int(deadline - time.time()))),
+            )
+            for event in stream:
+                observe(event['type'], event['object'])
+                resource_version = event['object'].metadata.resource_version
+                last_change = time.time()
+                if expected <= submitted:
+                    break
+        except ApiException as e:
+            if e.status == 410:
+                resource_version = None  # relist
+                continue
+            logger.warning(f"Pod watch failed: {e.status} {e.reason}")
+            time.sleep(2)
+        except Exception as e:
+            logger.warning(f"Pod watch failed: {e}")
+            time.sleep(2)
+
+    for ns, name in sorted(key for key in expected - submitted if key in ready):
+        logger.warning(f"Skipping restore for {ns}/{name} because it is not ready.")
+    runner.wait()
+    runner.shutdown()
+    return log_job_report(runner)
+
+def snapshot_cluster_resources():
     try:
-        command = (
-            f"{KUBECTL_PATH} get all,pv,pvc --all-namespaces -o yaml | "
-            f"{NEAT_PATH} | "
-            f"{YQ_PATH} eval 'del(.items[].metadata.creationTimestamp, .items[].metadata.uid, "
-            f".items[].spec.claimRef, .items[].metadata.resourceVersion)' - > {BACKUP_FILE}"
-        )
-        subprocess.run(command, shell=True, check=True)
-        logger.info(f"Cluster resources backed up to {BACKUP_FILE}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error backing up cluster resources: {e}")
+        snapshot = get_snapshotter().snapshot()
+    except Exception as e:
+        logger.error(f"Error snapshotting cluster resources: {e}")
+        return
+    if snapshot is None:
+        logger.info("Cluster resources unchanged since the last snapshot.")
+        return
+    changes = snapshot['changes']
+    logger.info(f"Cluster resources saved as snapshot {snapshot['version']}: {len(snapshot['objects'])} objects, "
+                f"{len(changes['added'])} added, {len(changes['changed'])} changed, {len(changes['removed'])} removed")
 
 def check_minikube_status():
     result = subprocess.run([MINIKUBE_PATH, 'status'], capture_output=True, text=True)
@@ -111,8 +259,7 @@ def check_minikube_status():
 
 def get_minikube_node_count():
     try:
-        nodes = run_command(f"{KUBECTL_PATH} get nodes -o jsonpath='{{.items[*].metadata.name}}'").split()
-        count = len(nodes)
+        count = len(v1.list_node().items)
         save_node_count(count)
         return count
     except Exception:
@@ -128,7 +275,16 @@ def start_minikube_cluster(nodes):
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to start Minikube: {e}")
 
-def restore_cluster_resources():
+def restore_cluster_resources(version=None):
+    report = get_snapshotter().restore(version)
+    if report is not None:
+        for tier in report['tiers']:
+            logger.info(f"Restored tier {tier['tier']}: {tier['objects']} objects, "
+                        f"{tier['failed']} failed in {tier['seconds']}s")
+        for key, error in report['failed'].items():
+            logger.error(f"Failed to apply {key}: {error}")
+        logger.info(f"Cluster resources restored from snapshot {report['version']} in {report['seconds']}s")
+        return report
     if os.path.exists(BACKUP_FILE):
         with open(BACKUP_FILE) as f:
             yaml_content = f.read()
@@ -140,60 +296,64 @@ def restore_cluster_resources():
     else:
         logger.error("No cluster backup file found.")
 
-def wait_for_pod_ready(namespace, pod_name, timeout=300):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        status = run_command(f"{KUBECTL_PATH} get pod {pod_name} -n {namespace} -o jsonpath='{{.status.containerStatuses[*].ready}}'")
-        if all(s == 'true' for s in status.split()):
-            logger.info(f"Pod {namespace}/{pod_name} is ready.")
-            return True
-        logger.info(f"Waiting for pod {namespace}/{pod_name} to become ready...")
-        time.sleep(5)
-    logger.warning(f"Timeout waiting for pod {namespace}/{pod_name} to become ready.")
-    return False
-
-def wait_for_all_pods_ready(timeout=600):
-    namespaces = run_command(f"{KUBECTL_PATH} get namespaces -o jsonpath='{{.items[*].metadata.name}}'").split()
-    all_pods_ready = False
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        all_pods_ready = True
-        for ns in namespaces:
-            pods = run_command(f"{KUBECTL_PATH} get pods -n {ns} -o jsonpath='{{.items[*].metadata.name}}'").split()
-            for pod in pods:
-                status = run_command(f"{KUBECTL_PATH} get pod {pod} -n {ns} -o jsonpath='{{.status.containerStatuses[*].ready}}'")
-                if not all(s == 'true' for s in status.split()):
-                    all_pods_ready = False
-                    logger.info(f"Waiting for pod {ns}/{pod} to become ready...")
-                    break
-            if not all_pods_ready:
-                break
-        if all_pods_ready:
-            logger.info("All pods are ready!")
-            return True
-        time.sleep(5)
-    logger.warning("Timeout waiting for all pods to become ready.")
-    return False
+def recover_cluster(reconnect=connect_kubernetes):
+    logger.warning("Cluster down! Restarting and restoring...")
+    nodes = load_node_count()
+    start_minikube_cluster(nodes)
+    reconnect()
+    with RECOVERY_SECONDS.time():
+        restore_cluster_resources()
+        restore_all_pod_data()
+
+def back_up_cluster(nodes=None, pods=None):
+    """Record the node count, snapshot the resources and back up the pod volumes"""
+    if nodes is None:
+        get_minikube_node_count()
+    else:
+        save_node_count(len(nodes))
+    snapshot_cluster_resources()
+    try:
+        backup_all_pod_volumes(nodes, pods)
+    except ApiException as e:
+        logger.error(f"Error backing up pod volumes: {e.status} {e.reason}")
 
 def monitor_and_backup_cluster():
     Path(BACKUP_DIR).mkdir(parents=True, exist_ok=True)
+    connect_kubernetes()
+    loop = instrumentation.LoopTimer("disaster_recovery", MONITOR_INTERVAL)
     while True:
-        if not check_minikube_status():
-            logger.warning("Cluster down! Restarting and restoring...")
-            nodes = load_node_count()
-            start_minikube_cluster(nodes)
-            restore_cluster_resources()
-            if wait_for_all_pods_ready():
-                restore_all_pod_data()
-        else:
-            get_minikube_node_count()
-            run_kubectl_get_all_and_neat()
-            backup_all_pod_volumes()
-        time.sleep(60)
+        with loop.cycle():
+            if not check_minikube_status():
+                recover_cluster()
+            else:
+                back_up_cluster()
+        time.sleep(MONITOR_INTERVAL)
 
 if __name__ == "__main__":
-    try:
-        logger.info("Starting cluster monitor and backup...")
-        monitor_and_backup_cluster()
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
+    # python cluster_level_disaster_recovery.py versions <namespace> <pod>
+    # python cluster_level_disaster_recovery.py restore <namespace> <pod> [version]
+    # python cluster_level_disaster_recovery.py snapshots
+    # python cluster_level_disaster_recovery.py restore-resources [version]
+    if len(sys.argv) >= 4 and sys.argv[1] == "versions":
+        for version in volume_backups.versions(sys.argv[2], sys.argv[3]):
+            print(version)
+    elif len(sys.argv) >= 4 and sys.argv[1] == "restore":
+        try:
+            restore_pod_data(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
+        except BackupError as e:
+            logger.error(f"Restore failed: {e}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "snapshots":
+        for version in SnapshotStore(SNAPSHOT_DIR).versions():
+            print(version)
+    elif len(sys.argv) >= 2 and sys.argv[1] == "restore-resources":
+        connect_kubernetes()
+        restore_cluster_resources(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        try:
+            logger.info("Starting cluster monitor and backup...")
+            instrumentation.instrument_kubernetes()
+            instrumentation.instrument_subprocess()
+            instrumentation.serve(9103)
+            monitor_and_backup_cluster()
+        except Exception as e:
+            logger.error(f"Fatal error: {e}")
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+from kubernetes import client, config
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation
+from common.controller_runtime import Backoff, Controller, Manager
+from common.informer import Informer
+
+# The three operators, hosted as reconcilers in this one process
+import autoscaler_operator as autoscaler
+import cluster_level_disaster_recovery as dr
+import node_temperature_controller as temperature
+
+WORKERS = int(os.environ.get("MANAGER_WORKERS", "3"))  # reconciles running at once, across all controllers
+
+manager = Manager(WORKERS)
+cordon = temperature.CordonController(None)  # its API client is set by connect()
+
+# One cache of nodes and pods for every controller, plus the scheduler's FailedScheduling events
+nodes = None
+pods = None
+scheduling_events = None
+sampler = None  # node CPU, from cgroups or podman stats
+
+# Function to load the kubeconfig and give every controller and informer the same client and connection pool
+def connect():
+    config.load_kube_config()
+    api_client = client.ApiClient()
+    v1 = client.CoreV1Api(api_client)
+    autoscaler.v1 = v1
+    cordon.api = v1
+    dr.connect_kubernetes(api_client)
+    # Informers pick the new client up on their next list or watch (minikube may have moved the apiserver)
+    for informer, list_func in ((nodes, v1.list_node), (pods, v1.list_pod_for_all_namespaces),
+                                (scheduling_events, v1.list_event_for_all_namespaces)):
+        if informer is not None:
+            informer.list_func = list_func
+    return v1
+
+def cluster_state():
+    return nodes.list(), pods.list()
+
+def cluster_state_after_scale_out():
+    # `minikube node add` returns before the node informer has seen the new nodes, so list those live
+    return autoscaler.v1.list_node().items, pods.list()
+
+# Reconcilers; each runs on the shared thread pool, one at a time per controller
+
+def reconcile_pending_pods(key):
+    pending_pods = autoscaler.check_pending_pods()
+    if pending_pods:
+        print(f"Found {len(pending_pods)} pending pods due to insufficient resources.")
+        autoscaler.scale_out(pending_pods, cluster_state, replan_state=cluster_state_after_scale_out)
+    else:
+        print("No pending pods requiring new nodes.")
+
+def reconcile_cordons(key):
+    cordon.reconcile(nodes.list())
+
+def reconcile_cluster(key):
+    """Restore the cluster if it is down; on "backup" also snapshot and back it up, then come back later"""
+    if not dr.check_minikube_status():
+        dr.recover_cluster(reconnect=connect)
+    elif key == "backup":
+        dr.back_up_cluster(nodes.list(), pods.list())
+    if key == "backup":
+        return dr.MONITOR_INTERVAL
+
+def sample_cpu():
+    cordon.observe(sampler.sample())
+    if cordon.wants_change():
+        manager.enqueue_threadsafe("cordon_reconcile")
+
+# Event handlers, called on the informer threads
+
+def on_pod(event_type, old, new):
+    autoscaler.unschedulable_pods.update_pod(event_type, new or old)
+
+def on_scheduling_event(event_type, old, new):
+    autoscaler.unschedulable_pods.update_event(event_type, new or old)
+    if autoscaler.unschedulable_pods.changed.is_set():
+        autoscaler.unschedulable_pods.changed.clear()
+        # Wait a moment so a burst of pending pods is handled together
+        manager.enqueue_threadsafe("autoscaler", delay=autoscaler.SETTLE_SECONDS)
+
+def on_node(event_type, old, new):
+    # Nodes that appeared, went away or were (un)cordoned by someone; status heartbeats are ignored
+    if event_type != "MODIFIED" or bool(old.spec.unschedulable) != bool(new.spec.unschedulable):
+        manager.enqueue_threadsafe("cordon_reconcile")
+
+def on_api_error(error):
+    # The apiserver stopped answering: check on the cluster now instead of at the next backup
+    manager.enqueue_threadsafe("disaster_recovery", "health")
+
+manager.add(Controller("cordon_reconcile", reconcile_cordons, priority=0, rate=1, burst=2,
+                       resync=temperature.CHECK_INTERVAL))
+manager.add(Controller("autoscaler", reconcile_pending_pods, priority=1, rate=0.1, burst=1,
+                       backoff=Backoff(base=5, cap=300), resync=autoscaler.RESYNC_SECONDS))
+manager.add(Controller("disaster_recovery", reconcile_cluster, priority=2, rate=0.1, burst=2,
+                       backoff=Backoff(base=10, cap=600), resync_key="backup"))
+
+def main():
+    global nodes, pods, scheduling_events, sampler
+    v1 = connect()
+    nodes = Informer("nodes", v1.list_node)
+    pods = Informer("pods", v1.list_pod_for_all_namespaces)
+    scheduling_events = Informer("scheduling-events", v1.list_event_for_all_namespaces,
+                                 field_selector="reason=FailedScheduling")
+    nodes.add_handler(on_node)
+    pods.add_handler(on_pod)
+    scheduling_events.add_handler(on_scheduling_event)
+    for informer in (nodes, pods, scheduling_events):
+        informer.add_error_handler(on_api_error)
+
+    sampler, interval = temperature.make_sampler()
+    manager.every("cpu_sample", interval, sample_cpu)
+    os.makedirs(dr.BACKUP_DIR, exist_ok=True)
+
+    def start_informers():
+        for informer in (nodes, pods, scheduling_events):
+            informer.start()
+
+    # Informer handlers enqueue work, so the informers start once the manager's loop is running
+    asyncio.run(manager.run(on_start=start_informers))
+
+if __name__ == "__main__":
+    instrumentation.instrument_kubernetes()
+    instrumentation.instrument_subprocess()
+    instrumentation.serve(9100)
+    main()
@@ -1,60 +1,321 @@
+import math
+import os
 import subprocess
 import time
 import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from kubernetes import client, config
 
-THRESHOLD = 80  # percent
-CHECK_INTERVAL = 30  # seconds
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation, podman_stats
 
-def get_podman_stats():
+HIGH_WATERMARK = float(os.environ.get("HIGH_WATERMARK", "80"))  # percent, cordon above this
+LOW_WATERMARK = float(os.environ.get("LOW_WATERMARK", "60"))  # percent, uncordon below this
+SMOOTHING_SECONDS = float(os.environ.get("SMOOTHING_SECONDS", "10"))  # EWMA time constant
+MIN_DWELL = float(os.environ.get("MIN_DWELL", "60"))  # seconds a node keeps its state before flipping again
+CHECK_INTERVAL = float(os.environ.get("CHECK_INTERVAL", "5"))  # seconds between reconciles
+PATCH_WORKERS = 8
+SAMPLE_INTERVAL = float(os.environ.get("SAMPLE_INTERVAL", "0.5"))  # seconds between cgroup samples
+PODMAN_SAMPLE_INTERVAL = float(os.environ.get("PODMAN_SAMPLE_INTERVAL", "30"))  # each podman stats sample forks
+DISCOVERY_INTERVAL = 30  # seconds between looking for added/removed node containers
+CGROUP_ROOT = os.environ.get("CGROUP_ROOT", "/sys/fs/cgroup")
+# Upgrade step: treat cordoned nodes without our annotation as ours (earlier versions did not annotate)
+ADOPT_UNANNOTATED_CORDONS = os.environ.get("ADOPT_UNANNOTATED_CORDONS") == "1"
+
+# podman names container cgroups libpod-<id>.scope (systemd) or libpod-<id> (cgroupfs)
+LIBPOD_CGROUP = re.compile(r"libpod-([0-9a-f]+)(?:\.scope)?")
+
+def list_node_containers():
+    """{container name: full container id} for the running podman containers"""
     result = subprocess.run(
-        ["podman", "stats", "--no-stream"],
+        ["podman", "ps", "--no-trunc", "--format", "{{.ID}} {{.Names}}"],
         capture_output=True,
-        text=True
+        text=True,
+        check=True
     )
-    return result.stdout
+    containers = {}
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            containers[parts[1]] = parts[0]
+    return containers
 
-def parse_stats(stats_output):
-    node_cpu = {}
-    lines = stats_output.strip().split("\n")
-    header_skipped = False
+def find_container_cgroups(root, containers):
+    """Map container names to their cgroup v2 directories under `root`"""
+    names = {container_id: name for name, container_id in containers.items()}
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        match = LIBPOD_CGROUP.fullmatch(os.path.basename(dirpath))
+        if match:
+            dirnames[:] = []  # the node's own kubepods hierarchy lives below, skip it
+            name = names.get(match.group(1))
+            if name is not None and "cpu.stat" in filenames:
+                found[name] = dirpath
+    return found
 
-    for line in lines:
-        if not header_skipped:
-            header_skipped = True
-            continue
+def read_usage_usec(fd):
+    for line in os.pread(fd, 4096, 0).decode().splitlines():
+        key, _, value = line.partition(" ")
+        if key == "usage_usec":
+            return int(value)
+    raise OSError("usage_usec missing from cpu.stat")
 
-        parts = re.split(r"\s{2,}", line.strip())
-        if len(parts) >= 3:
-            name = parts[1]  # NAME column
-            cpu_str = parts[2]  # CPU % column
-            cpu_val = float(cpu_str.strip('%'))
-            node_cpu[name] = cpu_val
+# Samples node CPU from cgroup v2 counters without forking a process per reading
+class CgroupSampler:
+    def __init__(self, root=CGROUP_ROOT, list_containers=list_node_containers, clock=time.monotonic):
+        self.root = root
+        self.list_containers = list_containers
+        self.clock = clock
+        self._files = {}  # node -> (cpu.stat fd, memory.current fd or None)
+        self._paths = {}  # node -> cgroup directory the fds were opened from
+        self._previous = {}  # node -> (clock, usage_usec)
+        self._discovered_at = None
 
-    return node_cpu
+    def available(self):
+        try:
+            self.discover()
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"cgroup sampler unavailable: {e}")
+            return False
+        return bool(self._files)
 
-def cordon_node(node):
-    subprocess.run(["kubectl", "cordon", node])
+    def discover(self):
+        cgroups = find_container_cgroups(self.root, self.list_containers())
+        for node in list(self._files):
+            if self._paths.get(node) != cgroups.get(node):  # gone, or restarted under a new id
+                self._forget(node)
+        for node, path in cgroups.items():
+            if node not in self._files:
+                try:
+                    cpu_fd = os.open(os.path.join(path, "cpu.stat"), os.O_RDONLY)
+                except OSError as e:
+                    print(f"Cannot read cgroup of {node}: {e}")
+                    continue
+                try:
+                    memory_fd = os.open(os.path.join(path, "memory.current"), os.O_RDONLY)
+                except OSError:
+                    memory_fd = None
+                self._files[node] = (cpu_fd, memory_fd)
+                self._paths[node] = path
+        self._discovered_at = self.clock()
 
-def uncordon_node(node):
-    subprocess.run(["kubectl", "uncordon", node])
+    def sample(self):
+        """{node: {"cpu": percent of one CPU, "memory_bytes": ...}} since the previous sample"""
+        if self._discovered_at is None or self.clock() - self._discovered_at >= DISCOVERY_INTERVAL:
+            try:
+                self.discover()
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Error discovering node containers: {e}")
 
-def main():
-    while True:
-        print("Checking node CPU usage...")
-        stats_output = get_podman_stats()
-        node_cpu = parse_stats(stats_output)
+        stats = {}
+        for node, (cpu_fd, memory_fd) in list(self._files.items()):
+            try:
+                now = self.clock()
+                usage = read_usage_usec(cpu_fd)
+                memory = int(os.pread(memory_fd, 64, 0)) if memory_fd is not None else None
+            except (OSError, ValueError):
+                self._forget(node)  # container went away; picked up again by the next discovery
+                continue
+            previous = self._previous.get(node)
+            self._previous[node] = (now, usage)
+            if previous is None or now <= previous[0]:
+                continue
+            cpu = (usage - previous[1]) / ((now - previous[0]) * 1e6) * 100
+            stats[node] = {"cpu": round(max(cpu, 0.0), 2), "memory_bytes": memory}
+        return stats
+
+    def close(self):
+        for node in list(self._files):
+            self._forget(node)
+
+    def _forget(self, node):
+        for fd in self._files.pop(node, ()):
+            if fd is not None:
+                os.close(fd)
+        self._paths.pop(node, None)
+        self._previous.pop(node, None)
+
+# Fallback when the cgroup files are not readable (cgroup v1, remote podman, permissions)
+class PodmanSampler:
+    def sample(self):
+        try:
+            stats = podman_stats.collect()
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Error running podman stats: {e}")
+            return {}
+        return {
+            name: {"cpu": float(cpu), "memory_bytes": None if math.isnan(memory) else int(memory)}
+            for name, cpu, memory in zip(stats.names, stats.cpu_percent, stats.mem_used_bytes)
+            if not math.isnan(cpu)  # stopped containers report "--"
+        }
+
+    def close(self):
+        pass
+
+def make_sampler():
+    sampler = CgroupSampler()
+    if sampler.available():
+        print(f"Sampling node CPU from cgroups under {CGROUP_ROOT} every {SAMPLE_INTERVAL}s")
+        return sampler, SAMPLE_INTERVAL
+    print("Falling back to podman stats for node CPU")
+    return PodmanSampler(), PODMAN_SAMPLE_INTERVAL
+
+# Annotation marking nodes this controller cordoned, so manual cordons are left alone
+CORDONED_BY = "node-temperature-controller/cordoned"
+
+class NodeState:
+    def __init__(self, cordoned):
+        self.ewma = None
+        self.updated_at = None
+        self.cordoned = cordoned  # desired schedulability
+        self.changed_at = None
+
+# Cordons hot nodes and uncordons them once they cool down, patching only on transitions
+class CordonController:
+    def __init__(self, api, high=HIGH_WATERMARK, low=LOW_WATERMARK, smoothing=SMOOTHING_SECONDS,
+                 min_dwell=MIN_DWELL, clock=time.monotonic, workers=PATCH_WORKERS, adopt=ADOPT_UNANNOTATED_CORDONS):
+        self.api = api
+        self.high = high
+        self.low = low
+        self.smoothing = smoothing
+        self.min_dwell = min_dwell
+        self.clock = clock
+        self.workers = workers
+        self.adopt = adopt
+        self.nodes = {}  # node -> NodeState
+        self.skipped = set()  # nodes cordoned by someone else, logged once
+        self._lock = threading.Lock()  # observe() and reconcile() may run on different threads
 
-        for node, cpu in node_cpu.items():
-            print(f"Node: {node}, CPU: {cpu}%")
+    def observe(self, stats):
+        """Fold one sample {node: {"cpu": ...}} into each node's EWMA"""
+        with self._lock:
+            now = self.clock()
+            for node, values in stats.items():
+                state = self.nodes.get(node)
+                if state is None:
+                    continue  # not a Kubernetes node (yet); picked up by the next reconcile
+                if state.ewma is None:
+                    state.ewma = values["cpu"]
+                else:
+                    alpha = 1 - math.exp(-(now - state.updated_at) / self.smoothing)
+                    state.ewma += alpha * (values["cpu"] - state.ewma)
+                state.updated_at = now
 
-            if cpu > THRESHOLD:
-                print(f"> {node} over {THRESHOLD}%, cordoning...")
-                cordon_node(node)
-            else:
-                print(f"> {node} below {THRESHOLD}%, uncordoning...")
-                uncordon_node(node)
+    def reconcile(self, nodes=None):
+        """Compare desired with observed schedulability and patch the nodes that differ.
+
+        `nodes` is the current node list, e.g. from a shared cache; listed from the API when omitted.
+        """
+        if nodes is None:
+            nodes = self.api.list_node().items
+        with self._lock:
+            adopted, patches = self._plan(nodes)
+
+        # API calls happen outside the lock, so sampling is never held up by them
+        for node in adopted:
+            self.annotate(node)
+        if patches:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(patches))) as pool:
+                list(pool.map(lambda patch: self.patch(*patch), patches))
+        return patches
+
+    def _plan(self, nodes):
+        """Update the node states from `nodes`; returns (nodes to adopt, (node, unschedulable) patches)"""
+        now = self.clock()
+        observed = {}
+        skipped = set()
+        adopted = []
+        for node in nodes:
+            annotations = node.metadata.annotations or {}
+            unschedulable = bool(node.spec.unschedulable)
+            if unschedulable and CORDONED_BY not in annotations:
+                if not self.adopt:
+                    skipped.add(node.metadata.name)  # cordoned by someone else
+                    continue
+                print(f"> {node.metadata.name} is cordoned without {CORDONED_BY}, adopting it")
+                adopted.append(node.metadata.name)
+            observed[node.metadata.name] = unschedulable
+            if node.metadata.name not in self.nodes:
+                self.nodes[node.metadata.name] = NodeState(unschedulable)
+        for node in list(self.nodes):
+            if node not in observed:
+                del self.nodes[node]
+        for node in sorted(skipped - self.skipped):
+            print(f"> {node} is cordoned without {CORDONED_BY}, leaving it alone "
+                  f"(set ADOPT_UNANNOTATED_CORDONS=1 if this controller cordoned it)")
+        self.skipped = skipped
+
+        patches = []
+        for node, state in self.nodes.items():
+            desired = self.decide(state, now)
+            if desired != state.cordoned:
+                state.cordoned = desired
+                state.changed_at = now
+                print(f"> {node} CPU {state.ewma:.1f}% (smoothed), {'cordoning' if desired else 'uncordoning'}...")
+            if desired != observed[node]:
+                patches.append((node, desired))
+        return adopted, patches
+
+    def wants_change(self):
+        """True if a reconcile now would flip some node"""
+        with self._lock:
+            now = self.clock()
+            return any(self.decide(state, now) != state.cordoned for state in self.nodes.values())
+
+    def decide(self, state, now):
+        if state.ewma is None:
+            return state.cordoned
+        if state.changed_at is not None and now - state.changed_at < self.min_dwell:
+            return state.cordoned
+        if not state.cordoned and state.ewma > self.high:
+            return True
+        if state.cordoned and state.ewma < self.low:
+            return False
+        return state.cordoned
+
+    def patch(self, node, unschedulable):
+        body = {
+            "spec": {"unschedulable": unschedulable},
+            "metadata": {"annotations": {CORDONED_BY: "true" if unschedulable else None}},
+        }
+        try:
+            self.api.patch_node(node, body)
+        except Exception as e:
+            print(f"Error patching {node}: {e}")  # still differs from desired, so retried next reconcile
+
+    def annotate(self, node):
+        """Mark an adopted node as cordoned by this controller, so it stays ours without ADOPT_UNANNOTATED_CORDONS"""
+        try:
+            self.api.patch_node(node, {"metadata": {"annotations": {CORDONED_BY: "true"}}})
+        except Exception as e:
+            print(f"Error annotating {node}: {e}")  # adopted again by the next reconcile
+
+def main():
+    config.load_kube_config()
+    controller = CordonController(client.CoreV1Api())
+    sampler, interval = make_sampler()
+    reconcile_loop = instrumentation.LoopTimer("cordon_reconcile", CHECK_INTERVAL)
+    sample_loop = instrumentation.LoopTimer("cpu_sample", interval)
+    next_check = next_sample = time.monotonic()
+    while True:
+        if time.monotonic() >= next_check:
+            with reconcile_loop.cycle():
+                try:
+                    controller.reconcile()
+                except Exception as e:
+                    print(f"Error reconciling nodes: {e}")
+            next_check = max(next_check + CHECK_INTERVAL, time.monotonic())
 
-        time.sleep(CHECK_INTERVAL)
+        if time.monotonic() >= next_sample:
+            with sample_loop.cycle():
+                controller.observe(sampler.sample())
+            next_sample = max(next_sample + interval, time.monotonic())
+        time.sleep(max(0.0, min(next_check, next_sample) - time.monotonic()))
 
 if __name__ == "__main__":
+    instrumentation.instrument_kubernetes()
+    instrumentation.instrument_subprocess()
+    instrumentation.serve(9102)
     main()
@@ -0,0 +1 @@
+"""Offline stand-in for minikube: a generated cluster behind a fake API server and fake CLIs."""
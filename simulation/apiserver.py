@@ -0,0 +1,317 @@
+"""HTTP front end for a SimCluster that speaks enough of the Kubernetes API for the operators.
+
+Serves discovery, list (with field and label selectors), watch (with
+bookmarks and 410 Gone after compaction), get, create, replace, merge /
+strategic merge / server-side apply patches and delete for the resources in
+cluster.RESOURCES, plus /sim/* endpoints the fake CLIs and the benchmark
+runner use to drive the cluster. Every API request is counted by verb and
+path template in cluster.requests.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from common.instrumentation import path_template
+
+from .cluster import BY_PATH, RESOURCES, SimError, matches, parse_selector
+
+BOOKMARK_INTERVAL = 5  # seconds without events before a watch gets a bookmark
+DEFAULT_WATCH_TIMEOUT = 300
+PATCH_TYPES = (
+    'application/merge-patch+json',
+    'application/strategic-merge-patch+json',
+    'application/apply-patch+yaml',
+)
+
+
+def status_body(status, reason, message):
+    return {'kind': 'Status', 'apiVersion': 'v1', 'metadata': {}, 'status': 'Failure',
+            'message': message, 'reason': reason, 'code': status}
+
+
+def discovery(path):
+    """Discovery documents, or None if `path` is not a discovery path"""
+    if path == '/version':
+        return {'major': '1', 'minor': '30', 'gitVersion': 'v1.30.0', 'platform': 'linux/amd64'}
+    if path == '/api':
+        return {'kind': 'APIVersions', 'versions': ['v1'], 'serverAddressByClientCIDRs': []}
+    groups = {}
+    for resource in RESOURCES:
+        if resource.group:
+            groups.setdefault(resource.group, []).append(resource.version)
+    if path == '/apis':
+        return {'kind': 'APIGroupList', 'apiVersion': 'v1', 'groups': [{
+            'name': group,
+            'versions': [{'groupVersion': f"{group}/{v}", 'version': v} for v in sorted(set(versions))],
+            'preferredVersion': {'groupVersion': f"{group}/{versions[0]}", 'version': versions[0]},
+        } for group, versions in sorted(groups.items())]}
+    group_version = path[len('/api/'):] if path.startswith('/api/') else path[len('/apis/'):]
+    resources = [resource for resource in RESOURCES if resource.api_version == group_version]
+    if not resources or path.rstrip('/').count('/') != (2 if path.startswith('/api/') else 3):
+        return None
+    verbs = ['create', 'delete', 'get', 'list', 'patch', 'update', 'watch']
+    return {'kind': 'APIResourceList', 'apiVersion': 'v1', 'groupVersion': group_version, 'resources': [
+        {'name': resource.plural, 'singularName': resource.kind.lower(), 'namespaced': resource.namespaced,
+         'kind': resource.kind, 'verbs': verbs}
+        for resource in resources
+    ] + [
+        {'name': f"{resource.plural}/status", 'singularName': '', 'namespaced': resource.namespaced,
+         'kind': resource.kind, 'verbs': ['get', 'patch', 'update']}
+        for resource in resources
+    ]}
+
+
+def parse_resource_path(path):
+    """'/api/v1/namespaces/ns/pods/name' -> (Resource, namespace, name); None if it is no resource path"""
+    parts = path.strip('/').split('/')
+    if parts[0] == 'api' and len(parts) >= 3:
+        api_version, rest = parts[1], parts[2:]
+    elif parts[0] == 'apis' and len(parts) >= 4:
+        api_version, rest = f"{parts[1]}/{parts[2]}", parts[3:]
+    else:
+        return None
+    namespace = None
+    if rest[0] == 'namespaces' and len(rest) >= 3:
+        namespace, rest = rest[1], rest[2:]
+    resource = BY_PATH.get((api_version, rest[0]))
+    if resource is None:
+        return None
+    name = rest[1] if len(rest) > 1 else None
+    return resource, namespace, name
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    cluster = None  # set by serve()
+
+    # Plumbing
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.cluster.lock:
+            self.cluster.response_bytes += len(data)
+
+    def _send_error(self, error):
+        self._send_json(error.status, status_body(error.status, error.reason, str(error)))
+
+    def _body(self):
+        return json.loads(self._raw_body) if self._raw_body else {}
+
+    def _count(self, verb, path):
+        with self.cluster.lock:
+            self.cluster.requests[(verb, path_template(path))] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    # Routing
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        # Always drain the body, or the next request on this keep-alive connection would read it
+        self._raw_body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path.startswith('/sim/'):
+                self._sim(method, url.path, query)
+                return
+            document = discovery(url.path) if method == 'GET' else None
+            if document is not None:
+                self._count('DISCOVERY', url.path)
+                self._send_json(200, document)
+                return
+            parsed = parse_resource_path(url.path)
+            if parsed is None:
+                raise SimError(404, 'NotFound', f"the server could not find the requested resource {url.path}")
+            self._resource(method, url.path, query, *parsed)
+        except SimError as e:
+            self._send_error(e)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _resource(self, method, path, query, resource, namespace, name):
+        cluster = self.cluster
+        if method == 'GET' and name is None:
+            if query.get('watch') in ('true', '1'):
+                self._count('WATCH', path)
+                self._watch(resource, namespace, query)
+                return
+            self._count('LIST', path)
+            items, rv = cluster.list(resource, namespace, query.get('fieldSelector', ''), query.get('labelSelector', ''))
+            self._send_json(200, {'kind': f"{resource.kind}List", 'apiVersion': resource.api_version,
+                                  'metadata': {'resourceVersion': str(rv)}, 'items': items})
+            return
+        self._count(method, path)
+        if method == 'GET':
+            self._send_json(200, cluster.get(resource, namespace, name))
+        elif method == 'POST' and name is None:
+            self._send_json(201, cluster.create(resource, self._body(), namespace))
+        elif method == 'PUT' and name is not None:
+            body = self._body()
+            self._send_json(200, cluster.update(resource, namespace, name, lambda old: dict(body, metadata=dict(
+                body.get('metadata', {}), name=name, namespace=old['metadata'].get('namespace')))))
+        elif method == 'PATCH' and name is not None:
+            content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+            if content_type not in PATCH_TYPES:
+                raise SimError(415, 'UnsupportedMediaType', f"patch type {content_type} is not supported here")
+            body = self._body()
+            if content_type == 'application/apply-patch+yaml':
+                self._send_json(200, cluster.apply(resource, namespace, name, body))
+            else:
+                self._send_json(200, cluster.patch(resource, namespace, name, body))
+        elif method == 'DELETE' and name is not None:
+            self._send_json(200, cluster.delete(resource, namespace, name))
+        else:
+            raise SimError(405, 'MethodNotAllowed', f"{method} is not supported on {path}")
+
+    # Watch
+
+    def _watch(self, resource, namespace, query):
+        cluster = self.cluster
+        fields = parse_selector(query.get('fieldSelector', ''))
+        labels = parse_selector(query.get('labelSelector', ''))
+        bookmarks = query.get('allowWatchBookmarks') in ('true', '1')
+        deadline = time.monotonic() + float(query.get('timeoutSeconds') or DEFAULT_WATCH_TIMEOUT)
+
+        def wanted(obj):
+            return obj is not None and (namespace is None or obj['metadata'].get('namespace') == namespace) \
+                and matches(obj, fields, labels)
+
+        rv_param = query.get('resourceVersion') or '0'
+        if rv_param == '0':
+            items, rv = cluster.list(resource, namespace, query.get('fieldSelector', ''), query.get('labelSelector', ''))
+            initial = [('ADDED', obj) for obj in items]
+        else:
+            with cluster.lock:
+                cluster._check_running()
+            rv, initial = int(rv_param), []
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._write_events(initial)
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            with cluster.lock:
+                if not cluster.running:
+                    break  # the apiserver went away; clients see the stream end
+                try:
+                    changes = cluster.changes_since(rv)
+                    if not changes:
+                        cluster.changed.wait(min(BOOKMARK_INTERVAL, max(0.0, deadline - time.monotonic())))
+                        changes = cluster.changes_since(rv) if cluster.running else []
+                except SimError as e:
+                    error = e
+                else:
+                    error = None
+                    rv = max(rv, cluster.resource_version)
+            if error is not None:
+                self._write_events([('ERROR', status_body(error.status, error.reason, str(error)))])
+                break
+            events = []
+            for _, entry_resource, event_type, obj, old in changes:
+                if entry_resource is not resource:
+                    continue
+                now_wanted, was_wanted = event_type != 'DELETED' and wanted(obj), wanted(old)
+                if now_wanted:
+                    events.append(('MODIFIED' if was_wanted else 'ADDED', obj))
+                elif was_wanted or (event_type == 'DELETED' and wanted(obj)):
+                    events.append(('DELETED', obj))  # deleted, or no longer matches the selectors
+            if events:
+                self._write_events(events)
+                last_sent = time.monotonic()
+            elif bookmarks and time.monotonic() - last_sent >= BOOKMARK_INTERVAL:
+                self._write_events([('BOOKMARK', {'kind': resource.kind, 'apiVersion': resource.api_version,
+                                                  'metadata': {'resourceVersion': str(rv)}})])
+                last_sent = time.monotonic()
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_events(self, events):
+        if not events:
+            return
+        data = b''.join(json.dumps({'type': event_type, 'object': obj}).encode() + b'\n' for event_type, obj in events)
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+        self.wfile.flush()
+        with self.cluster.lock:
+            self.cluster.response_bytes += len(data)
+
+    # Simulator control, used by the fake CLIs and the benchmark runner
+
+    def _sim(self, method, path, query):
+        cluster = self.cluster
+        if path == '/sim/spawn' and method == 'POST':
+            cluster.record_spawn(self._body()['argv'])
+            self._send_json(200, {})
+        elif path == '/sim/status':
+            self._send_json(200, {'running': cluster.running, 'nodes': len(cluster.node_names()),
+                                  'profile': cluster.profile})
+        elif path == '/sim/start' and method == 'POST':
+            cluster.start(int(self._body().get('nodes', 1)))
+            self._send_json(200, {'running': cluster.running})
+        elif path == '/sim/stop' and method == 'POST':
+            cluster.stop()
+            self._send_json(200, {})
+        elif path == '/sim/delete' and method == 'POST':
+            cluster.lose()
+            self._send_json(200, {})
+        elif path == '/sim/nodes' and method == 'POST':
+            with cluster.lock:
+                cluster._check_running()
+                name = cluster.add_node()
+            self._send_json(200, {'name': name})
+        elif path == '/sim/nodes':
+            self._send_json(200, {'nodes': cluster.node_names() if cluster.running else []})
+        elif path == '/sim/podman/stats':
+            self._send_json(200, cluster.podman_stats())
+        elif path == '/sim/podman/ps':
+            self._send_json(200, cluster.containers())
+        else:
+            raise SimError(404, 'NotFound', path)
+
+
+def serve(cluster, port=0, addr='127.0.0.1'):
+    """Serve `cluster` on a background thread; returns the server (its URL is server.url)"""
+    handler = type('Handler', (APIHandler,), {'cluster': cluster})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    server.url = f"http://{addr}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, name='sim-apiserver', daemon=True).start()
+    return server
+
+
+def write_kubeconfig(path, url, name='sim'):
+    """A kubeconfig pointing at the simulated API server (JSON, which is valid YAML)"""
+    config = {
+        'apiVersion': 'v1',
+        'kind': 'Config',
+        'clusters': [{'name': name, 'cluster': {'server': url}}],
+        'users': [{'name': name, 'user': {'token': 'simulated'}}],
+        'contexts': [{'name': name, 'context': {'cluster': name, 'user': name, 'namespace': 'default'}}],
+        'current-context': name,
+    }
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+    return path
@@ -0,0 +1,390 @@
+"""Benchmark the operators against a simulated cluster, offline.
+
+For each controller a fresh cluster is generated and served by the fake API
+server, and the controller script runs as its own process with KUBECONFIG,
+PATH (fake kubectl / minikube / podman) and its metrics port pointed at the
+simulator. After the controller finished its first cycle and a steady-state
+window, its scenario is injected:
+
+    autoscaler    pending-burst  a deployment whose pods fit on no node
+    temperature   cpu-spike      some workers jump to 97% CPU
+    dr            cluster-loss   the cluster, its objects and its volumes vanish
+
+and the runner records per-cycle wall time (from the controller's own
+/metrics), API requests by verb and path, process spawns by command, time to
+the first corrective action (reaction_s) and until the cluster is back in the
+desired state (resolved_s), and the controller's peak RSS. With --manager
+every scenario runs against scripts/controller_manager.py instead, which
+hosts all three controllers in one process:
+
+    python -m simulation.benchmark --nodes 1000 --pods 20000
+    python -m simulation.benchmark --controllers autoscaler,temperature --nodes 100 --pods 2000
+    python -m simulation.benchmark --manager
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.request import urlopen
+
+from . import apiserver
+from .cluster import NODES, PODS, SimCluster
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR = os.path.join(REPO_ROOT, 'simulation', 'bin')
+METRIC_LINE = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+# Scenarios
+
+class PendingBurst:
+    name = 'pending-burst'
+
+    def __init__(self, count=10, cpu='2'):
+        self.count = count
+        self.cpu = cpu
+
+    def ready(self, cluster, state_dir):
+        return True
+
+    def inject(self, cluster):
+        self.deletes_before = self._pod_deletes(cluster)
+        self.namespace, self.deployment = cluster.pending_burst(self.count, self.cpu)
+
+    def reacted(self, cluster, since):
+        return bool(cluster.spawns_since(since, 'minikube', 'node', 'add')) or self._pod_deletes(cluster) > self.deletes_before
+
+    def resolved(self, cluster, since):
+        pods, _ = cluster.list(PODS, self.namespace, 'status.phase=Running')
+        return len(pods) >= self.count
+
+    @staticmethod
+    def _pod_deletes(cluster):
+        with cluster.lock:
+            return cluster.requests[('DELETE', '/api/v1/namespaces/{name}/pods/{name}')]
+
+
+class CpuSpike:
+    name = 'cpu-spike'
+
+    def __init__(self, count=10, percent=97.0):
+        self.count = count
+        self.percent = percent
+
+    def ready(self, cluster, state_dir):
+        return True
+
+    def inject(self, cluster):
+        self.nodes = set(cluster.cpu_spike(self.count, self.percent))
+
+    def cordoned(self, cluster):
+        nodes, _ = cluster.list(NODES)
+        return sum(1 for node in nodes if node['metadata']['name'] in self.nodes and node['spec'].get('unschedulable'))
+
+    def reacted(self, cluster, since):
+        return self.cordoned(cluster) > 0
+
+    def resolved(self, cluster, since):
+        return self.cordoned(cluster) == len(self.nodes)
+
+
+class ClusterLoss:
+    name = 'cluster-loss'
+
+    def ready(self, cluster, state_dir):
+        """Only pull the plug once the DR monitor has a snapshot and a backup to restore from"""
+        snapshots = os.path.join(state_dir, 'snapshots')
+        backups = os.path.join(state_dir, 'backup')
+        return os.path.isdir(snapshots) and bool(os.listdir(snapshots)) and os.path.isdir(backups)
+
+    def inject(self, cluster):
+        pods, _ = cluster.list(PODS)
+        self.expected = sum(1 for pod in pods if pod['metadata']['namespace'].startswith('team-'))
+        self.volume_files = sorted(volume_files(cluster.volume_root))
+        cluster.lose()
+
+    def reacted(self, cluster, since):
+        return bool(cluster.spawns_since(since, 'minikube', 'start'))
+
+    def resolved(self, cluster, since):
+        if not cluster.running:
+            return False
+        pods, _ = cluster.list(PODS, None, 'status.phase=Running')
+        running = sum(1 for pod in pods if pod['metadata']['namespace'].startswith('team-'))
+        return running >= self.expected and sorted(volume_files(cluster.volume_root)) == self.volume_files
+
+
+def volume_files(root):
+    found = []
+    for dirpath, _, filenames in os.walk(root or ''):
+        found.extend(os.path.relpath(os.path.join(dirpath, name), root) for name in filenames)
+    return found
+
+
+CONTROLLERS = {
+    'autoscaler': {'script': 'scripts/autoscaler_operator.py', 'loop': 'autoscaler', 'scenario': PendingBurst},
+    'temperature': {'script': 'scripts/node_temperature_controller.py', 'loop': 'cordon_reconcile', 'scenario': CpuSpike},
+    'dr': {'script': 'scripts/cluster_level_disaster_recovery.py', 'loop': 'disaster_recovery', 'scenario': ClusterLoss},
+}
+MANAGER_SCRIPT = 'scripts/controller_manager.py'
+
+
+# Measurements
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def scrape(port):
+    """{(name, ((label, value), ...)): value} from a Prometheus text endpoint; {} if it cannot be reached"""
+    try:
+        with urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            text = response.read().decode()
+    except OSError:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            labels = tuple(LABEL.findall(match.group(2) or ''))
+            samples[(match.group(1), labels)] = float(match.group(3))
+    return samples
+
+
+def histogram_summary(samples, name, **labels):
+    """count, mean and an upper-bound p95 of one labelled histogram series"""
+    def wanted(series_labels):
+        present = dict(series_labels)
+        return all(present.get(key) == value for key, value in labels.items())
+
+    count = sum(v for (n, l), v in samples.items() if n == f"{name}_count" and wanted(l))
+    total = sum(v for (n, l), v in samples.items() if n == f"{name}_sum" and wanted(l))
+    buckets = Counter()
+    for (n, l), v in samples.items():
+        if n == f"{name}_bucket" and wanted([pair for pair in l if pair[0] != 'le']):
+            buckets[float(dict(l)['le'])] += v
+    p95 = next((bound for bound in sorted(buckets) if count and buckets[bound] >= 0.95 * count), None)
+    return {
+        'count': int(count),
+        'mean_s': round(total / count, 4) if count else None,
+        'p95_le_s': None if p95 in (None, float('inf')) else p95,
+    }
+
+
+def series(samples, name, key):
+    """{label value: count} of a histogram's _count series, grouped by one label"""
+    grouped = Counter()
+    for (n, labels), value in samples.items():
+        if n == f"{name}_count":
+            grouped[' '.join(v for k, v in labels if k in key)] += int(value)
+    return dict(grouped)
+
+
+def counters(cluster):
+    with cluster.lock:
+        requests = Counter({f"{verb} {path}": count for (verb, path), count in cluster.requests.items()})
+        spawns = Counter(' '.join(argv[:2]) for _, argv in cluster.spawns)
+        return requests, spawns, cluster.response_bytes
+
+
+def delta(after, before):
+    return {key: after[key] - before.get(key, 0) for key in sorted(after) if after[key] - before.get(key, 0)}
+
+
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def wait_for(condition, timeout, interval=0.05):
+    """Seconds until condition() held, or None on timeout"""
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if condition():
+            return round(time.monotonic() - started, 3)
+        time.sleep(interval)
+    return None
+
+
+# Runner
+
+def seed_volumes(cluster, files_per_pod=5, file_size=64 * 1024):
+    pods, _ = cluster.list(PODS)
+    for pod in pods:
+        if any(volume.get('emptyDir') is not None for volume in pod['spec'].get('volumes', [])):
+            data = os.path.join(cluster.volume_root, pod['metadata']['namespace'], pod['metadata']['name'], 'data')
+            os.makedirs(data, exist_ok=True)
+            for i in range(files_per_pod):
+                with open(os.path.join(data, f"file-{i}.bin"), 'wb') as f:
+                    f.write(os.urandom(file_size))
+
+
+def run_controller(name, args, workdir):
+    spec = CONTROLLERS[name]
+    scenario = spec['scenario']()
+    state_dir = os.path.join(workdir, name)
+    os.makedirs(state_dir)
+
+    print(f"[{name}] generating {args.nodes} nodes / {args.pods} pods...")
+    started = time.monotonic()
+    cluster = SimCluster(seed=args.seed, start_seconds=args.start_seconds, node_boot_seconds=args.node_boot_seconds,
+                         volume_root=os.path.join(state_dir, 'volumes'))
+    cluster.populate(nodes=args.nodes, pods=args.pods, namespaces=args.namespaces, volume_pods=args.volume_pods)
+    seed_volumes(cluster)
+    cluster.start_controllers()
+    server = apiserver.serve(cluster)
+    kubeconfig = apiserver.write_kubeconfig(os.path.join(state_dir, 'kubeconfig'), server.url)
+    generate_s = round(time.monotonic() - started, 3)
+
+    metrics_port = free_port()
+    env = dict(
+        os.environ,
+        KUBECONFIG=kubeconfig,
+        SIM_URL=server.url,
+        SIM_VOLUMES=cluster.volume_root,
+        PATH=BIN_DIR + os.pathsep + os.environ.get('PATH', ''),
+        MINIKUBE_PATH=os.path.join(BIN_DIR, 'minikube'),
+        KUBECTL_PATH=os.path.join(BIN_DIR, 'kubectl'),
+        METRICS_PORT=str(metrics_port),
+        METRICS_ADDR='127.0.0.1',
+        PYTHONUNBUFFERED='1',
+        CGROUP_ROOT=os.path.join(state_dir, 'no-cgroups'),  # node "containers" only exist in podman stats
+        DR_STATE_DIR=state_dir,
+        DR_MONITOR_INTERVAL=str(args.dr_interval),
+    )
+    env.update(dict(item.split('=', 1) for item in args.env))
+    log_path = os.path.join(state_dir, 'controller.log')
+    with open(log_path, 'w') as log:
+        script = MANAGER_SCRIPT if args.manager else spec['script']
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, script)],
+                                   cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    result = {'controller': name, 'script': script, 'scenario': scenario.name, 'generate_s': generate_s,
+              'log': log_path}
+    try:
+        def cycles():
+            return histogram_summary(scrape(metrics_port), 'loop_cycle_duration_seconds', loop=spec['loop'])['count']
+
+        print(f"[{name}] waiting for the first cycle...")
+        result['first_cycle_s'] = wait_for(lambda: process.poll() is None and cycles() >= 1, args.timeout, 0.5)
+        if result['first_cycle_s'] is None or process.poll() is not None:
+            raise RuntimeError(f"{name} did not complete a cycle, see {log_path}")
+
+        print(f"[{name}] steady state for {args.steady}s...")
+        requests_before, spawns_before, bytes_before = counters(cluster)
+        time.sleep(args.steady)
+        requests_after, spawns_after, bytes_after = counters(cluster)
+        result['steady'] = {
+            'seconds': args.steady,
+            'requests': delta(requests_after, requests_before),
+            'response_bytes': bytes_after - bytes_before,
+            'spawns': delta(spawns_after, spawns_before),
+        }
+
+        wait_for(lambda: scenario.ready(cluster, state_dir), args.timeout, 0.5)
+        print(f"[{name}] injecting {scenario.name}...")
+        injected = time.time()
+        scenario.inject(cluster)
+        result['reaction_s'] = wait_for(lambda: scenario.reacted(cluster, injected), args.timeout)
+        result['resolved_s'] = wait_for(lambda: scenario.resolved(cluster, injected),
+                                        args.timeout - (time.time() - injected))
+        if result['resolved_s'] is not None:
+            result['resolved_s'] = round(time.time() - injected, 3)
+        time.sleep(1)  # let the controller finish the cycle that fixed it
+
+        requests_end, spawns_end, bytes_end = counters(cluster)
+        result['scenario_window'] = {
+            'requests': delta(requests_end, requests_after),
+            'response_bytes': bytes_end - bytes_after,
+            'spawns': delta(spawns_end, spawns_after),
+        }
+        samples = scrape(metrics_port)
+        result['loops'] = {loop: histogram_summary(samples, 'loop_cycle_duration_seconds', loop=loop)
+                           for loop in sorted({dict(labels).get('loop') for (n, labels) in samples
+                                               if n == 'loop_cycle_duration_seconds_count'})}
+        result['kubernetes_calls'] = series(samples, 'kubernetes_request_duration_seconds', ('method', 'path'))
+        result['subprocess_calls'] = series(samples, 'subprocess_duration_seconds', ('command',))
+        result['peak_rss_mb'] = peak_rss_mb(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        server.shutdown()
+        cluster.stop_controllers()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--controllers', default=','.join(CONTROLLERS),
+                        help=f"comma-separated subset of {', '.join(CONTROLLERS)}")
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--pods', type=int, default=20000)
+    parser.add_argument('--namespaces', type=int, default=20)
+    parser.add_argument('--volume-pods', type=int, default=20, help="standalone pods with a /data volume to back up")
+    parser.add_argument('--steady', type=float, default=20, help="seconds of steady state measured before the event")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds to wait for each phase")
+    parser.add_argument('--dr-interval', type=int, default=10, help="DR monitor interval (the script defaults to 60)")
+    parser.add_argument('--start-seconds', type=float, default=5, help="how long a simulated `minikube start` takes")
+    parser.add_argument('--node-boot-seconds', type=float, default=2, help="how long an added node takes to be Ready")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="extra environment for the controllers, e.g. --env MIN_DWELL=10")
+    parser.add_argument('--manager', action='store_true',
+                        help=f"run every scenario against {MANAGER_SCRIPT} instead of the controller's own script")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="where to save the JSON report (default: benchmark-results/<timestamp>-simulation.json)")
+    args = parser.parse_args(argv)
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='sim-benchmark-') as workdir:
+        for name in args.controllers.split(','):
+            try:
+                report['results'].append(run_controller(name, args, workdir))
+            except RuntimeError as e:
+                print(f"[{name}] failed: {e}")
+                with open(os.path.join(workdir, name, 'controller.log')) as f:
+                    print(f.read()[-3000:])
+                report['results'].append({'controller': name, 'error': str(e)})
+
+    output = args.output or os.path.join('benchmark-results', f"{time.strftime('%Y%m%d-%H%M%S')}-simulation.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for result in report['results']:
+        if 'error' in result:
+            continue
+        steady_requests = sum(result['steady']['requests'].values())
+        loops = ', '.join(f"{loop} x{s['count']} mean {s['mean_s']}s" for loop, s in result['loops'].items())
+        print(f"{result['controller']}: first cycle after {result['first_cycle_s']}s; {loops}")
+        print(f"  steady: {steady_requests} API requests, {sum(result['steady']['spawns'].values())} spawns "
+              f"in {result['steady']['seconds']}s")
+        print(f"  {result['scenario']}: reaction {result['reaction_s']}s, resolved {result['resolved_s']}s, "
+              f"{sum(result['scenario_window']['requests'].values())} API requests, "
+              f"{sum(result['scenario_window']['spawns'].values())} spawns; peak RSS {result['peak_rss_mb']} MB")
+    print(f"Report saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
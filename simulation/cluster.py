@@ -0,0 +1,733 @@
+"""In-memory cluster state behind the simulated API server.
+
+Objects are kept as the JSON dicts the real API serves (camelCase fields), one
+store per resource, with a global resourceVersion and a bounded change history
+that watches are served from. Stored objects are never mutated in place:
+every change commits a new dict, so readers can serialize what they got
+without holding the lock.
+
+A background thread plays the parts of the cluster the operators depend on:
+a deployment and replicaset controller, a first-fit scheduler that records
+FailedScheduling events for pods that do not fit, nodes that become Ready a
+little while after `minikube node add`, and per-node CPU load for `podman
+stats`. Scenario methods (`pending_burst`, `cpu_spike`, `lose`) script the
+events the operators are supposed to react to.
+"""
+import bisect
+import copy
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+
+from kubernetes.utils import parse_quantity
+
+CONTROL_PLANE_LABEL = 'node-role.kubernetes.io/control-plane'
+HOSTNAME_LABEL = 'kubernetes.io/hostname'
+SYSTEM_NAMESPACES = ('default', 'kube-system', 'kube-public', 'kube-node-lease')
+TERMINAL_PHASES = ('Succeeded', 'Failed')
+
+
+class Resource:
+    def __init__(self, group, version, plural, kind, namespaced=True):
+        self.group = group
+        self.version = version
+        self.plural = plural
+        self.kind = kind
+        self.namespaced = namespaced
+        self.api_version = f"{group}/{version}" if group else version
+
+
+RESOURCES = [
+    Resource('', 'v1', 'namespaces', 'Namespace', namespaced=False),
+    Resource('', 'v1', 'nodes', 'Node', namespaced=False),
+    Resource('', 'v1', 'pods', 'Pod'),
+    Resource('', 'v1', 'events', 'Event'),
+    Resource('', 'v1', 'configmaps', 'ConfigMap'),
+    Resource('', 'v1', 'services', 'Service'),
+    Resource('', 'v1', 'persistentvolumes', 'PersistentVolume', namespaced=False),
+    Resource('', 'v1', 'persistentvolumeclaims', 'PersistentVolumeClaim'),
+    Resource('apps', 'v1', 'deployments', 'Deployment'),
+    Resource('apps', 'v1', 'replicasets', 'ReplicaSet'),
+    Resource('apps', 'v1', 'statefulsets', 'StatefulSet'),
+    Resource('apps', 'v1', 'daemonsets', 'DaemonSet'),
+    Resource('batch', 'v1', 'jobs', 'Job'),
+    Resource('batch', 'v1', 'cronjobs', 'CronJob'),
+    Resource('autoscaling', 'v2', 'horizontalpodautoscalers', 'HorizontalPodAutoscaler'),
+]
+BY_PATH = {(resource.api_version, resource.plural): resource for resource in RESOURCES}
+BY_KIND = {resource.kind: resource for resource in RESOURCES}
+NODES, PODS, EVENTS = BY_KIND['Node'], BY_KIND['Pod'], BY_KIND['Event']
+DEPLOYMENTS, REPLICASETS = BY_KIND['Deployment'], BY_KIND['ReplicaSet']
+
+
+class SimError(Exception):
+    def __init__(self, status, reason, message):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+def not_found(resource, name):
+    return SimError(404, 'NotFound', f'{resource.plural} "{name}" not found')
+
+
+def now_iso(when=None):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(when))
+
+
+# Selectors
+
+def parse_selector(text):
+    """'a=b,c!=d,e,!f' -> [('a', '=', 'b'), ('c', '!=', 'd'), ('e', 'exists', None), ('f', '!exists', None)]"""
+    requirements = []
+    for part in filter(None, (part.strip() for part in (text or '').split(','))):
+        if '!=' in part:
+            key, value = part.split('!=', 1)
+            requirements.append((key.strip(), '!=', value.strip()))
+        elif '=' in part:
+            key, value = part.split('=', 1)
+            requirements.append((key.strip(), '=', value.strip().lstrip('=')))
+        elif part.startswith('!'):
+            requirements.append((part[1:].strip(), '!exists', None))
+        else:
+            requirements.append((part, 'exists', None))
+    return requirements
+
+
+def field_value(obj, path):
+    for key in path.split('.'):
+        if not isinstance(obj, dict):
+            return ''
+        obj = obj.get(key)
+    return '' if obj is None else str(obj)
+
+
+def matches(obj, fields, labels):
+    for key, op, value in fields:
+        actual = field_value(obj, key)
+        if (op == '=' and actual != value) or (op == '!=' and actual == value):
+            return False
+    object_labels = obj['metadata'].get('labels') or {}
+    for key, op, value in labels:
+        if op == 'exists' and key not in object_labels:
+            return False
+        if op == '!exists' and key in object_labels:
+            return False
+        if op == '=' and object_labels.get(key) != value:
+            return False
+        if op == '!=' and object_labels.get(key) == value:
+            return False
+    return True
+
+
+def merge_patch(target, patch):
+    """RFC 7386 merge patch, also used for strategic merge and apply patches of the fields the operators touch"""
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+# Resource requests
+
+def cpu_cores(value):
+    return float(parse_quantity(value)) if value else 0.0
+
+
+def memory_bytes(value):
+    return int(parse_quantity(value)) if value else 0
+
+
+def pod_requests(pod):
+    """(cpu cores, memory bytes) requested by a pod's containers"""
+    cpu = memory = 0
+    for container in pod['spec'].get('containers', []):
+        requests = (container.get('resources') or {}).get('requests') or {}
+        cpu += cpu_cores(requests.get('cpu'))
+        memory += memory_bytes(requests.get('memory'))
+    return cpu, memory
+
+
+def is_bound(pod):
+    return bool(pod['spec'].get('nodeName')) and pod['status'].get('phase') not in TERMINAL_PHASES
+
+
+def node_ready(node):
+    return any(c['type'] == 'Ready' and c['status'] == 'True' for c in node['status'].get('conditions', []))
+
+
+class SimCluster:
+    def __init__(self, profile='minikube', seed=0, node_cpu='4', node_memory='8Gi', node_pods=110,
+                 node_boot_seconds=1.0, start_seconds=2.0, history=100000, volume_root=None):
+        self.profile = profile
+        self.random = random.Random(seed)
+        self.node_capacity = {'cpu': node_cpu, 'memory': node_memory, 'pods': str(node_pods)}
+        self.node_boot_seconds = node_boot_seconds
+        self.start_seconds = start_seconds
+        self.history_size = history
+        self.volume_root = volume_root
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.running = True
+        self.resource_version = 0
+        self.compacted = 0  # watches from before this resourceVersion get 410 Gone
+        self._objects = {resource.plural: {} for resource in RESOURCES}
+        self._history = []  # (rv, resource, type, obj, old)
+        self._history_rvs = []
+        self._owned = {}  # owner uid -> set of pod keys
+        self._used = {}  # node name -> [cpu, memory, pods] requested by bound pods
+        self._unbound = set()  # keys of pods waiting for the scheduler
+        self._dirty_owners = set()  # deployment / replicaset keys to reconcile
+        self._booting = {}  # node name -> time it becomes Ready
+        self._failed = {}  # pod key -> (event key, message, last recorded)
+        self._attempted = {}  # pod key -> capacity version it last failed to schedule at
+        self._capacity_version = 0  # bumped whenever a node changes or a bound pod goes away
+        self._next_fit = 0
+        self.cpu_base = {}  # node name -> steady CPU percent
+        self.cpu_spikes = {}  # node name -> CPU percent while spiking
+        self.requests = Counter()  # (verb, path template) -> API requests served
+        self.response_bytes = 0
+        self.spawns = []  # (time, argv) of every fake CLI invocation
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # Store
+
+    def _key(self, resource, namespace, name):
+        return (namespace or '') + '/' + name if resource.namespaced else name
+
+    def _commit(self, resource, event_type, obj, old=None):
+        self.resource_version += 1
+        rv = self.resource_version
+        if event_type != 'DELETED':
+            obj['metadata']['resourceVersion'] = str(rv)
+            self._objects[resource.plural][self._key(resource, obj['metadata'].get('namespace'), obj['metadata']['name'])] = obj
+        self._history.append((rv, resource, event_type, obj, old))
+        self._history_rvs.append(rv)
+        if len(self._history) > 2 * self.history_size:
+            cut = len(self._history) - self.history_size
+            self.compacted = self._history_rvs[cut - 1]
+            del self._history[:cut]
+            del self._history_rvs[:cut]
+        self._track(resource, event_type, obj, old)
+        self.changed.notify_all()
+        return obj
+
+    def _track(self, resource, event_type, obj, old):
+        """Keep the indexes the simulated controllers use in step with the store"""
+        if resource is PODS:
+            key = self._key(PODS, obj['metadata']['namespace'], obj['metadata']['name'])
+            for ref in (old or obj)['metadata'].get('ownerReferences') or []:
+                if event_type == 'DELETED':
+                    self._owned.get(ref['uid'], set()).discard(key)
+                else:
+                    self._owned.setdefault(ref['uid'], set()).add(key)
+                self._dirty_owners.add(('replicasets', ref['uid']))
+            if old is not None and is_bound(old):
+                self._release(old)
+                self._capacity_version += 1
+            if event_type != 'DELETED' and is_bound(obj):
+                self._reserve(obj)
+            if event_type != 'DELETED' and not obj['spec'].get('nodeName') and obj['status'].get('phase') == 'Pending':
+                self._unbound.add(key)
+            else:
+                self._unbound.discard(key)
+        elif resource in (DEPLOYMENTS, REPLICASETS):
+            self._dirty_owners.add((resource.plural, obj['metadata']['uid']))
+        elif resource is NODES:
+            self._capacity_version += 1
+            if event_type == 'DELETED':
+                self._used.pop(obj['metadata']['name'], None)
+
+    def _reserve(self, pod):
+        cpu, memory = pod_requests(pod)
+        used = self._used.setdefault(pod['spec']['nodeName'], [0.0, 0, 0])
+        used[0] += cpu
+        used[1] += memory
+        used[2] += 1
+
+    def _release(self, pod):
+        used = self._used.get(pod['spec']['nodeName'])
+        if used is not None:
+            cpu, memory = pod_requests(pod)
+            used[0] -= cpu
+            used[1] -= memory
+            used[2] -= 1
+
+    def _check_running(self):
+        if not self.running:
+            raise SimError(503, 'ServiceUnavailable', 'the cluster is not running')
+
+    def get(self, resource, namespace, name):
+        with self.lock:
+            self._check_running()
+            obj = self._objects[resource.plural].get(self._key(resource, namespace, name))
+        if obj is None:
+            raise not_found(resource, name)
+        return obj
+
+    def list(self, resource, namespace=None, field_selector='', label_selector=''):
+        """(items, resourceVersion) of the objects matching the selectors"""
+        fields, labels = parse_selector(field_selector), parse_selector(label_selector)
+        with self.lock:
+            self._check_running()
+            objects = list(self._objects[resource.plural].values())
+            rv = self.resource_version
+        items = [obj for obj in objects
+                 if (namespace is None or obj['metadata'].get('namespace') == namespace) and matches(obj, fields, labels)]
+        return items, rv
+
+    def create(self, resource, obj, namespace=None):
+        with self.lock:
+            self._check_running()
+            obj = copy.deepcopy(obj)
+            metadata = obj.setdefault('metadata', {})
+            if resource.namespaced:
+                metadata['namespace'] = namespace or metadata.get('namespace') or 'default'
+            if 'generateName' in metadata and 'name' not in metadata:
+                metadata['name'] = metadata['generateName'] + self._suffix()
+            key = self._key(resource, metadata.get('namespace'), metadata['name'])
+            if key in self._objects[resource.plural]:
+                raise SimError(409, 'AlreadyExists', f'{resource.plural} "{metadata["name"]}" already exists')
+            obj['apiVersion'], obj['kind'] = resource.api_version, resource.kind
+            metadata.setdefault('uid', str(uuid.UUID(int=self.random.getrandbits(128))))
+            metadata.setdefault('creationTimestamp', now_iso())
+            if resource is PODS:
+                obj.setdefault('status', {}).setdefault('phase', 'Pending')
+            return self._commit(resource, 'ADDED', obj)
+
+    def update(self, resource, namespace, name, change):
+        """Commit change(copy of the object); returns the new object"""
+        with self.lock:
+            self._check_running()
+            old = self._objects[resource.plural].get(self._key(resource, namespace, name))
+            if old is None:
+                raise not_found(resource, name)
+            new = change(copy.deepcopy(old))
+            new['metadata']['uid'] = old['metadata']['uid']
+            return self._commit(resource, 'MODIFIED', new, old)
+
+    def patch(self, resource, namespace, name, patch):
+        return self.update(resource, namespace, name, lambda obj: merge_patch(obj, patch))
+
+    def apply(self, resource, namespace, name, body):
+        """Server-side apply: create the object or merge the applied fields into it"""
+        with self.lock:
+            self._check_running()
+            if self._key(resource, namespace, name) not in self._objects[resource.plural]:
+                return self.create(resource, body, namespace)
+            return self.patch(resource, namespace, name, {k: v for k, v in body.items() if k != 'status'})
+
+    def delete(self, resource, namespace, name):
+        with self.lock:
+            self._check_running()
+            key = self._key(resource, namespace, name)
+            old = self._objects[resource.plural].pop(key, None)
+            if old is None:
+                raise not_found(resource, name)
+            gone = copy.deepcopy(old)
+            self._commit(resource, 'DELETED', gone, old)
+            if resource is PODS:
+                self._failed.pop(key, None)
+                self._attempted.pop(key, None)
+            return gone
+
+    def changes_since(self, rv):
+        """History entries after `rv`; raises 410 Gone if they have been compacted away"""
+        if rv < self.compacted:
+            raise SimError(410, 'Expired', f'too old resource version: {rv} ({self.compacted})')
+        start = bisect.bisect_right(self._history_rvs, rv)
+        return self._history[start:]
+
+    # Cluster lifecycle
+
+    def _suffix(self, length=5):
+        return ''.join(self.random.choice('bcdfghjklmnpqrstvwxz2456789') for _ in range(length))
+
+    def node_names(self):
+        with self.lock:
+            return sorted(self._objects['nodes'])
+
+    def add_node(self, ready_after=None):
+        """Add a worker named like minikube does (<profile>-mNN); it turns Ready after `ready_after` seconds"""
+        with self.lock:
+            numbers = [1]
+            for name in self._objects['nodes']:
+                if name.startswith(self.profile + '-m') and name[len(self.profile) + 2:].isdigit():
+                    numbers.append(int(name[len(self.profile) + 2:]))
+            name = f"{self.profile}-m{max(numbers) + 1:02d}"
+            self._create_node(name, control_plane=False, ready=False)
+            self._booting[name] = time.time() + (self.node_boot_seconds if ready_after is None else ready_after)
+            return name
+
+    def _create_node(self, name, control_plane, ready=True):
+        labels = {HOSTNAME_LABEL: name, 'kubernetes.io/os': 'linux', 'minikube.k8s.io/name': self.profile}
+        if control_plane:
+            labels[CONTROL_PLANE_LABEL] = ''
+        self.cpu_base[name] = self.random.uniform(10, 45)
+        self.create(NODES, {
+            'metadata': {'name': name, 'labels': labels},
+            'spec': {'podCIDR': '10.244.0.0/24'},
+            'status': {
+                'capacity': dict(self.node_capacity),
+                'allocatable': dict(self.node_capacity),
+                'conditions': [{'type': 'Ready', 'status': 'True' if ready else 'False', 'reason': 'KubeletReady'}],
+                'nodeInfo': {
+                    'architecture': 'amd64', 'bootID': name, 'containerRuntimeVersion': 'cri-o://1.29.1',
+                    'kernelVersion': '6.8.0', 'kubeProxyVersion': 'v1.30.0', 'kubeletVersion': 'v1.30.0',
+                    'machineID': name, 'operatingSystem': 'linux', 'osImage': 'Ubuntu 22.04.4 LTS', 'systemUUID': name,
+                },
+            },
+        })
+
+    def boot(self, nodes):
+        """Bring up a fresh cluster: a control plane, nodes - 1 workers and the system namespaces"""
+        with self.lock:
+            self.running = True
+            self._create_node(self.profile, control_plane=True)
+            for i in range(2, nodes + 1):
+                self._create_node(f"{self.profile}-m{i:02d}", control_plane=False)
+            for namespace in SYSTEM_NAMESPACES:
+                self.create(BY_KIND['Namespace'], {'metadata': {'name': namespace}, 'status': {'phase': 'Active'}})
+            self.create(BY_KIND['Service'], {
+                'metadata': {'name': 'kubernetes', 'namespace': 'default'},
+                'spec': {'clusterIP': '10.96.0.1', 'ports': [{'port': 443, 'protocol': 'TCP'}]},
+            })
+            self.create(BY_KIND['ConfigMap'], {'metadata': {'name': 'kube-root-ca.crt', 'namespace': 'default'}, 'data': {}})
+
+    def start(self, nodes):
+        """`minikube start`: takes start_seconds, then boots a fresh cluster if it is not running"""
+        time.sleep(self.start_seconds)
+        with self.lock:
+            if not self.running:
+                self.boot(nodes)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.changed.notify_all()
+
+    def lose(self):
+        """Simulate losing the cluster: the apiserver goes away and every object and volume with it"""
+        with self.lock:
+            self.running = False
+            for store in self._objects.values():
+                store.clear()
+            self._history.clear()
+            self._history_rvs.clear()
+            self.compacted = self.resource_version + 1
+            self._owned.clear()
+            self._used.clear()
+            self._unbound.clear()
+            self._dirty_owners.clear()
+            self._booting.clear()
+            self._failed.clear()
+            self._attempted.clear()
+            self.cpu_base.clear()
+            self.cpu_spikes.clear()
+            self.changed.notify_all()
+        if self.volume_root and os.path.isdir(self.volume_root):
+            shutil.rmtree(self.volume_root)
+
+    # Generated state
+
+    def populate(self, nodes=1000, pods=20000, namespaces=20, replicas=10, fill=0.85, volume_pods=0):
+        """Boot `nodes` nodes and fill them to about `fill` of their CPU and memory with `pods` running pods.
+
+        Pods belong to deployments of `replicas` each, spread over `namespaces`
+        namespaces with a service and a config map per deployment. The first
+        `volume_pods` pods are standalone pods with a /data volume, like the
+        stateful pods the DR monitor backs up.
+        """
+        capacity_cpu = cpu_cores(self.node_capacity['cpu'])
+        capacity_memory = memory_bytes(self.node_capacity['memory'])
+        workers = max(1, nodes - 1)
+        per_node = max(1, -(-pods // workers))
+        cpu_m = max(10, int(capacity_cpu * fill / per_node * 1000))
+        memory_mi = max(16, int(capacity_memory * fill / per_node / 2 ** 20))
+        requests = {'cpu': f"{cpu_m}m", 'memory': f"{memory_mi}Mi"}
+
+        with self.lock:
+            self.boot(nodes)
+            worker_names = [name for name in sorted(self._objects['nodes']) if name != self.profile]
+            for i in range(namespaces):
+                self.create(BY_KIND['Namespace'], {'metadata': {'name': f"team-{i:02d}"}, 'status': {'phase': 'Active'}})
+            placed = 0
+            for i in range(volume_pods):
+                namespace = f"team-{i % namespaces:02d}"
+                pod = self._pod_body(f"stateful-{i:04d}", namespace, {'app': f"stateful-{i:04d}"}, requests, volume=True)
+                self._bind(self.create(PODS, pod), worker_names[placed % len(worker_names)])
+                placed += 1
+            deployment = 0
+            while placed < pods:
+                count = min(replicas, pods - placed)
+                namespace = f"team-{deployment % namespaces:02d}"
+                name = f"app-{deployment:05d}"
+                self.create(BY_KIND['ConfigMap'], {'metadata': {'name': f"{name}-config", 'namespace': namespace},
+                                                   'data': {'LOG_LEVEL': 'info'}})
+                self.create(BY_KIND['Service'], {
+                    'metadata': {'name': name, 'namespace': namespace},
+                    'spec': {'selector': {'app': name}, 'ports': [{'port': 80, 'protocol': 'TCP'}],
+                             'clusterIP': f"10.96.{deployment // 250}.{deployment % 250 + 2}"},
+                })
+                self.create_deployment(namespace, name, count, requests)
+                rs = self._replicaset_for(self._objects['deployments'][f"{namespace}/{name}"])
+                for _ in range(count):
+                    pod = self._pod_from(rs)
+                    self._bind(self.create(PODS, pod), worker_names[placed % len(worker_names)])
+                    placed += 1
+                deployment += 1
+            self._dirty_owners.clear()  # everything was created complete
+
+    def create_deployment(self, namespace, name, replicas, requests):
+        return self.create(DEPLOYMENTS, {
+            'metadata': {'name': name, 'namespace': namespace, 'labels': {'app': name}},
+            'spec': {
+                'replicas': replicas,
+                'selector': {'matchLabels': {'app': name}},
+                'template': self._pod_body(None, None, {'app': name}, requests),
+            },
+        })
+
+    def _pod_body(self, name, namespace, labels, requests, volume=False):
+        container = {'name': 'app', 'image': 'nginx:1.27', 'resources': {'requests': dict(requests)}}
+        spec = {'containers': [container], 'restartPolicy': 'Always'}
+        if volume:
+            container['volumeMounts'] = [{'name': 'data', 'mountPath': '/data'}]
+            spec['volumes'] = [{'name': 'data', 'emptyDir': {}}]
+        metadata = {'labels': dict(labels)}
+        if name:
+            metadata.update(name=name, namespace=namespace)
+        return {'metadata': metadata, 'spec': spec}
+
+    def _replicaset_for(self, deployment):
+        """The deployment's replicaset for its current template, created if missing"""
+        template = deployment['spec']['template']
+        digest = hashlib.sha1(json.dumps(template, sort_keys=True).encode()).hexdigest()[:10]
+        namespace = deployment['metadata']['namespace']
+        name = f"{deployment['metadata']['name']}-{digest}"
+        rs = self._objects['replicasets'].get(f"{namespace}/{name}")
+        replicas = deployment['spec'].get('replicas', 1)
+        if rs is None:
+            rs = self.create(REPLICASETS, {
+                'metadata': {
+                    'name': name, 'namespace': namespace, 'labels': dict(template['metadata'].get('labels', {})),
+                    'ownerReferences': [self._owner_ref(deployment)],
+                },
+                'spec': {'replicas': replicas, 'selector': deployment['spec']['selector'], 'template': template},
+            })
+        elif rs['spec'].get('replicas') != replicas:
+            rs = self.patch(REPLICASETS, namespace, name, {'spec': {'replicas': replicas}})
+        return rs
+
+    @staticmethod
+    def _owner_ref(owner):
+        return {'apiVersion': owner['apiVersion'], 'kind': owner['kind'], 'name': owner['metadata']['name'],
+                'uid': owner['metadata']['uid'], 'controller': True, 'blockOwnerDeletion': True}
+
+    def _pod_from(self, rs):
+        pod = copy.deepcopy(rs['spec']['template'])
+        pod['metadata']['name'] = f"{rs['metadata']['name']}-{self._suffix()}"
+        pod['metadata']['namespace'] = rs['metadata']['namespace']
+        pod['metadata']['ownerReferences'] = [self._owner_ref(rs)]
+        return pod
+
+    def _bind(self, pod, node):
+        def run(obj):
+            obj['spec']['nodeName'] = node
+            obj['status'] = {
+                'phase': 'Running',
+                'hostIP': '192.168.49.2',
+                'podIP': f"10.244.{self.random.randrange(256)}.{self.random.randrange(1, 255)}",
+                'startTime': now_iso(),
+                'conditions': [{'type': 'Ready', 'status': 'True'}, {'type': 'PodScheduled', 'status': 'True'}],
+                'containerStatuses': [{'name': c['name'], 'ready': True, 'restartCount': 0, 'image': c['image'],
+                                       'imageID': f"docker.io/library/{c['image']}",
+                                       'state': {'running': {'startedAt': now_iso()}}} for c in obj['spec']['containers']],
+            }
+            return obj
+        return self.update(PODS, pod['metadata']['namespace'], pod['metadata']['name'], run)
+
+    # Scenarios
+
+    def pending_burst(self, count, cpu='1', namespace='burst', name='burst'):
+        """A deployment of `count` pods that do not fit on the current nodes; returns its namespace and name"""
+        with self.lock:
+            if namespace not in self._objects['namespaces']:
+                self.create(BY_KIND['Namespace'], {'metadata': {'name': namespace}, 'status': {'phase': 'Active'}})
+            self.create_deployment(namespace, name, count, {'cpu': cpu, 'memory': '64Mi'})
+        return namespace, name
+
+    def cpu_spike(self, count, percent=97.0):
+        """Push `count` random workers to `percent` CPU; returns their names"""
+        with self.lock:
+            workers = [name for name in sorted(self._objects['nodes']) if name != self.profile]
+            spiked = self.random.sample(workers, min(count, len(workers)))
+            for name in spiked:
+                self.cpu_spikes[name] = percent
+        return spiked
+
+    def calm(self):
+        with self.lock:
+            self.cpu_spikes.clear()
+
+    def podman_stats(self):
+        """Rows of `podman stats --format json` for the node containers"""
+        with self.lock:
+            if not self.running:
+                return []
+            nodes = sorted(self._objects['nodes'])
+            capacity = memory_bytes(self.node_capacity['memory'])
+            rows = []
+            for name in nodes:
+                cpu = self.cpu_spikes.get(name, self.cpu_base.get(name, 20.0)) + self.random.uniform(-2, 2)
+                used = self._used.get(name, [0.0, 0, 0])[1]
+                rows.append({
+                    'id': hashlib.sha256(name.encode()).hexdigest()[:12],
+                    'name': name,
+                    'cpu_percent': f"{max(0.0, cpu):.2f}%",
+                    'mem_usage': f"{used / 1e9:.3f}GB / {capacity / 1e9:.3f}GB",
+                    'mem_percent': f"{100 * used / capacity:.2f}%",
+                    'cpu_time': '1h2m3.5s',
+                })
+        return rows
+
+    def containers(self):
+        """{name: container id} of the running node containers"""
+        with self.lock:
+            if not self.running:
+                return {}
+            return {name: hashlib.sha256(name.encode()).hexdigest() for name in self._objects['nodes']}
+
+    def record_spawn(self, argv):
+        with self.lock:
+            self.spawns.append((time.time(), list(argv)))
+
+    def spawns_since(self, since, *prefix):
+        with self.lock:
+            return [(when, argv) for when, argv in self.spawns if when >= since and argv[:len(prefix)] == list(prefix)]
+
+    # Simulated controllers
+
+    def start_controllers(self, tick=0.1):
+        self._tick = tick
+        self._thread = threading.Thread(target=self._run, name='sim-controllers', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_controllers(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self._tick):
+            with self.lock:
+                if not self.running:
+                    continue
+                self._boot_nodes()
+                self._reconcile_owners()
+                self._schedule()
+
+    def _boot_nodes(self):
+        now = time.time()
+        for name, ready_at in list(self._booting.items()):
+            if ready_at <= now and name in self._objects['nodes']:
+                del self._booting[name]
+                self.patch(NODES, None, name, {'status': {'conditions': [
+                    {'type': 'Ready', 'status': 'True', 'reason': 'KubeletReady'}]}})
+
+    def _reconcile_owners(self):
+        dirty, self._dirty_owners = self._dirty_owners, set()
+        by_uid = None
+        for plural, uid in dirty:
+            if by_uid is None:
+                by_uid = {obj['metadata']['uid']: obj for kind in ('deployments', 'replicasets')
+                          for obj in self._objects[kind].values()}
+            owner = by_uid.get(uid)
+            if owner is None:
+                continue
+            if owner['kind'] == 'Deployment':
+                self._replicaset_for(owner)
+                continue
+            owned = sorted(self._owned.get(uid, ()))
+            want = owner['spec'].get('replicas', 1)
+            for _ in range(want - len(owned)):
+                self.create(PODS, self._pod_from(owner))
+            for key in owned[want:]:
+                namespace, name = key.split('/', 1)
+                self.delete(PODS, namespace, name)
+
+    def _schedule(self):
+        if not self._unbound:
+            return
+        nodes = [(node['metadata']['name'], node['metadata'].get('labels', {}), (
+                    cpu_cores(node['status']['allocatable']['cpu']),
+                    memory_bytes(node['status']['allocatable']['memory']),
+                    int(node['status']['allocatable']['pods'])))
+                 for node in self._objects['nodes'].values()
+                 if node_ready(node) and not node['spec'].get('unschedulable')]
+        for key in sorted(self._unbound):
+            pod = self._objects['pods'].get(key)
+            if pod is None or self._attempted.get(key) == self._capacity_version:
+                continue  # nothing changed since it last failed to fit
+            cpu, memory = pod_requests(pod)
+            selector = pod['spec'].get('nodeSelector') or {}
+            reasons = Counter()
+            # Next fit: start where the last pod went, so placing a large batch does not rescan the full nodes
+            for offset in range(len(nodes)):
+                name, labels, (cpu_total, memory_total, pods_total) = nodes[(self._next_fit + offset) % len(nodes)]
+                if any(labels.get(k) != v for k, v in selector.items()):
+                    reasons["node(s) didn't match Pod's node affinity/selector"] += 1
+                    continue
+                used = self._used.get(name, [0.0, 0, 0])
+                if used[0] + cpu > cpu_total + 1e-9:
+                    reasons['Insufficient cpu'] += 1
+                elif used[1] + memory > memory_total:
+                    reasons['Insufficient memory'] += 1
+                elif used[2] + 1 > pods_total:
+                    reasons['Too many pods'] += 1
+                else:
+                    self._next_fit = (self._next_fit + offset) % len(nodes)
+                    self._attempted.pop(key, None)
+                    self._bind(pod, name)
+                    break
+            else:
+                unschedulable = len(self._objects['nodes']) - len(nodes)
+                if unschedulable:
+                    reasons['node(s) were unschedulable'] += unschedulable
+                self._attempted[key] = self._capacity_version
+                self._record_failed(key, pod, len(self._objects['nodes']), reasons)
+
+    def _record_failed(self, key, pod, total, reasons):
+        detail = ', '.join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+        message = (f"0/{total} nodes are available: {detail}. preemption: 0/{total} nodes are available: "
+                   f"{total} No preemption victims found for incoming pod.")
+        previous = self._failed.get(key)
+        now = time.time()
+        if previous is not None and previous[1] == message and now - previous[2] < 30:
+            return  # the scheduler backs off before reporting the same failure again
+        namespace, name = key.split('/', 1)
+        if previous is None or f"{namespace}/{previous[0]}" not in self._objects['events']:
+            event = self.create(EVENTS, {
+                'metadata': {'name': f"{name}.{uuid.UUID(int=self.random.getrandbits(128)).hex[:16]}", 'namespace': namespace},
+                'involvedObject': {'kind': 'Pod', 'name': name, 'namespace': namespace, 'uid': pod['metadata']['uid']},
+                'reason': 'FailedScheduling', 'message': message, 'type': 'Warning', 'count': 1,
+                'firstTimestamp': now_iso(now), 'lastTimestamp': now_iso(now),
+                'source': {'component': 'default-scheduler'},
+            })
+            event_name = event['metadata']['name']
+        else:
+            event_name = previous[0]
+            self.update(EVENTS, namespace, event_name, lambda e: dict(
+                e, message=message, count=e.get('count', 1) + 1, lastTimestamp=now_iso(now)))
+        self._failed[key] = (event_name, message, now)
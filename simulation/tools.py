@@ -0,0 +1,294 @@
+"""Fake kubectl, minikube and podman backed by the simulated API server.
+
+The executables in simulation/bin call main() with their own name. Each run
+is reported to the simulator first (POST /sim/spawn), so the benchmark can
+count process spawns per command. They find the server through SIM_URL and
+keep pod volumes under SIM_VOLUMES/<namespace>/<pod>, where `kubectl exec`
+runs the requested command with the volume paths mapped into that directory.
+
+Only the subcommands and flags the operators use are implemented; anything
+else fails with exit status 2, like a usage error would.
+"""
+import json
+import os
+import sys
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+SIM_URL = os.environ.get('SIM_URL', 'http://127.0.0.1:8001')
+SIM_VOLUMES = os.environ.get('SIM_VOLUMES', '')
+
+
+class UsageError(Exception):
+    pass
+
+
+def call(method, path, body=None, content_type='application/json'):
+    """(status, decoded JSON body) of one request to the simulator"""
+    data = None if body is None else json.dumps(body).encode()
+    request = Request(SIM_URL + path, data=data, method=method, headers={'Content-Type': content_type})
+    try:
+        with urlopen(request, timeout=600) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except HTTPError as e:
+        return e.code, json.loads(e.read() or b'null')
+    except OSError as e:
+        return 503, {'message': str(e)}
+
+
+def take_flag(args, *names, default=None):
+    """Remove `--name value`, `--name=value` or `-n value` from args and return the value"""
+    for i, arg in enumerate(args):
+        for name in names:
+            if arg == name and i + 1 < len(args):
+                value = args[i + 1]
+                del args[i:i + 2]
+                return value
+            if arg.startswith(name + '=') and name.startswith('--'):
+                del args[i]
+                return arg.split('=', 1)[1]
+    return default
+
+
+def take_switch(args, *names):
+    found = False
+    for name in names:
+        while name in args:
+            args.remove(name)
+            found = True
+    return found
+
+
+# kubectl
+
+def discover():
+    """{name, singular or kind (lower case): (path prefix, namespaced, kind)} like kubectl's discovery"""
+    prefixes = ['/api/v1']
+    _, groups = call('GET', '/apis')
+    for group in groups['groups']:
+        prefixes.append(f"/apis/{group['preferredVersion']['groupVersion']}")
+    resources = {}
+    for prefix in prefixes:
+        _, document = call('GET', prefix)
+        for resource in document['resources']:
+            if '/' in resource['name']:
+                continue
+            entry = (prefix, resource['name'], resource['namespaced'], resource['kind'])
+            for alias in (resource['name'], resource['singularName'], resource['kind'].lower()):
+                resources.setdefault(alias, entry)
+    return resources
+
+
+def resource_path(entry, namespace=None, name=None):
+    prefix, plural, namespaced, _ = entry
+    path = prefix + (f"/namespaces/{namespace}" if namespaced and namespace else '') + f"/{plural}"
+    return path + (f"/{name}" if name else '')
+
+
+def kubectl(args):
+    if not args:
+        raise UsageError('kubectl: no command')
+    command, args = args[0], args[1:]
+    if command == 'version':
+        print('Client Version: v1.30.0-sim\nServer Version: v1.30.0')
+        return 0
+    if command == 'exec':
+        return kubectl_exec(args)
+    if command in ('cordon', 'uncordon'):
+        node = args[0]
+        status, body = call('PATCH', f"/api/v1/nodes/{node}", {'spec': {'unschedulable': command == 'cordon' or None}},
+                            'application/strategic-merge-patch+json')
+        return report(status, body, f"node/{node} {command}ed")
+    if command == 'get':
+        return kubectl_get(args)
+    if command == 'apply':
+        return kubectl_apply(args)
+    if command == 'delete':
+        namespace = take_flag(args, '-n', '--namespace', default='default')
+        entry = discover().get(args[0].lower())
+        if entry is None or len(args) < 2:
+            raise UsageError(f"kubectl delete: unsupported arguments {args}")
+        status, body = call('DELETE', resource_path(entry, namespace, args[1]))
+        return report(status, body, f'{entry[3].lower()} "{args[1]}" deleted')
+    raise UsageError(f"kubectl: unsupported command {command}")
+
+
+def report(status, body, message):
+    if status >= 400:
+        print(f"Error from server ({body.get('reason', status)}): {body.get('message', '')}", file=sys.stderr)
+        return 1
+    print(message)
+    return 0
+
+
+def kubectl_get(args):
+    all_namespaces = take_switch(args, '-A', '--all-namespaces')
+    namespace = take_flag(args, '-n', '--namespace', default='default')
+    output = take_flag(args, '-o', '--output', default='name')
+    query = []
+    selector = take_flag(args, '-l', '--selector')
+    if selector:
+        query.append(f"labelSelector={selector}")
+    field_selector = take_flag(args, '--field-selector')
+    if field_selector:
+        query.append(f"fieldSelector={field_selector}")
+    entry = discover().get(args[0].lower()) if args else None
+    if entry is None:
+        raise UsageError(f"kubectl get: unsupported arguments {args}")
+    name = args[1] if len(args) > 1 else None
+    path = resource_path(entry, None if all_namespaces else namespace, name)
+    status, body = call('GET', path + ('?' + '&'.join(query) if query else ''))
+    if status >= 400:
+        return report(status, body, '')
+    if output == 'json':
+        print(json.dumps(body if name else dict(body, kind='List', apiVersion='v1'), indent=2))
+    else:
+        for obj in [body] if name else body['items']:
+            print(f"{entry[3].lower()}/{obj['metadata']['name']}")
+    return 0
+
+
+def kubectl_apply(args):
+    filename = take_flag(args, '-f', '--filename')
+    if filename is None:
+        raise UsageError('kubectl apply: -f is required')
+    text = sys.stdin.read() if filename == '-' else open(filename).read()
+    try:
+        documents = [json.loads(text)]
+    except ValueError:
+        import yaml
+        documents = [doc for doc in yaml.safe_load_all(text) if doc]
+    objects = []
+    for document in documents:
+        objects.extend(document.get('items', []) if document.get('kind', '').endswith('List') else [document])
+    resources = discover()
+    failed = 0
+    for obj in objects:
+        entry = resources.get(obj['kind'].lower())
+        metadata = obj.get('metadata', {})
+        if entry is None:
+            print(f"error: resource mapping not found for kind {obj['kind']}", file=sys.stderr)
+            failed += 1
+            continue
+        path = resource_path(entry, metadata.get('namespace') or 'default', metadata['name'])
+        status, body = call('PATCH', path + '?fieldManager=kubectl', obj, 'application/apply-patch+yaml')
+        failed += report(status, body, f"{entry[3].lower()}/{metadata['name']} configured")
+    return 1 if failed else 0
+
+
+def kubectl_exec(args):
+    if '--' not in args:
+        raise UsageError('kubectl exec: expected -- before the command')
+    split = args.index('--')
+    options, command = args[:split], args[split + 1:]
+    namespace = take_flag(options, '-n', '--namespace', default='default')
+    take_flag(options, '-c', '--container')
+    take_switch(options, '-i', '--stdin', '-t', '--tty', '-it')
+    if len(options) != 1:
+        raise UsageError(f"kubectl exec: unsupported arguments {options}")
+    pod = options[0]
+    status, body = call('GET', f"/api/v1/namespaces/{namespace}/pods/{pod}")
+    if status >= 400:
+        return report(status, body, '')
+    if body['status'].get('phase') != 'Running':
+        print(f"error: cannot exec into a container in a completed pod; current phase is {body['status'].get('phase')}",
+              file=sys.stderr)
+        return 1
+    root = os.path.join(SIM_VOLUMES, namespace, pod)
+    os.makedirs(root, exist_ok=True)
+    command = map_paths(command, root)
+    sys.stdout.flush()
+    os.execvp(command[0], command)
+
+
+def map_paths(command, root):
+    """Point the absolute paths a command works on into the pod's directory"""
+    mapped = list(command)
+    if mapped[:2] == ['sh', '-c']:
+        # sh -c SCRIPT NAME ARG...: only the positional arguments are paths
+        for i in range(4, len(mapped)):
+            if mapped[i].startswith('/'):
+                mapped[i] = root + mapped[i]
+    else:
+        for i in range(1, len(mapped)):
+            if mapped[i - 1] == '-C' or (mapped[i].startswith('/') and mapped[i - 1] not in ('-f', '-T')):
+                mapped[i] = root + mapped[i]
+                if mapped[i - 1] == '-C':
+                    os.makedirs(mapped[i], exist_ok=True)
+    return mapped
+
+
+# minikube
+
+def minikube(args):
+    take_flag(args, '-p', '--profile')
+    command = args[0] if args else ''
+    if command == 'status':
+        output = take_flag(args, '-o', '--output', '--format', default='text')
+        _, status = call('GET', '/sim/status')
+        state = 'Running' if status['running'] else 'Stopped'
+        if output == 'json' or output.startswith('{'):
+            print(json.dumps({'Name': status['profile'], 'Host': state, 'Kubelet': state, 'APIServer': state,
+                              'Kubeconfig': 'Configured' if status['running'] else 'Misconfigured', 'Worker': False}))
+        else:
+            print(f"{status['profile']}\ntype: Control Plane\nhost: {state}\nkubelet: {state}\n"
+                  f"apiserver: {state}\nkubeconfig: {'Configured' if status['running'] else 'Misconfigured'}\n")
+        return 0 if status['running'] else 7
+    if command == 'start':
+        nodes = int(take_flag(args, '--nodes', '-n', default='1'))
+        status, body = call('POST', '/sim/start', {'nodes': nodes})
+        return report(status, body, f"Done! kubectl is now configured to use the simulated cluster ({nodes} nodes)")
+    if command in ('stop', 'delete'):
+        status, body = call('POST', f"/sim/{command}")
+        return report(status, body, f"{command}: done")
+    if command == 'node' and args[1:2] == ['add']:
+        status, body = call('POST', '/sim/nodes')
+        return report(status, body, f"Successfully added {body.get('name')} to the cluster")
+    if command == 'node' and args[1:2] == ['list']:
+        _, body = call('GET', '/sim/nodes')
+        for name in body['nodes']:
+            print(f"{name}\t192.168.49.2")
+        return 0
+    if command == 'ip':
+        print('192.168.49.2')
+        return 0
+    raise UsageError(f"minikube: unsupported arguments {args}")
+
+
+# podman
+
+def podman(args):
+    command = args[0] if args else ''
+    if command == 'stats':
+        output = take_flag(args, '--format', default='table')
+        _, rows = call('GET', '/sim/podman/stats')
+        if output == 'json':
+            print(json.dumps(rows, indent=1))
+        else:
+            print(f"{'ID':<14}{'NAME':<24}{'CPU %':<10}{'MEM USAGE / LIMIT':<24}{'MEM %':<10}{'CPU TIME':<12}")
+            for row in rows:
+                print(f"{row['id']:<14}{row['name']:<24}{row['cpu_percent']:<10}{row['mem_usage']:<24}"
+                      f"{row['mem_percent']:<10}{row['cpu_time']:<12}")
+        return 0
+    if command == 'ps':
+        output = take_flag(args, '--format', default=None)
+        _, containers = call('GET', '/sim/podman/ps')
+        for name, container_id in sorted(containers.items()):
+            if output:
+                print(output.replace('{{.ID}}', container_id).replace('{{.Names}}', name))
+            else:
+                print(f"{container_id[:12]}  {name}")
+        return 0
+    raise UsageError(f"podman: unsupported arguments {args}")
+
+
+TOOLS = {'kubectl': kubectl, 'minikube': minikube, 'podman': podman}
+
+
+def main(tool, args):
+    call('POST', '/sim/spawn', {'argv': [tool] + args})
+    try:
+        return TOOLS[tool](list(args))
+    except UsageError as e:
+        print(e, file=sys.stderr)
+        return 2
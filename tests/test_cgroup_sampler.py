@@ -0,0 +1,112 @@
+"""CgroupSampler against a fixture cgroup v2 tree, with a fake podman and clock."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import node_temperature_controller as temperature
+
+WORKER_ID = "a1" * 32
+CONTROL_ID = "b2" * 32
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class CgroupSamplerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="cgroup-")
+        self.addCleanup(shutil.rmtree, self.root)
+        self.containers = {"minikube": CONTROL_ID, "minikube-m02": WORKER_ID}
+        self.clock = FakeClock()
+        self.sampler = temperature.CgroupSampler(self.root, lambda: dict(self.containers), self.clock)
+        self.addCleanup(self.sampler.close)
+
+        self.control = self.make_cgroup(f"machine.slice/libpod-{CONTROL_ID}.scope", usage=5_000_000, memory=1024)
+        self.worker = self.make_cgroup(f"machine.slice/libpod-{WORKER_ID}", usage=1_000_000)
+        # The node's own pods live below its container; they must not be mistaken for nodes
+        self.make_cgroup(f"machine.slice/libpod-{WORKER_ID}/kubepods/libpod-{CONTROL_ID}.scope", usage=0)
+        # A container that is not a minikube node
+        self.make_cgroup("machine.slice/libpod-" + "c3" * 32 + ".scope", usage=0)
+
+    def make_cgroup(self, relative, usage, memory=None):
+        path = os.path.join(self.root, relative)
+        os.makedirs(path, exist_ok=True)
+        self.write_usage(path, usage)
+        if memory is not None:
+            with open(os.path.join(path, "memory.current"), "w") as f:
+                f.write(f"{memory}\n")
+        return path
+
+    def write_usage(self, path, usage):
+        # Rewritten in place, as the kernel does, so the sampler's open fd sees the new value
+        with open(os.path.join(path, "cpu.stat"), "w") as f:
+            f.write(f"usage_usec {usage}\nuser_usec {usage // 2}\nsystem_usec {usage // 2}\n")
+
+    def test_discovers_node_containers_only(self):
+        self.assertTrue(self.sampler.available())
+        self.assertEqual(self.sampler._paths, {
+            "minikube": os.path.join(self.root, f"machine.slice/libpod-{CONTROL_ID}.scope"),
+            "minikube-m02": os.path.join(self.root, f"machine.slice/libpod-{WORKER_ID}"),
+        })
+
+    def test_percent_from_usage_delta(self):
+        self.assertEqual(self.sampler.sample(), {})  # the first sample only sets the baseline
+
+        self.clock.now += 2.0
+        self.write_usage(self.control, 5_000_000 + 3_000_000)  # 1.5 CPUs over 2s
+        self.write_usage(self.worker, 1_000_000 + 500_000)  # a quarter of a CPU
+        self.assertEqual(self.sampler.sample(), {
+            "minikube": {"cpu": 150.0, "memory_bytes": 1024},
+            "minikube-m02": {"cpu": 25.0, "memory_bytes": None},
+        })
+
+        self.clock.now += 0.5
+        self.write_usage(self.worker, 1_500_000 + 100_000)
+        self.assertEqual(self.sampler.sample()["minikube-m02"]["cpu"], 20.0)
+        self.assertEqual(self.sampler.sample(), {})  # no time has passed
+
+    def test_counter_reset_is_not_negative(self):
+        self.sampler.sample()
+        self.clock.now += 1.0
+        self.write_usage(self.worker, 0)  # container restarted in place
+        self.assertEqual(self.sampler.sample()["minikube-m02"]["cpu"], 0.0)
+
+    def test_container_unreadable_between_samples(self):
+        self.sampler.sample()
+        self.clock.now += 1.0
+        with open(os.path.join(self.worker, "cpu.stat"), "w"):
+            pass  # what a removed cgroup reads as: no usage_usec
+        self.write_usage(self.control, 5_000_000 + 1_000_000)
+
+        self.assertEqual(self.sampler.sample(), {"minikube": {"cpu": 100.0, "memory_bytes": 1024}})
+        self.assertNotIn("minikube-m02", self.sampler._files)
+
+    def test_container_removed_and_recreated(self):
+        self.sampler.sample()
+        del self.containers["minikube-m02"]
+        shutil.rmtree(self.worker)
+        self.clock.now += temperature.DISCOVERY_INTERVAL
+        self.assertEqual(set(self.sampler.sample()), {"minikube"})
+        self.assertEqual(set(self.sampler._files), {"minikube"})
+
+        # The node comes back under a new container id: a new baseline, not a delta from the old one
+        new_id = "d4" * 32
+        self.containers["minikube-m02"] = new_id
+        path = self.make_cgroup(f"machine.slice/libpod-{new_id}.scope", usage=9_000_000)
+        self.clock.now += temperature.DISCOVERY_INTERVAL
+        self.assertEqual(set(self.sampler.sample()), {"minikube"})
+        self.clock.now += 1.0
+        self.write_usage(path, 9_000_000 + 250_000)
+        self.assertEqual(self.sampler.sample()["minikube-m02"], {"cpu": 25.0, "memory_bytes": None})
+
+
+if __name__ == "__main__":
+    unittest.main()